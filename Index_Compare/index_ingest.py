@@ -0,0 +1,230 @@
+# 指数行情增量下载（并发 + 限速 + 重试）
+#
+# 每个指数只请求数据库中最后日期之后的数据，多个指数并发调用 pro.index_daily，
+# 受每分钟调用次数限制，失败时按指数退避重试；全部下载完成后在一个事务中用
+# INSERT OR REPLACE 写入数据库。
+#
+# pro 可以是 tushare.pro_api() 返回的对象，也可以是任何实现了
+# index_daily(ts_code=..., start_date=..., end_date=...) -> DataFrame 的对象，
+# 例如本文件中的 FakeProApi（本地假数据，用于演练和检查下载流程）。
+#
+# 命令行：
+#   python index_ingest.py --fake --db test_index.db --fail-prob 0.3
+#   python index_ingest.py --token YOUR_TUSHARE_TOKEN
+
+import argparse
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import shared_path  # noqa: F401  把 MyBacktrader 加到 sys.path，使用其中的 db_access
+from db_access import write_connection
+
+# 配置参数
+DB_NAME = 'index_data.db'
+TABLE_NAME = 'index'
+START_DATE = '20240101'
+CALLS_PER_MINUTE = 100   # tushare 接口的每分钟调用上限，按账号权限调整
+MAX_WORKERS = 4
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 2.0    # 第 n 次重试前等待 BACKOFF_SECONDS * 2**n 秒
+
+COLUMNS = ['ts_code', 'trade_date', 'close']
+
+# 常用指数代码列表
+INDEX_DICT = {
+    '上证综指': '000001.SH',
+    '沪深300': '000300.SH',
+    '中证500': '000905.SH',
+    '中证1000': '000852.SH',
+    '中证2000': '000933.SH',
+    '创业板指': '399006.SZ',
+    '科创50': '000688.SH'
+}
+
+
+class RateLimiter:
+    """滑动窗口限速：任意 period 秒内最多 max_calls 次调用，可在多个线程间共享。"""
+
+    def __init__(self, max_calls=CALLS_PER_MINUTE, period=60.0, clock=time.monotonic, sleep=time.sleep):
+        self.max_calls = max_calls
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.max_calls:
+            return
+        while True:
+            with self.lock:
+                now = self.clock()
+                while self.calls and now - self.calls[0] >= self.period:
+                    self.calls.popleft()
+                if len(self.calls) < self.max_calls:
+                    self.calls.append(now)
+                    return
+                wait = self.period - (now - self.calls[0])
+            self.sleep(wait)
+
+
+class FakeProApi:
+    """
+    本地假数据源，接口与 tushare pro.index_daily 相同。
+    收盘价由 (ts_code, 日期) 确定地生成，多次请求同一天得到相同数值；
+    fail_prob 为每次调用抛出异常的概率，用于演练重试。
+    """
+
+    def __init__(self, fail_prob=0.0, latency=0.0, seed=0):
+        self.fail_prob = fail_prob
+        self.latency = latency
+        self.rng = np.random.default_rng(seed)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def index_daily(self, ts_code, start_date, end_date):
+        with self.lock:
+            self.calls += 1
+            fail = self.rng.random() < self.fail_prob
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise IOError(f"模拟接口错误: {ts_code}")
+        dates = pd.bdate_range(pd.to_datetime(start_date, format='%Y%m%d'),
+                               pd.to_datetime(end_date, format='%Y%m%d'))
+        phase = zlib.crc32(ts_code.encode()) % 1000
+        days = (dates - pd.Timestamp('2000-01-01')).days.to_numpy()
+        close = 1000.0 + phase + 200.0 * np.sin(days / 60.0 + phase) + days * 0.05
+        df = pd.DataFrame({'ts_code': ts_code, 'trade_date': dates.strftime('%Y%m%d'), 'close': close.round(4)})
+        return df.iloc[::-1].reset_index(drop=True)  # 与 tushare 一样按日期倒序返回
+
+
+def create_index_table(conn, table=TABLE_NAME):
+    # index 是 SQL 关键字，表名需要加引号
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS "{table}" (
+            ts_code TEXT,
+            trade_date TEXT,
+            close REAL,
+            PRIMARY KEY (ts_code, trade_date)
+        )
+    ''')
+    conn.commit()
+
+
+def next_start_dates(conn, codes, table=TABLE_NAME, start_date=START_DATE):
+    """每个指数需要下载的起始日期：数据库最后日期的下一天，没有数据时为 start_date。"""
+    latest = dict(conn.execute(f'SELECT ts_code, MAX(trade_date) FROM "{table}" GROUP BY ts_code').fetchall())
+    starts = {}
+    for code in codes:
+        if latest.get(code):
+            starts[code] = (datetime.strptime(latest[code], '%Y%m%d') + timedelta(days=1)).strftime('%Y%m%d')
+        else:
+            starts[code] = start_date
+    return starts
+
+
+def fetch_index(pro, ts_code, start_date, end_date, limiter, max_retries=MAX_RETRIES,
+                backoff=BACKOFF_SECONDS, sleep=time.sleep):
+    """下载一个指数的日线，失败时指数退避重试，重试用尽后抛出最后一次的异常。"""
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            df = pro.index_daily(ts_code=ts_code, start_date=start_date, end_date=end_date)
+        except Exception:
+            if attempt == max_retries:
+                raise
+            sleep(backoff * 2 ** attempt)
+            continue
+        if df is None or df.empty:
+            return pd.DataFrame(columns=COLUMNS)
+        return df[COLUMNS]
+
+
+def upsert_rows(conn, frames, table=TABLE_NAME):
+    """把多个 DataFrame 在一个事务中写入（主键冲突时覆盖），返回写入行数。"""
+    rows = [row for df in frames for row in df[COLUMNS].itertuples(index=False, name=None)]
+    with conn:
+        conn.executemany(f'INSERT OR REPLACE INTO "{table}" (ts_code, trade_date, close) VALUES (?, ?, ?)', rows)
+    return len(rows)
+
+
+def ingest_indices(pro, index_dict, db_name=DB_NAME, table=TABLE_NAME, start_date=START_DATE, end_date=None,
+                   calls_per_minute=CALLS_PER_MINUTE, max_workers=MAX_WORKERS, max_retries=MAX_RETRIES,
+                   backoff=BACKOFF_SECONDS, progress=None, sleep=time.sleep):
+    """
+    增量下载 index_dict（名称 -> ts_code）中的全部指数并写入数据库。
+
+    progress(done, total, name, message) 在每个指数完成（或失败）后调用，调用发生在
+    执行本函数的线程中；GUI 应在后台线程中运行本函数，并通过队列把进度交给主线程。
+    返回 {'inserted': 写入行数, 'fetched': {名称: 行数}, 'failed': {名称: 错误信息}}。
+    """
+    end_date = end_date or datetime.today().strftime('%Y%m%d')
+    with write_connection(db_name) as conn:
+        create_index_table(conn, table)
+        starts = next_start_dates(conn, index_dict.values(), table, start_date)
+
+    todo = {name: code for name, code in index_dict.items() if starts[code] <= end_date}
+    total = len(index_dict)
+    done = total - len(todo)
+    if progress:
+        for name in index_dict:
+            if name not in todo:
+                progress(done, total, name, '已是最新')
+
+    limiter = RateLimiter(calls_per_minute, sleep=sleep)
+    frames, fetched, failed = [], {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(fetch_index, pro, code, starts[code], end_date, limiter,
+                               max_retries, backoff, sleep): name
+                   for name, code in todo.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            done += 1
+            try:
+                df = future.result()
+            except Exception as e:
+                failed[name] = str(e)
+                message = f"失败: {e}"
+            else:
+                frames.append(df)
+                fetched[name] = len(df)
+                message = f"{len(df)} 条"
+            if progress:
+                progress(done, total, name, message)
+
+    with write_connection(db_name) as conn:
+        inserted = upsert_rows(conn, frames, table)
+    return {'inserted': inserted, 'fetched': fetched, 'failed': failed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='指数行情增量下载')
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--table', default=TABLE_NAME)
+    parser.add_argument('--start', default=START_DATE)
+    parser.add_argument('--end', default=None, help='默认为今天')
+    parser.add_argument('--calls-per-minute', type=int, default=CALLS_PER_MINUTE)
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    parser.add_argument('--token', default=None, help='tushare token')
+    parser.add_argument('--fake', action='store_true', help='使用本地假数据源 FakeProApi')
+    parser.add_argument('--fail-prob', type=float, default=0.0, help='假数据源每次调用失败的概率')
+    args = parser.parse_args()
+
+    if args.fake:
+        pro = FakeProApi(fail_prob=args.fail_prob)
+    else:
+        import tushare as ts
+        pro = ts.pro_api(args.token)
+
+    stats = ingest_indices(pro, INDEX_DICT, args.db, args.table, args.start, args.end,
+                           calls_per_minute=args.calls_per_minute, max_workers=args.workers,
+                           progress=lambda done, total, name, message: print(f"[{done}/{total}] {name}: {message}"))
+    print(f"写入 {stats['inserted']} 条，失败 {len(stats['failed'])} 个指数")
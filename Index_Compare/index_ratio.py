@@ -1,89 +1,75 @@
 # 指数比值分析系统（使用数据库 + Tkinter GUI + 可变均线周期）
 
 import tushare as ts
-import pandas as pd
-import sqlite3
-import os
 import matplotlib.pyplot as plt
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
-from datetime import datetime
+from index_ingest import DB_NAME, INDEX_DICT, START_DATE, TABLE_NAME, ingest_indices
+from ratio_engine import MA_WINDOWS, export_all_pairs, get_ratio_tables, invalidate
 
 # 配置 tushare
 TOKEN = 'YOUR_TUSHARE_TOKEN_HERE'  # <<< 替换为你的 token
 ts.set_token(TOKEN)
 pro = ts.pro_api()
 
-# 配置参数
-DB_NAME = 'index_data.db'
-TABLE_NAME = 'index'
-START_DATE = '20240101'
-TODAY = datetime.today().strftime('%Y%m%d')
-
-# 常用指数代码列表
-INDEX_DICT = {
-    '上证综指': '000001.SH',
-    '沪深300': '000300.SH',
-    '中证500': '000905.SH',
-    '中证1000': '000852.SH',
-    '中证2000': '000933.SH',
-    '创业板指': '399006.SZ',
-    '科创50': '000688.SH'
-}
-
-# 创建数据库表结构
-def create_index_table():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute(f'''
-        CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-            ts_code TEXT,
-            trade_date TEXT,
-            close REAL,
-            PRIMARY KEY (ts_code, trade_date)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# 下载并更新指数数据
-def update_index_data():
-    create_index_table()
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    for name, ts_code in INDEX_DICT.items():
-        latest = cursor.execute(f"SELECT MAX(trade_date) FROM {TABLE_NAME} WHERE ts_code = ?", (ts_code,)).fetchone()[0]
-        start = latest if latest else START_DATE
-        df = pro.index_daily(ts_code=ts_code, start_date=start, end_date=TODAY)
-        if df.empty:
+# 数据库、起始日期和指数列表见 index_ingest.py
+
+# 后台任务：work(progress) 在后台线程中运行，进度和结果经队列交给主线程，界面不会卡住；
+# 运行期间 button 不可用，结束后在主线程调用 on_done(kind, payload)，kind 为 'done' 或 'error'
+def run_in_background(work, on_done, button):
+    button.config(state='disabled')
+    events = queue.Queue()
+
+    def worker():
+        try:
+            events.put(('done', work(lambda message: events.put(('progress', message)))))
+        except Exception as e:
+            events.put(('error', str(e)))
+
+    threading.Thread(target=worker, daemon=True).start()
+    root.after(100, poll_events, events, on_done, button)
+
+def poll_events(events, on_done, button):
+    while True:
+        try:
+            kind, payload = events.get_nowait()
+        except queue.Empty:
+            root.after(100, poll_events, events, on_done, button)
+            return
+        if kind == 'progress':
+            status_var.set(payload)
             continue
-        df = df[['ts_code', 'trade_date', 'close']]
-        df.to_sql(TABLE_NAME, conn, if_exists='append', index=False, method='multi')
-    conn.close()
-    messagebox.showinfo("更新完成", "指数数据已更新到数据库。")
-
-# 从数据库中读取指数数据
-def load_index_data(ts_code):
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query(f"SELECT trade_date, close FROM {TABLE_NAME} WHERE ts_code = ? ORDER BY trade_date", conn, params=(ts_code,))
-    conn.close()
-    df['trade_date'] = pd.to_datetime(df['trade_date'])
-    df.set_index('trade_date', inplace=True)
-    return df
-
-# 绘图函数
+        button.config(state='normal')
+        on_done(kind, payload)
+        return
+
+# 下载并更新指数数据：在后台线程中增量下载
+def update_index_data():
+    status_var.set("开始下载...")
+    run_in_background(
+        lambda progress: ingest_indices(pro, INDEX_DICT, DB_NAME, TABLE_NAME, START_DATE,
+                                        progress=lambda done, total, name, message:
+                                        progress(f"[{done}/{total}] {name}: {message}")),
+        finish_update, btn_download)
+
+def finish_update(kind, payload):
+    if kind == 'done' and payload['inserted']:
+        invalidate()  # 新数据写入后重新计算比值缓存
+    if kind == 'error':
+        status_var.set("下载失败")
+        messagebox.showerror("更新失败", payload)
+    elif payload['failed']:
+        status_var.set(f"写入 {payload['inserted']} 条，{len(payload['failed'])} 个指数失败")
+        messagebox.showwarning("部分更新失败", "\n".join(f"{k}: {v}" for k, v in payload['failed'].items()))
+    else:
+        status_var.set(f"更新完成，写入 {payload['inserted']} 条")
+        messagebox.showinfo("更新完成", "指数数据已更新到数据库。")
+
+# 绘图函数：比值和均线取自比值引擎的缓存（全部指数对、全部均线周期已预先算好）
 def plot_ratio(numerator_code, denominator_code, ma_days):
-    df_n = load_index_data(numerator_code)
-    df_d = load_index_data(denominator_code)
-    df = pd.DataFrame()
-    df['n'] = df_n['close']
-    df['d'] = df_d['close']
-    df.dropna(inplace=True)
-
-    # 比值及均线
-    df['ratio'] = df['n'] / df['d']
-    df['ma'] = df['ratio'].rolling(window=ma_days).mean()
-    df['位置'] = df.apply(lambda x: '上方' if x['ratio'] > x['ma'] else '下方', axis=1)
+    df = get_ratio_tables(DB_NAME, TABLE_NAME).pair_frame(numerator_code, denominator_code, ma_days)
 
     # 保存 CSV
     export = df[['n', 'd', 'ratio', 'ma', '位置']].copy()
@@ -120,7 +106,7 @@ denominator_cb.grid(row=1, column=1)
 
 label3 = tk.Label(root, text="选择均线天数")
 label3.grid(row=2, column=0)
-ma_cb = ttk.Combobox(root, values=[5, 10, 20, 30, 60, 120, 240])
+ma_cb = ttk.Combobox(root, values=list(MA_WINDOWS))
 ma_cb.set(20)
 ma_cb.grid(row=2, column=1)
 
@@ -143,4 +129,26 @@ btn_plot.grid(row=3, column=0, columnspan=2, pady=10)
 btn_download = tk.Button(root, text="下载/更新数据", command=update_index_data, bg="skyblue")
 btn_download.grid(row=4, column=0, columnspan=2, pady=10)
 
+# 导出全部比值：全部指数对 x 全部均线周期的长表较大，与下载一样在后台线程中计算和写出
+def on_export_all():
+    status_var.set("正在导出全部比值...")
+    run_in_background(
+        lambda progress: export_all_pairs('index_ratio_all_pairs.csv', DB_NAME, TABLE_NAME, INDEX_DICT),
+        finish_export, btn_export)
+
+def finish_export(kind, payload):
+    if kind == 'error':
+        status_var.set("导出失败")
+        messagebox.showerror("导出失败", payload)
+    else:
+        status_var.set(f"导出完成，共 {payload} 行")
+        messagebox.showinfo("导出完成", f"全部指数对的比值与均线已导出到 index_ratio_all_pairs.csv（{payload} 行）")
+
+btn_export = tk.Button(root, text="导出全部比值", command=on_export_all)
+btn_export.grid(row=5, column=0, columnspan=2, pady=10)
+
+status_var = tk.StringVar()
+status_label = tk.Label(root, textvariable=status_var)
+status_label.grid(row=6, column=0, columnspan=2, pady=5)
+
 root.mainloop()
\ No newline at end of file
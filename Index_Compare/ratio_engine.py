@@ -0,0 +1,139 @@
+# 指数比值引擎：一次计算全部分子/分母组合和全部均线周期
+#
+# 所有指数的收盘价一次性读入 (日期 x 指数) 数组，向量化计算 N x N 个比值序列及
+# MA_WINDOWS 中每个周期的均线，结果放在 LRU 缓存中；数据库行数或最后日期变化时
+# （如 update_index_data 写入新数据后）缓存自动失效，也可调用 invalidate() 手动清空。
+#
+# 与原 plot_ratio 的口径一致：每一对指数只使用两者都有收盘价的日期（dropna），
+# 均线在这些日期上滚动计算；“位置”为比值高于均线时“上方”，否则“下方”。
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import shared_path  # noqa: F401  把 MyBacktrader 加到 sys.path，使用其中的 db_access
+from db_access import fetch_one, read_frame
+from index_ingest import DB_NAME, INDEX_DICT, TABLE_NAME
+
+# 界面中可选的均线天数
+MA_WINDOWS = (5, 10, 20, 30, 60, 120, 240)
+CACHE_SIZE = 4
+
+
+def load_close_matrix(db_name=DB_NAME, table=TABLE_NAME, codes=None):
+    """读取全部指数收盘价，返回 (dates, codes, close)，close 为 (日期 x 指数) 数组，缺失为 NaN。"""
+    codes = list(codes or INDEX_DICT.values())
+    df = read_frame(db_name,
+                    f'SELECT ts_code, trade_date, close FROM "{table}" WHERE ts_code IN ({",".join("?" * len(codes))})',
+                    params=codes)
+    wide = df.pivot(index='trade_date', columns='ts_code', values='close').reindex(columns=codes).sort_index()
+    dates = pd.to_datetime(wide.index, format='%Y%m%d')
+    return dates, codes, wide.to_numpy(dtype=np.float64)
+
+
+def rolling_mean_valid(x, window):
+    """
+    沿时间轴对每一列只在非 NaN 的行上计算滚动均值（等价于每列先 dropna 再 rolling），
+    结果放回原来的行，NaN 行保持 NaN。
+    """
+    valid = ~np.isnan(x)
+    order = np.argsort(~valid, axis=0, kind='stable')
+    compact = np.take_along_axis(np.where(valid, x, 0.0), order, axis=0)
+    csum = np.cumsum(compact, axis=0)
+    ma = np.full(x.shape, np.nan)
+    if window <= len(x):
+        ma[window - 1:] = csum[window - 1:]
+        ma[window:] -= csum[:len(x) - window]
+        ma /= window
+    out = np.full(x.shape, np.nan)
+    np.put_along_axis(out, order, ma, axis=0)
+    # 每列第 window 个有效值之前没有均线
+    rank = np.cumsum(valid, axis=0)
+    return np.where(valid & (rank >= window), out, np.nan)
+
+
+class RatioTables:
+    """全部指数对的比值和均线。ratio[t, i, j] = close[t, i] / close[t, j]。"""
+
+    def __init__(self, dates, codes, close, windows=MA_WINDOWS):
+        self.dates = dates
+        self.codes = list(codes)
+        self.close = close
+        self.windows = tuple(windows)
+        n_dates, n = close.shape
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.ratio = close[:, :, None] / close[:, None, :]
+        flat = self.ratio.reshape(n_dates, n * n)
+        self.ma = {w: rolling_mean_valid(flat, w).reshape(n_dates, n, n) for w in windows}
+
+    def moving_average(self, window):
+        """均线；不在预计算周期中的天数按需计算一次并保留。"""
+        if window not in self.ma:
+            n_dates, n, _ = self.ratio.shape
+            self.ma[window] = rolling_mean_valid(self.ratio.reshape(n_dates, n * n), window).reshape(n_dates, n, n)
+        return self.ma[window]
+
+    def pair_frame(self, numerator_code, denominator_code, ma_days):
+        """一对指数的 DataFrame（列 n, d, ratio, ma, 位置），只含两者都有数据的日期。"""
+        i, j = self.codes.index(numerator_code), self.codes.index(denominator_code)
+        ratio = self.ratio[:, i, j]
+        keep = ~np.isnan(ratio)
+        ma = self.moving_average(ma_days)[keep, i, j]
+        df = pd.DataFrame({'n': self.close[keep, i], 'd': self.close[keep, j], 'ratio': ratio[keep], 'ma': ma},
+                          index=pd.Index(self.dates[keep], name='trade_date'))
+        df['位置'] = np.where(df['ratio'].to_numpy() > ma, '上方', '下方')
+        return df
+
+    def all_pairs_frame(self, names=None):
+        """全部有序指数对的长表：日期、分子、分母、比值，以及每个均线周期的均线和位置。"""
+        names = names or {}
+        labels = np.array([names.get(code, code) for code in self.codes], dtype=object)
+        n = len(self.codes)
+        ii, jj = np.nonzero(~np.eye(n, dtype=bool))
+        ratio = self.ratio[:, ii, jj]
+        keep = ~np.isnan(ratio)
+        rows, pairs = np.nonzero(keep)
+        out = pd.DataFrame({
+            '日期': self.dates[rows],
+            '分子': labels[ii[pairs]],
+            '分母': labels[jj[pairs]],
+            '分子指数': self.close[rows, ii[pairs]],
+            '分母指数': self.close[rows, jj[pairs]],
+            '比值': ratio[rows, pairs],
+        })
+        for w in self.windows:
+            ma = self.ma[w][:, ii, jj][rows, pairs]
+            out[f'{w}日均线'] = ma
+            out[f'{w}日均线位置'] = np.where(out['比值'].to_numpy() > ma, '上方', '下方')
+        return out.sort_values(['分子', '分母', '日期'], kind='stable').reset_index(drop=True)
+
+
+def data_fingerprint(db_name=DB_NAME, table=TABLE_NAME):
+    """行数和最后日期，写入新数据后会变化。"""
+    return fetch_one(db_name, f'SELECT COUNT(*), MAX(trade_date) FROM "{table}"')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _build_tables(db_name, table, codes, windows, fingerprint):
+    dates, codes, close = load_close_matrix(db_name, table, codes)
+    return RatioTables(dates, codes, close, windows)
+
+
+def get_ratio_tables(db_name=DB_NAME, table=TABLE_NAME, codes=None, windows=MA_WINDOWS):
+    """返回缓存的 RatioTables；数据库内容变化后自动重新计算。"""
+    codes = tuple(codes or INDEX_DICT.values())
+    return _build_tables(db_name, table, codes, tuple(windows), data_fingerprint(db_name, table))
+
+
+def invalidate():
+    _build_tables.cache_clear()
+
+
+def export_all_pairs(path, db_name=DB_NAME, table=TABLE_NAME, index_dict=None):
+    """把全部指数对、全部均线周期一次导出到 CSV，返回行数。"""
+    index_dict = index_dict or INDEX_DICT
+    tables = get_ratio_tables(db_name, table, index_dict.values())
+    out = tables.all_pairs_frame({code: name for name, code in index_dict.items()})
+    out.to_csv(path, index=False, encoding='utf-8-sig')
+    return len(out)
@@ -0,0 +1,13 @@
+# 与 MyBacktrader 共用的模块
+#
+# 数据访问层（连接池、唯一写连接、PRAGMA 设置）只在 MyBacktrader/db_access.py 中维护一份。
+# 导入本模块即把 ../MyBacktrader 加到 sys.path 末尾，之后 from db_access import ... 得到的就是它；
+# 加在末尾，Index_Compare 自己的模块仍然优先。
+
+import os
+import sys
+
+MYBACKTRADER_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                 os.pardir, 'MyBacktrader'))
+if MYBACKTRADER_DIR not in sys.path:
+    sys.path.append(MYBACKTRADER_DIR)
@@ -4,11 +4,18 @@ import sqlite3
 import os
 from datetime import datetime, date
 import sys
-import io
 import matplotlib.pyplot as plt
-
-# 确保标准输出的编码为 UTF-8
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', line_buffering=True)
+from db_access import max_trade_date
+from numpy_feed import NumpyData, load_numpy_bars
+from universe_loader import load_universe
+from indicator_cache import refresh_indicator_cache, strategy_indicators
+from candidate_scheduler import CandidateScheduler, has_next_bar, warmup_bars
+from universe_pruning import prune_universe
+from result_writers import CsvRecordWriter
+from bt_logging import INFO, WARNING, get_log, start_logging
+
+# 确保标准输出的编码为 UTF-8（不再按行缓冲，需要及时输出的地方显式 flush）
+sys.stdout.reconfigure(encoding='utf-8')
 os.environ["PYTHONIOENCODING"] = "utf-8"
 
 print("--- 程序启动 ---")
@@ -19,50 +26,37 @@ DB_FILE = 'daily_data.db' # SQLite数据库文件名
 DAILY_DATA_TABLE = 'daily_data' # 存储股票日线数据的表名
 STOCK_POOL_CSV = 'stock_pool.csv' # 存储自选股票代码的CSV文件
 PLOT_RESULTS = True # 是否显示回测图表 (这将使用Backtrader的内置绘图)
-
-
-# --- 辅助函数：从SQLite加载数据并转换为PandasData ---
+PLOT_MAX_STOCKS = 10 # 股票数超过此值时不绘制 Backtrader 内置图表（每只股票一个子图）
+LARGE_POOL_HINT = 200 # 股票数超过此值时提示改用 universe_backtest.py
+PRUNE_UNIVERSE = True # 只把回测区间内出现过买入信号的股票加入为数据源（结果不变）
+TRADE_RECORDS_CSV = 'trade_records.csv' # 交易记录（回测过程中分批写入）
+PORTFOLIO_VALUE_CSV = 'portfolio_value.csv' # 每日总资产（回测过程中分批写入，绘制走势图时读取）
+LOG_TXT = 'backtest_log.txt' # 策略日志（后台线程写入；以 .jsonl 结尾时写结构化的 JSON Lines）
+LOG_LEVEL = 'INFO' # 策略日志级别：DEBUG / INFO / WARNING / ERROR / OFF
+CONSOLE_LOG_LEVEL = 'INFO' # 输出到控制台的级别，None 时只写日志文件
+LOG_TAIL = 20 # 回测出错时输出的最近日志条数
+
+
+# --- 辅助函数：从SQLite加载数据并转换为NumpyData ---
 def load_stock_data(ts_code, fromdate, todate, db_file, table_name):
     '''
-    从SQLite数据库加载指定股票、日期范围的数据，并转换为bt.feeds.PandasData。
+    加载指定股票、日期范围的数据（优先列式存储，否则一次SQLite查询），并转换为NumpyData。
     '''
-    conn = None
     try:
-        conn = sqlite3.connect(db_file)
-        query = f"""
-            SELECT trade_date, open, high, low, close, vol
-            FROM {table_name}
-            WHERE ts_code = ? AND trade_date BETWEEN ? AND ?
-            ORDER BY trade_date ASC
-        """
         from_date_str = fromdate.strftime('%Y%m%d')
         to_date_str = todate.strftime('%Y%m%d')
-        
-        df = pd.read_sql_query(query, conn, params=(ts_code, from_date_str, to_date_str))
-        
-        if df.empty:
+        bars = load_numpy_bars(ts_code, fromdate, todate, db_file, table_name)
+
+        if len(bars['trade_date']) == 0:
             print(f"警告: 股票 {ts_code} 在 {from_date_str} 到 {to_date_str} 之间没有找到数据。")
             sys.stdout.flush()
             return None
 
-        # 确保列名与Backtrader PandasData的期望一致
-        df.columns = ['datetime', 'open', 'high', 'low', 'close', 'volume']
-        
-        # 将 datetime 列设置为索引，并转换为 datetime 对象
-        df['datetime'] = pd.to_datetime(df['datetime'], format='%Y%m%d')
-        df.set_index('datetime', inplace=True)
-        
-        # 补齐 Backtrader 可能需要的其他列，如 openinterest
-        if 'openinterest' not in df.columns:
-            df['openinterest'] = 0.0 # 或者 pd.NA
-            
-        print(f"信息: 已为股票 {ts_code} 成功加载 {len(df)} 条数据。")
+        print(f"信息: 已为股票 {ts_code} 成功加载 {len(bars['trade_date'])} 条数据。")
         sys.stdout.flush()
-        
-        # 创建 PandasData feed
-        # IMPORTANT CHANGE: Removed fromdate/todate from PandasData constructor
-        # Let PandasData infer date range from the DataFrame's index directly
-        data = bt.feeds.PandasData(dataname=df)
+
+        # 日期在 NumpyData 内一次性向量化转换，openinterest 与原 PandasData 做法一致补 0
+        data = NumpyData(bars=bars, openinterest=0.0)
         return data
 
     except sqlite3.Error as e:
@@ -73,9 +67,6 @@ def load_stock_data(ts_code, fromdate, todate, db_file, table_name):
         print(f"错误: 处理股票 {ts_code} 数据时发生未知错误: {e}")
         sys.stdout.flush()
         return None
-    finally:
-        if conn:
-            conn.close()
 
 
 # --- 回测策略 ---
@@ -85,31 +76,28 @@ class MyMultiStockStrategy(bt.Strategy):
     )
 
     def __init__(self):
-        self.log_messages = [] # 用于存储日志信息
+        self.logger = get_log('gemini') # 日志的级别和输出位置由 bt_logging.start_logging 设置
         self.orders = {} # 字典，用于追踪每只股票的挂单 {data: order_object}
         self.bought_price = {} # 记录每只股票的买入价格 {data: price}
         
         self.inds = {} # 字典，存储每只股票的技术指标
         for d in self.datas:
-            self.inds[d] = {
-                'ma240': bt.indicators.SMA(d.close, period=240, subplot=True),
-                'ma120': bt.indicators.SMA(d.close, period=120, subplot=True),
-                'ma60': bt.indicators.SMA(d.close, period=60, subplot=True),
-                'ma20': bt.indicators.SMA(d.close, period=20, subplot=True),
-                'vol_ma3': bt.indicators.SMA(d.volume, period=3, subplot=True),
-                'vol_ma8': bt.indicators.SMA(d.volume, period=8, subplot=True),
-                'rsi13': bt.indicators.RSI(d.close, period=13, subplot=True),
-                'rsi6': bt.indicators.RSI(d.close, period=6, subplot=True),
-            }
-
-    def log(self, txt, dt=None, data=None):
-        '''策略日志函数'''
-        dt = dt or self.datas[0].datetime.date(0) # 使用主数据的时间作为日志日期
-        ts_code_str = f"[{data._name}] " if data else ""
-        message = f'{dt.isoformat()}, {ts_code_str}{txt}'
-        self.log_messages.append(message)
-        print(message) # 打印到控制台
-        sys.stdout.flush()
+            # 优先读取指标缓存，缓存缺失时回退为 bt.indicators.SMA / RSI
+            self.inds[d] = strategy_indicators(
+                d, ('ma240', 'ma120', 'ma60', 'ma20', 'vol_ma3', 'vol_ma8', 'rsi13', 'rsi6'),
+                db_file=DB_FILE, subplot=True)
+        # 最长周期只算一次（原来每根 K 线对每只股票重算）
+        self.max_period = {d: warmup_bars(self.inds[d]) for d in self.datas}
+        # 只检查有持仓和通过预筛选（close > MA240 且 MA240 向上）的股票，持仓数增量维护
+        self.scheduler = CandidateScheduler(self, self.inds)
+
+    def log(self, txt, *args, dt=None, data=None, level=INFO, event=None, price=None, size=None):
+        '''策略日志函数：txt 为 % 格式串，args 在输出时才格式化；event / price / size 为结构化字段'''
+        if not self.logger.enabled(level):
+            return
+        dt = dt or self.datetime.date(0) # 使用策略时钟（各数据源日期的最大值）作为日志日期
+        self.logger.log(level, txt, *args, date=dt, ts_code=data._name if data else None,
+                        event=event, price=price, size=size)
 
     def notify_order(self, order):
         # 订单状态通知
@@ -120,21 +108,22 @@ class MyMultiStockStrategy(bt.Strategy):
         if order.status in [order.Completed]:
             if order.isbuy():
                 self.log(
-                    '买入执行, 股票: %s, 价格: %.2f, 数量: %.2f, 成本: %.2f, 佣金: %.2f' %
-                    (order.data._name, order.executed.price, order.executed.size,
-                     order.executed.value, order.executed.comm),
-                    data=order.data
+                    '买入执行, 股票: %s, 价格: %.2f, 数量: %.2f, 成本: %.2f, 佣金: %.2f',
+                    order.data._name, order.executed.price, order.executed.size,
+                    order.executed.value, order.executed.comm,
+                    data=order.data, event='buy_filled', price=order.executed.price, size=order.executed.size
                 )
                 self.bought_price[order.data] = order.executed.price
             elif order.issell():
                 self.log(
-                    '卖出执行, 股票: %s, 价格: %.2f, 数量: %.2f, 成本: %.2f, 佣金: %.2f' %
-                    (order.data._name, order.executed.price, order.executed.size,
-                     order.executed.value, order.executed.comm),
-                    data=order.data
+                    '卖出执行, 股票: %s, 价格: %.2f, 数量: %.2f, 成本: %.2f, 佣金: %.2f',
+                    order.data._name, order.executed.price, order.executed.size,
+                    order.executed.value, order.executed.comm,
+                    data=order.data, event='sell_filled', price=order.executed.price, size=order.executed.size
                 )
                 if order.data in self.bought_price:
                     del self.bought_price[order.data]
+            self.scheduler.update_position(order.data)
 
             # 订单完成后，从挂单字典中移除
             if order.data in self.orders:
@@ -143,7 +132,8 @@ class MyMultiStockStrategy(bt.Strategy):
         elif order.status in [order.Canceled, order.Margin, order.Rejected]:
             # 订单取消/保证金不足/拒绝
             reason = order.info.get('status_text', '未知原因') # 使用 .get 避免 KeyError
-            self.log(f'订单取消/保证金不足/拒绝, 股票: {order.data._name}, 原因: {reason}', data=order.data)
+            self.log('订单取消/保证金不足/拒绝, 股票: %s, 原因: %s', order.data._name, reason,
+                     data=order.data, level=WARNING, event='order_rejected')
             if order.data in self.orders:
                 self.orders[order.data] = None
 
@@ -151,24 +141,25 @@ class MyMultiStockStrategy(bt.Strategy):
         # 交易结束（平仓）通知
         if not trade.isclosed:
             return # 只处理已平仓的交易
-        self.log(f'交易结束, 股票: {trade.data._name}, 总利润: {trade.pnl:.2f}, 净利润: {trade.pnlcomm:.2f}', data=trade.data)
+        self.log('交易结束, 股票: %s, 总利润: %.2f, 净利润: %.2f', trade.data._name, trade.pnl, trade.pnlcomm,
+                 data=trade.data, event='trade_closed')
 
     def next(self):
-        # 获取当前持仓的股票数量
-        current_num_positions = len([d for d in self.positions if self.positions[d].size != 0])
-
-        for d in self.datas: # 遍历所有数据流（股票）
-            # 检查当前数据是否有效，即 Backtrader 是否有足够的数据填充其 lines
-            # 对于 PandasData，has_a_future() 是可用的，并用于判断是否还有未来的数据点
-            if not d.has_a_future(): 
+        # 获取当前持仓的股票数量（随订单成交增量维护）
+        current_num_positions = self.scheduler.positions
+
+        # 只遍历有持仓和通过预筛选的股票；持仓已满时只检查卖出
+        for d in self.scheduler.candidates(entries=current_num_positions < self.p.max_positions):
+            # 检查是否还有下一根 K 线（买入按下一根 K 线的开盘价 d.open[1] 计算数量）
+            # backtrader 的数据源没有 has_a_future()，原写法在第一根 K 线上就抛出 AttributeError
+            if not has_next_bar(d):
                 continue
 
             ind = self.inds[d]
             
             # 确保有足够的数据点来计算最长周期的指标 (MA240)
             # len(d) 应该大于等于 max_period 才能确保指标有值
-            max_period = max([ind[key].params.period for key in ind if hasattr(ind[key], 'params')])
-            if len(d) <= max_period: 
+            if len(d) <= self.max_period[d]:
                 continue
 
             # 确保所有关键指标都有值（防止冷启动阶段None/NaN）
@@ -185,9 +176,10 @@ class MyMultiStockStrategy(bt.Strategy):
             if position: # 如果有持仓
                 ma20_current = ind['ma20'][0] # 使用当前 bar 的20日均线
                 if d.close[0] < ma20_current: # 当前收盘价跌破20日均线
-                    self.log(f'触发卖出信号 (跌破20均线), 股票: {d._name}, 当前价: {d.close[0]:.2f}, 20日均线: {ma20_current:.2f}', data=d)
-                    # 下卖单，执行价格为下一天的开盘价 (Order.Open)
-                    self.orders[d] = self.close(data=d, exectype=bt.Order.Open)
+                    self.log('触发卖出信号 (跌破20均线), 股票: %s, 当前价: %.2f, 20日均线: %.2f', d._name, d.close[0], ma20_current,
+                             data=d, event='sell_signal', price=d.close[0])
+                    # 下卖单，执行价格为下一天的开盘价 (市价单在下一根 K 线开盘成交；backtrader 没有 Order.Open)
+                    self.orders[d] = self.close(data=d, exectype=bt.Order.Market)
                 continue # 如果已有持仓或已发出卖单，则跳过买入逻辑
 
             # --- 买入条件 ---
@@ -228,7 +220,7 @@ class MyMultiStockStrategy(bt.Strategy):
                         
                         # 避免除以0或负数
                         if denominator <= 0:
-                            self.log(f'警告: 股票 {d._name} 无法买入，已达最大持仓数。', data=d)
+                            self.log('警告: 股票 %s 无法买入，已达最大持仓数。', d._name, data=d, level=WARNING)
                             continue
                         
                         funds_to_invest = available_cash / denominator
@@ -240,9 +232,10 @@ class MyMultiStockStrategy(bt.Strategy):
                         if price_to_buy is not None and not pd.isna(price_to_buy) and price_to_buy > 0:
                             size = funds_to_invest // price_to_buy # 计算可买入股数 (向下取整)
                             if size > 0:
-                                self.log(f'发出买入信号, 股票: {d._name}, 建议买入数量: {size}, 占用资金: {size * price_to_buy:.2f}', data=d)
-                                # 下买单，执行价格为下一天的开盘价 (Order.Open)
-                                self.orders[d] = self.buy(data=d, size=size, exectype=bt.Order.Open)
+                                self.log('发出买入信号, 股票: %s, 建议买入数量: %s, 占用资金: %.2f', d._name, size, size * price_to_buy,
+                                         data=d, event='buy_signal', price=price_to_buy, size=size)
+                                # 下买单，执行价格为下一天的开盘价 (市价单在下一根 K 线开盘成交；backtrader 没有 Order.Open)
+                                self.orders[d] = self.buy(data=d, size=size, exectype=bt.Order.Market)
                         # else:
                             # 调试时可以打印警告，正常运行时无需
                             # self.log(f'警告: 股票 {d._name} 在 {self.datas[0].datetime.date(0)} 下一个交易日开盘价不可用，无法下单。')
@@ -320,32 +313,51 @@ class ProgressLogger(bt.Analyzer):
 class TradeRecorder(bt.Analyzer):
     '''
     分析器：记录所有已执行的交易，用于生成 CSV 报告。
+    设置 csv_file 时边回测边分批写入该文件（utf-8-sig），否则保存在 trades 列表中。
     '''
+    params = (('csv_file', None),)
+    columns = ('股票代码', '开仓日期', '平仓日期', '买入价格', '卖出价格', '交易数量', '总利润', '净利润', '利润率 (%)', '佣金')
+
     def __init__(self):
-        self.trades = []
+        self.trades = CsvRecordWriter(self.p.csv_file, self.columns, encoding='utf-8-sig') if self.p.csv_file else []
+
+    def stop(self):
+        if self.p.csv_file:
+            self.trades.close()
 
     def notify_trade(self, trade):
         # 只记录已平仓的交易
         if trade.isclosed:
+            # trade.history 为开仓、平仓等事件的列表（需要 Cerebro(tradehistory=True)）
+            opened, closed = trade.history[0].event, trade.history[-1].event
+            cost = abs(opened.size * opened.price)
             self.trades.append({
                 '股票代码': trade.data._name,
-                '开仓日期': bt.num2date(trade.history.open.datetime).date(),
-                '平仓日期': bt.num2date(trade.history.close.datetime).date(),
-                '买入价格': trade.history.open.price,
-                '卖出价格': trade.history.close.price,
-                '交易数量': trade.history.size,
+                '开仓日期': bt.num2date(trade.dtopen).date(),
+                '平仓日期': bt.num2date(trade.dtclose).date(),
+                '买入价格': opened.price,
+                '卖出价格': closed.price,
+                '交易数量': opened.size,
                 '总利润': trade.pnl,
                 '净利润': trade.pnlcomm,
-                '利润率 (%)': (trade.pnlcomm / trade.value * 100) if trade.value else 0, # 计算利润率
+                '利润率 (%)': (trade.pnlcomm / cost * 100) if cost else 0, # 计算利润率
                 '佣金': trade.commission
             })
 
 class ValueTracker(bt.Analyzer):
     '''
     分析器：记录每个交易日结束时的总资产。
+    设置 csv_file 时边回测边分批写入该文件，否则保存在 values 列表中。
     '''
+    params = (('csv_file', None),)
+    columns = ('日期', '总资产')
+
     def __init__(self):
-        self.values = []
+        self.values = CsvRecordWriter(self.p.csv_file, self.columns) if self.p.csv_file else []
+
+    def stop(self):
+        if self.p.csv_file:
+            self.values.close()
 
     def next(self):
         # 记录当前日期和投资组合总价值
@@ -358,7 +370,7 @@ class ValueTracker(bt.Analyzer):
 
 # --- 回测主函数 ---
 def run_backtest(stock_pool_path):
-    cerebro = bt.Cerebro()
+    cerebro = bt.Cerebro(tradehistory=True) # TradeRecorder 从 trade.history 读取开仓、平仓价格
 
     # 设置初始资金和佣金
     initial_capital = 300000.0 # 初始资金30万元
@@ -381,10 +393,10 @@ def run_backtest(stock_pool_path):
     cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
     cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='trade_analysis')
     cerebro.addanalyzer(ProgressLogger, _name='progress_logger')
-    cerebro.addanalyzer(TradeRecorder, _name='trade_recorder') # 添加交易记录分析器
-    cerebro.addanalyzer(ValueTracker, _name='value_tracker') # 添加资产走势记录分析器
+    cerebro.addanalyzer(TradeRecorder, _name='trade_recorder', csv_file=TRADE_RECORDS_CSV) # 添加交易记录分析器
+    cerebro.addanalyzer(ValueTracker, _name='value_tracker', csv_file=PORTFOLIO_VALUE_CSV) # 添加资产走势记录分析器
 
-    # 读取自选股票池，并选择前10只股票
+    # 读取自选股票池
     print(f"尝试读取自选股票池文件: {stock_pool_path}")
     sys.stdout.flush()
     try:
@@ -394,9 +406,13 @@ def run_backtest(stock_pool_path):
             print("错误: 自选股票池为空，请检查CSV文件内容。")
             sys.stdout.flush()
             return
-        # 获取前10只股票进行回测
-        ts_codes_to_backtest = selected_ts_codes[:10]
-        print(f"将对以下 {len(ts_codes_to_backtest)} 只股票进行回测: {ts_codes_to_backtest}")
+        ts_codes_to_backtest = selected_ts_codes
+        if len(ts_codes_to_backtest) <= PLOT_MAX_STOCKS:
+            print(f"将对以下 {len(ts_codes_to_backtest)} 只股票进行回测: {ts_codes_to_backtest}")
+        else:
+            print(f"将对 {len(ts_codes_to_backtest)} 只股票进行回测")
+        if len(ts_codes_to_backtest) > LARGE_POOL_HINT:
+            print("信息: 股票池较大，全市场回测建议使用 universe_backtest.py（内存受限、不绘图）")
         sys.stdout.flush()
     except FileNotFoundError:
         print(f"错误: 未找到自选股票池文件 '{stock_pool_path}'。请检查路径和文件名。")
@@ -413,13 +429,9 @@ def run_backtest(stock_pool_path):
 
     # 确定回测日期范围（从2022-01-01到数据库中的最新日期）
     from_date_obj = datetime(2022, 1, 1) # 回测起始日期
-    conn_check = None
     to_date_obj = None
     try:
-        conn_check = sqlite3.connect(DB_FILE)
-        cursor_check = conn_check.cursor()
-        cursor_check.execute(f"SELECT MAX(trade_date) FROM {DAILY_DATA_TABLE}")
-        last_date_str = cursor_check.fetchone()[0]
+        last_date_str = max_trade_date(DB_FILE, DAILY_DATA_TABLE)
         if last_date_str:
             to_date_obj = datetime.strptime(last_date_str, '%Y%m%d')
             print(f"信息: 数据库中最新数据日期: {to_date_obj.date()}")
@@ -431,63 +443,34 @@ def run_backtest(stock_pool_path):
         print(f"错误: 获取数据库最新日期失败: {e}")
         sys.stdout.flush()
         return
-    finally:
-        if conn_check:
-            conn_check.close()
     
     if not to_date_obj: # 如果没有获取到结束日期，则退出
         return
 
     # 为所有选定股票添加数据馈送
+    # 一次批量查询加载全部股票，覆盖目录表用于跳过区间内无数据的股票
     # Backtrader会自动处理多个数据流的时间同步
-    for stock_code in ts_codes_to_backtest:
-        print(f"正在添加股票 {stock_code} 的数据到回测引擎...")
+    try:
+        bars_by_code, skipped = load_universe(ts_codes_to_backtest, from_date_obj, to_date_obj,
+                                              DB_FILE, DAILY_DATA_TABLE)
+    except sqlite3.Error as e:
+        print(f"错误: 批量加载股票数据失败: {e}")
         sys.stdout.flush()
-        # 预检查该股票在指定日期范围内的数据量
-        conn_precheck = None
-        try:
-            conn_precheck = sqlite3.connect(DB_FILE)
-            cursor_precheck = conn_precheck.cursor()
-            check_query = f"""
-                SELECT COUNT(*)
-                FROM {DAILY_DATA_TABLE}
-                WHERE ts_code = ? AND trade_date BETWEEN ? AND ?
-            """
-            from_date_str_check = from_date_obj.strftime('%Y%m%d')
-            to_date_str_check = to_date_obj.strftime('%Y%m%d')
-            cursor_precheck.execute(check_query, (stock_code, from_date_str_check, to_date_str_check))
-            count_rows = cursor_precheck.fetchone()[0]
-
-            if count_rows == 0:
-                print(f"警告: 数据库中未找到股票 {stock_code} 在 {from_date_str_check} 到 {to_date_str_check} 之间的数据。将跳过此股票。")
-                sys.stdout.flush()
-                continue # 跳过此股票，处理下一只
-            else:
-                print(f"信息: 数据库中确认股票 {stock_code} 在 {from_date_str_check} 到 {to_date_str_check} 之间有 {count_rows} 条数据。")
-                sys.stdout.flush()
-
-        except sqlite3.Error as e:
-            print(f"错误: 数据库预检查失败 for {stock_code}: {e}. 将跳过此股票。")
-            sys.stdout.flush()
-            continue
-        finally:
-            if conn_precheck:
-                conn_precheck.close()
+        return
 
-        try:
-            # 使用获取到的 from_date_obj 和 to_date_obj
-            data = load_stock_data(stock_code, from_date_obj, to_date_obj, DB_FILE, DAILY_DATA_TABLE)
-            if data:
-                cerebro.adddata(data)
-                print(f"股票 {stock_code} 的数据已成功添加到 Backtrader 引擎。")
-                sys.stdout.flush()
-            else:
-                print(f"警告: 未能为股票 {stock_code} 加载数据，已跳过。")
-                sys.stdout.flush()
-        except Exception as e:
-            print(f"错误: 添加股票 {stock_code} 的数据时发生致命错误: {e}. 将跳过此股票。")
-            sys.stdout.flush()
-            continue
+    for stock_code, reason in skipped.items():
+        print(f"警告: 股票 {stock_code} {reason}，将跳过此股票。")
+    if PRUNE_UNIVERSE:
+        # 从未出现买入信号的股票不会持仓，不加入为数据源（见 universe_pruning.py）
+        kept, _ = prune_universe(list(bars_by_code), bars_by_code)
+        print(f"信息: 按买入信号裁剪股票池，{len(bars_by_code)} 只中保留 {len(kept)} 只。")
+        bars_by_code = {stock_code: bars_by_code[stock_code] for stock_code in kept}
+    refresh_indicator_cache(list(bars_by_code), DB_FILE, table=DAILY_DATA_TABLE)
+    for stock_code, bars in bars_by_code.items():
+        # 日期在 NumpyData 内一次性向量化转换，openinterest 与原 PandasData 做法一致补 0
+        cerebro.adddata(NumpyData(bars=bars, openinterest=0.0), name=stock_code)
+        print(f"信息: 股票 {stock_code} 的 {len(bars['trade_date'])} 条数据已添加到 Backtrader 引擎。")
+    sys.stdout.flush()
 
     if not cerebro.datas:
         print("错误: 没有成功添加任何股票数据，回测无法运行。")
@@ -496,8 +479,13 @@ def run_backtest(stock_pool_path):
 
     print('开始回测模拟...')
     sys.stdout.flush()
+    # 策略日志由后台线程写入控制台和 LOG_TXT，环形缓冲保留最近的日志
+    backtest_logs = start_logging('gemini', level=LOG_LEVEL, log_file=LOG_TXT, console_level=CONSOLE_LOG_LEVEL)
     try:
-        strategies = cerebro.run()
+        try:
+            strategies = cerebro.run()
+        finally:
+            backtest_logs.stop()
         print('DEBUG: cerebro.run() 调用已完成。')
         sys.stdout.flush()
 
@@ -536,18 +524,14 @@ def run_backtest(stock_pool_path):
         
         sys.stdout.flush()
 
-        # 保存交易记录到 CSV 文件
-        trade_records = strategy.analyzers.trade_recorder.trades
-        if trade_records:
-            trade_df = pd.DataFrame(trade_records)
-            trade_df.to_csv('trade_records.csv', index=False, encoding='utf-8-sig')
-            print("\n交易记录已保存到 'trade_records.csv'")
+        # 交易记录已在回测过程中写入 CSV 文件
+        if strategy.analyzers.trade_recorder.trades:
+            print(f"\n交易记录已保存到 '{TRADE_RECORDS_CSV}'")
             sys.stdout.flush()
 
-        # 绘制并保存总资产每日走势图
-        value_records = strategy.analyzers.value_tracker.values
-        if value_records:
-            value_df = pd.DataFrame(value_records)
+        # 绘制并保存总资产每日走势图（每日总资产已在回测过程中写入 CSV 文件）
+        if strategy.analyzers.value_tracker.values:
+            value_df = pd.read_csv(PORTFOLIO_VALUE_CSV, encoding='utf-8')
             value_df['日期'] = pd.to_datetime(value_df['日期'])
             value_df.set_index('日期', inplace=True)
             
@@ -567,7 +551,10 @@ def run_backtest(stock_pool_path):
             sys.stdout.flush()
         
         # Backtrader 内置的绘图 (可选)
-        if PLOT_RESULTS:
+        if PLOT_RESULTS and len(cerebro.datas) > PLOT_MAX_STOCKS:
+            print(f"\n信息: 共 {len(cerebro.datas)} 只股票，超过 {PLOT_MAX_STOCKS} 只，跳过 Backtrader 内置图表。")
+            sys.stdout.flush()
+        elif PLOT_RESULTS:
             print("\n正在生成 Backtrader 内置回测图表 (这将是一个交互式窗口)...")
             sys.stdout.flush()
             # cerebro.plot() 会打开一个交互式窗口，可能需要手动关闭才能让程序继续
@@ -580,6 +567,10 @@ def run_backtest(stock_pool_path):
 
     except Exception as e:
         print(f"回测模拟过程中发生错误: {e}")
+        recent = backtest_logs.recent(LOG_TAIL)
+        if recent:
+            print(f"最近 {len(recent)} 条策略日志:")
+            print('\n'.join(recent))
         # import traceback # 调试时可以取消注释以打印完整堆栈
         # traceback.print_exc()
         sys.stdout.flush()
@@ -0,0 +1,113 @@
+'''
+后台加载工具（Tkinter）
+
+BackgroundTask 在工作线程中运行耗时的函数，进度、结果和异常都放进队列，
+由主线程用 widget.after() 轮询取出后再调用回调，工作线程从不直接操作 Tk 控件。
+取消通过 threading.Event 实现：工作函数在每个数据块之间调用 check_cancel()，
+收到取消请求时抛出 LoadCancelled。
+
+read_sql_chunks 用 pandas.read_sql_query(chunksize=...) 分块读取查询结果，
+每块之后报告进度并检查取消，可同时按 dtype 指定各列类型以减少内存占用。
+'''
+import queue
+import threading
+
+import pandas as pd
+
+# --- 配置参数 ---
+LOAD_CHUNK_ROWS = 1000  # 每块读取的行数
+POLL_MS = 100           # 主线程轮询队列的间隔（毫秒）
+
+
+class LoadCancelled(Exception):
+    '''用户取消了后台加载。'''
+
+
+def check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise LoadCancelled()
+
+
+def read_sql_chunks(conn, query, params=(), total=None, chunksize=LOAD_CHUNK_ROWS, dtype=None,
+                    progress=None, cancel=None):
+    '''
+    分块读取查询结果并拼接为 DataFrame。
+    progress(done, total) 在每块之后调用（total 为预计行数，可为 None）。
+    '''
+    chunks, done = [], 0
+    for chunk in pd.read_sql_query(query, conn, params=params, chunksize=chunksize, dtype=dtype):
+        chunks.append(chunk)
+        done += len(chunk)
+        if progress:
+            progress(done, total)
+        check_cancel(cancel)
+    if not chunks:
+        return pd.read_sql_query(query, conn, params=params, dtype=dtype)
+    return pd.concat(chunks, ignore_index=True)
+
+
+class BackgroundTask:
+    '''
+    func(progress, cancel) 在工作线程中运行：
+      progress(fraction, message) 报告 0~1 的进度和说明文字；
+      cancel 为 threading.Event，func 应定期调用 check_cancel(cancel)。
+    回调都在主线程中调用：on_progress(fraction, message)、on_done(result)、
+    on_error(exception)、on_cancelled()。
+    '''
+
+    def __init__(self, widget, func, on_done, on_error=None, on_progress=None, on_cancelled=None):
+        self.widget = widget
+        self.func = func
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_cancelled = on_cancelled
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.widget.after(POLL_MS, self._poll)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _run(self):
+        def progress(fraction, message=''):
+            self.events.put(('progress', (fraction, message)))
+        try:
+            result = self.func(progress, self.cancel_event)
+        except LoadCancelled:
+            self.events.put(('cancelled', None))
+        except Exception as e:
+            self.events.put(('error', e))
+        else:
+            self.events.put(('done', result))
+
+    def _poll(self):
+        while True:
+            try:
+                kind, payload = self.events.get_nowait()
+            except queue.Empty:
+                self.widget.after(POLL_MS, self._poll)
+                return
+            if kind == 'progress':
+                if self.on_progress:
+                    self.on_progress(*payload)
+            elif kind == 'done':
+                self.on_done(payload)
+                return
+            elif kind == 'error':
+                if self.on_error:
+                    self.on_error(payload)
+                return
+            elif kind == 'cancelled':
+                if self.on_cancelled:
+                    self.on_cancelled()
+                return
@@ -0,0 +1,431 @@
+'''
+列式 K 线存储
+
+把 daily_data 表转换为按字段连续存放的二进制数组（每个字段一个文件），
+再加上按 ts_code 排序的偏移量索引。读取时用 numpy.memmap 打开，
+每只股票的数据就是各字段数组上的一段连续切片，不需要再对 SQLite 做逐只查询。
+
+目录结构（默认在数据库同目录下的 bar_store/）：
+    meta.json          元信息：行数、字段类型、源数据库指纹和写入版本（change_tracking）
+    index.npz          codes / offsets / counts 三个数组
+    <field>.bin        各字段的连续数组（trade_date 为 int32，其余为 float64）
+
+命令行用法：
+    python bar_store.py                      # 根据 daily_data.db 构建或增量刷新
+    python bar_store.py my.db --rebuild      # 强制全量重建
+'''
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+
+import numpy as np
+
+from change_tracking import changed_codes, ensure_tracking, table_version
+from db_access import file_signature, read_connection, write_connection
+
+# --- 配置参数 ---
+DB_FILE = 'daily_data.db'
+DAILY_DATA_TABLE = 'daily_data'
+BAR_STORE_DIRNAME = 'bar_store'
+STORE_VERSION = 1
+FETCH_CHUNK = 200000  # 每次从 SQLite 取出的行数
+IN_CHUNK = 500        # 增量刷新时每个 IN (...) 查询的代码数
+
+# 字段名 -> 存储类型，trade_date 以 YYYYMMDD 整数保存
+FIELDS = (
+    ('trade_date', 'int32'),
+    ('open', 'float64'),
+    ('high', 'float64'),
+    ('low', 'float64'),
+    ('close', 'float64'),
+    ('vol', 'float64'),
+    ('pe_ttm', 'float64'),
+    ('pb', 'float64'),
+    ('total_mv', 'float64'),
+)
+FIELD_NAMES = tuple(name for name, _ in FIELDS)
+VALUE_FIELDS = FIELD_NAMES[1:]
+
+META_FILE = 'meta.json'
+INDEX_FILE = 'index.npz'
+
+
+def store_dir_for(db_file):
+    '''默认的存储目录：与数据库文件放在同一目录下。'''
+    return os.path.join(os.path.dirname(os.path.abspath(db_file)), BAR_STORE_DIRNAME)
+
+
+def date_to_int(value):
+    '''datetime / date / 'YYYYMMDD' / int 统一转为 YYYYMMDD 整数。'''
+    if value is None:
+        return None
+    if hasattr(value, 'strftime'):
+        return int(value.strftime('%Y%m%d'))
+    return int(value)
+
+
+def _db_file_stat(db_file):
+    return file_signature(db_file)
+
+
+def _db_fingerprint(conn, table):
+    '''数据库内容指纹：总行数和最大交易日。'''
+    count, max_date = conn.execute(f"SELECT COUNT(*), MAX(trade_date) FROM {table}").fetchone()
+    return int(count or 0), (int(max_date) if max_date else 0)
+
+
+def _ensure_tracking(db_file, table):
+    '''在日线表上建立写入版本的触发器；数据库只读等原因无法建立时只打印警告（存储每次都要重建）。'''
+    try:
+        with write_connection(db_file) as conn:
+            ensure_tracking(conn, table)
+    except sqlite3.OperationalError as e:
+        print(f"警告: 无法在 {table} 上建立写入版本跟踪（{e}），列式存储无法增量刷新")
+        sys.stdout.flush()
+
+
+def _rows_to_columns(rows):
+    '''把 fetchmany 得到的行元组转为 (codes 列表, 字段 -> ndarray)。NULL 值转为 NaN。'''
+    cols = list(zip(*rows))
+    codes = cols[0]
+    arrays = {'trade_date': np.asarray(cols[1], dtype='U8').astype(np.int32)}
+    for name, col in zip(VALUE_FIELDS, cols[2:]):
+        arrays[name] = np.array(col, dtype=np.float64)
+    return codes, arrays
+
+
+def _write_store(store_dir, codes, offsets, counts, columns, meta):
+    '''先写到临时目录，再整体替换，避免读取方看到写了一半的文件。'''
+    tmp_dir = store_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    for name, dtype in FIELDS:
+        np.asarray(columns[name], dtype=dtype).tofile(os.path.join(tmp_dir, f'{name}.bin'))
+    np.savez(os.path.join(tmp_dir, INDEX_FILE),
+             codes=np.asarray(codes, dtype=str),
+             offsets=np.asarray(offsets, dtype=np.int64),
+             counts=np.asarray(counts, dtype=np.int64))
+    with open(os.path.join(tmp_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    old_dir = store_dir + '.old'
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.exists(store_dir):
+        os.replace(store_dir, old_dir)
+    os.replace(tmp_dir, store_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+
+def _group_offsets(code_per_row):
+    '''按已排序的 ts_code 序列计算每只股票的起始偏移和行数。'''
+    n = len(code_per_row)
+    if n == 0:
+        return [], [], []
+    code_per_row = np.asarray(code_per_row)
+    starts = np.flatnonzero(np.r_[True, code_per_row[1:] != code_per_row[:-1]])
+    counts = np.diff(np.r_[starts, n])
+    return code_per_row[starts].tolist(), starts.tolist(), counts.tolist()
+
+
+def build_bar_store(db_file=DB_FILE, store_dir=None, table=DAILY_DATA_TABLE):
+    '''从 daily_data 表全量构建列式存储，返回写入的行数。'''
+    store_dir = store_dir or store_dir_for(db_file)
+    _ensure_tracking(db_file, table)
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.execute("BEGIN")  # 读事务：版本号与读到的行来自同一个快照
+        data_version = table_version(conn, table)
+        total_rows, max_date = _db_fingerprint(conn, table)
+        columns = {name: np.empty(total_rows, dtype=dtype) for name, dtype in FIELDS}
+        code_per_row = np.empty(total_rows, dtype=object)
+
+        cursor = conn.execute(f"""
+            SELECT ts_code, trade_date, {', '.join(VALUE_FIELDS)}
+            FROM {table}
+            ORDER BY ts_code ASC, trade_date ASC
+        """)
+        pos = 0
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK)
+            if not rows:
+                break
+            codes, arrays = _rows_to_columns(rows)
+            end = pos + len(rows)
+            code_per_row[pos:end] = codes
+            for name in FIELD_NAMES:
+                columns[name][pos:end] = arrays[name]
+            pos = end
+            print(f"信息: 已转换 {pos}/{total_rows} 行")
+            sys.stdout.flush()
+        cursor.close()
+    finally:
+        conn.close()
+
+    codes, offsets, counts = _group_offsets(code_per_row)
+    _write_store(store_dir, codes, offsets, counts, columns,
+                 _store_meta(table, pos, max_date, data_version, _db_file_stat(db_file)))
+    print(f"信息: 列式存储已写入 {store_dir}，共 {len(codes)} 只股票、{pos} 行")
+    sys.stdout.flush()
+    return pos
+
+
+def _store_meta(table, rows, max_date, data_version, stat):
+    meta = {
+        'version': STORE_VERSION,
+        'table': table,
+        'rows': int(rows),
+        'max_trade_date': int(max_date),
+        'data_version': data_version,
+        'fields': dict(FIELDS),
+    }
+    meta.update(stat)
+    return meta
+
+
+def _load_codes(conn, table, codes):
+    '''读取指定股票的全部行，返回 (每行的代码, 字段 -> ndarray)，按 (ts_code, trade_date) 排序。'''
+    rows = []
+    for i in range(0, len(codes), IN_CHUNK):
+        chunk = codes[i:i + IN_CHUNK]
+        rows.extend(conn.execute(f"""
+            SELECT ts_code, trade_date, {', '.join(VALUE_FIELDS)}
+            FROM {table}
+            WHERE ts_code IN ({','.join('?' * len(chunk))})
+            ORDER BY ts_code ASC, trade_date ASC
+        """, chunk).fetchall())
+    if not rows:
+        return np.empty(0, dtype=object), {name: np.empty(0, dtype=dtype) for name, dtype in FIELDS}
+    codes, arrays = _rows_to_columns(rows)
+    return np.asarray(codes, dtype=object), arrays
+
+
+def refresh_bar_store(db_file=DB_FILE, store_dir=None, table=DAILY_DATA_TABLE, rebuild=False):
+    '''
+    刷新列式存储：
+    - 数据库文件未变化，或写入版本（change_tracking）与构建时相同时直接返回；
+    - 版本变化时只重新读取构建后有过插入、修改或删除的股票（含按原日期覆盖的行），
+      替换这些股票的数据，其余股票沿用旧数据；
+    - 存储不存在、表名变化、没有记录版本（旧版存储或数据库未建立跟踪）时全量重建。
+    返回 True 表示存储被重写。
+    '''
+    store_dir = store_dir or store_dir_for(db_file)
+    store = None if rebuild else open_bar_store(store_dir)
+    if store is None or store.meta.get('table') != table or store.meta.get('data_version') is None:
+        build_bar_store(db_file, store_dir, table)
+        return True
+
+    stat = _db_file_stat(db_file)
+    if all(store.meta.get(k) == v for k, v in stat.items()):
+        return False
+
+    _ensure_tracking(db_file, table)
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.execute("BEGIN")
+        data_version = table_version(conn, table)
+        if data_version is None or data_version < store.meta['data_version']:
+            changed = None  # 跟踪被删除后重建过，版本号不可比较
+        elif data_version == store.meta['data_version']:
+            # 内容未变（例如只是执行了 VACUUM 或写了其他表），只更新文件指纹
+            store.meta.update(stat)
+            with open(os.path.join(store_dir, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump(store.meta, f, ensure_ascii=False, indent=2)
+            return False
+        else:
+            changed = changed_codes(conn, table, store.meta['data_version'])
+            new_codes, new_arrays = _load_codes(conn, table, changed)
+    finally:
+        conn.close()
+    if changed is None:
+        build_bar_store(db_file, store_dir, table)
+        return True
+
+    # 未变化的股票取旧数据，变化的股票（可能已被全部删除）取新读到的行，按 (code, date) 排序合并
+    changed_set = set(changed)
+    keep = np.array([code not in changed_set for code in store.codes], dtype=bool)
+    old_codes = np.repeat(np.asarray(store.codes, dtype=object)[keep], store.counts[keep])
+    old_rows = np.repeat(keep, store.counts)
+    all_codes = np.concatenate([old_codes, new_codes])
+    code_ids = np.unique(all_codes.astype(str), return_inverse=True)[1]
+    columns = {name: np.concatenate([np.asarray(store.column(name))[old_rows], new_arrays[name]])
+               for name in FIELD_NAMES}
+    order = np.lexsort((columns['trade_date'], code_ids))
+    columns = {name: col[order] for name, col in columns.items()}
+    codes, offsets, counts = _group_offsets(all_codes[order])
+    store.close()
+
+    total_rows = len(all_codes)
+    max_date = int(columns['trade_date'].max()) if total_rows else 0
+    _write_store(store_dir, codes, offsets, counts, columns,
+                 _store_meta(table, total_rows, max_date, data_version, stat))
+    print(f"信息: 列式存储已增量刷新，重新读取 {len(changed)} 只股票、{len(new_codes)} 行")
+    sys.stdout.flush()
+    return True
+
+
+class BarStore:
+    '''只读的列式存储视图，所有返回的数组都是 memmap 切片（零拷贝）。'''
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, META_FILE), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError(f"列式存储版本不匹配: {self.meta.get('version')}")
+        self.rows = int(self.meta['rows'])
+        self.max_trade_date = int(self.meta['max_trade_date'])
+
+        with np.load(os.path.join(store_dir, INDEX_FILE)) as index:
+            self.codes = index['codes'].tolist()
+            self.offsets = index['offsets']
+            self.counts = index['counts']
+        self._slices = {code: (int(start), int(count))
+                        for code, start, count in zip(self.codes, self.offsets, self.counts)}
+        self._verified_stat = None  # 上次按内容确认一致时的数据库文件签名
+
+        self._columns = {}
+        for name, dtype in self.meta['fields'].items():
+            path = os.path.join(store_dir, f'{name}.bin')
+            if self.rows:
+                self._columns[name] = np.memmap(path, dtype=dtype, mode='r', shape=(self.rows,))
+            else:
+                self._columns[name] = np.empty(0, dtype=dtype)
+
+    def __contains__(self, ts_code):
+        return ts_code in self._slices
+
+    def __len__(self):
+        return len(self.codes)
+
+    def column(self, name):
+        return self._columns[name]
+
+    def is_fresh(self, db_file):
+        '''
+        数据库文件（及非空的 WAL 文件）大小和修改时间与构建时一致即视为最新；
+        不一致时（写入、切换为 WAL 模式、VACUUM、检查点等都会改变文件状态）再比较日线表的写入版本
+        （change_tracking，按主键查一行），版本相同仍视为最新，并记住此时的文件签名。
+        按原日期覆盖或修改已有行也会改变版本；数据库没有建立版本跟踪时视为不一致。
+        '''
+        try:
+            stat = _db_file_stat(db_file)
+        except OSError:
+            return False
+        if all(self.meta.get(k) == v for k, v in stat.items()) or stat == self._verified_stat:
+            return True
+        if self.meta.get('data_version') is None:
+            return False
+        try:
+            with read_connection(db_file) as conn:
+                data_version = table_version(conn, self.meta['table'])
+        except sqlite3.Error:
+            return False
+        if data_version != self.meta['data_version']:
+            return False
+        self._verified_stat = stat
+        return True
+
+    def get(self, ts_code, fromdate=None, todate=None, fields=FIELD_NAMES):
+        '''
+        返回指定股票在 [fromdate, todate] 内的数据，字段 -> 切片。
+        股票不存在时返回 None。
+        '''
+        if ts_code not in self._slices:
+            return None
+        start, count = self._slices[ts_code]
+        end = start + count
+        dates = self._columns['trade_date'][start:end]
+        lo, hi = 0, count
+        if fromdate is not None:
+            lo = int(np.searchsorted(dates, date_to_int(fromdate), side='left'))
+        if todate is not None:
+            hi = int(np.searchsorted(dates, date_to_int(todate), side='right'))
+        return {name: self._columns[name][start + lo:start + hi] for name in fields}
+
+    def latest(self, fields=FIELD_NAMES):
+        '''每只股票最后一行数据，返回 (codes, 字段 -> ndarray)。'''
+        nonempty = self.counts > 0
+        last_rows = (self.offsets + self.counts - 1)[nonempty]
+        codes = [code for code, ok in zip(self.codes, nonempty) if ok]
+        return codes, {name: np.asarray(self._columns[name][last_rows]) for name in fields}
+
+    def close(self):
+        for col in self._columns.values():
+            mm = getattr(col, '_mmap', None)
+            if mm is not None:
+                mm.close()
+        self._columns = {}
+
+
+def open_bar_store(store_dir=None, db_file=None):
+    '''
+    打开列式存储。目录不存在或损坏时返回 None；
+    传入 db_file 时还会检查存储是否与数据库一致，不一致同样返回 None。
+    '''
+    store_dir = store_dir or store_dir_for(db_file or DB_FILE)
+    if not os.path.exists(os.path.join(store_dir, META_FILE)):
+        return None
+    try:
+        store = BarStore(store_dir)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"警告: 无法打开列式存储 {store_dir}: {e}")
+        sys.stdout.flush()
+        return None
+    if db_file is not None and not store.is_fresh(db_file):
+        print(f"警告: 列式存储 {store_dir} 与数据库 {db_file} 不一致，请运行 bar_store.py 刷新")
+        sys.stdout.flush()
+        store.close()
+        return None
+    return store
+
+
+_shared_stores = {}  # (db_file, store_dir) -> (存储或 None, 打开时的 _store_state)
+
+
+def _store_state(db_file, store_dir):
+    '''数据库文件签名和存储 meta.json 的状态（刷新存储时整个目录被替换，meta.json 随之变化）。'''
+    try:
+        signature = tuple(sorted(file_signature(db_file).items()))
+    except OSError:
+        signature = None
+    try:
+        st = os.stat(os.path.join(store_dir, META_FILE))
+        meta = (st.st_ino, st.st_mtime_ns)
+    except OSError:
+        meta = None
+    return signature, meta
+
+
+def get_shared_store(db_file=DB_FILE, store_dir=None):
+    '''
+    进程内共享的存储实例，供各数据源复用，避免重复打开 memmap。
+    每次取用时比较数据库文件签名和存储的 meta.json：数据库写入后重新检查是否一致，
+    存储刷新或新建后重新打开；都未变化时直接返回上次的结果（包括 None），不重复检查。
+    旧的存储实例不主动关闭，已取出的切片在不再被引用后随 memmap 释放。
+    '''
+    store_dir = store_dir or store_dir_for(db_file)
+    key = (os.path.abspath(db_file), os.path.abspath(store_dir))
+    state = _store_state(db_file, store_dir)
+    cached = _shared_stores.get(key)
+    if cached is None or cached[1] != state:
+        _shared_stores[key] = cached = (open_bar_store(store_dir, db_file=db_file), state)
+    return cached[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='从 daily_data 表构建/刷新列式 K 线存储')
+    parser.add_argument('db_file', nargs='?', default=DB_FILE, help='SQLite 数据库文件')
+    parser.add_argument('--table', default=DAILY_DATA_TABLE, help='日线数据表名')
+    parser.add_argument('--store-dir', default=None, help='存储目录，默认在数据库同目录下的 bar_store/')
+    parser.add_argument('--rebuild', action='store_true', help='强制全量重建')
+    args = parser.parse_args()
+    changed = refresh_bar_store(args.db_file, args.store_dir, args.table, rebuild=args.rebuild)
+    if not changed:
+        print("信息: 列式存储已是最新")
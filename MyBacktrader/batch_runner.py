@@ -0,0 +1,276 @@
+'''
+批量回测（命令行，无需图形界面）
+
+对一个或多个股票池 CSV（可用通配符匹配 StockFilterApp 导出的 stock_pool_<时间戳>.csv）
+依次运行指定的策略，每次回测的结果写入单独的子目录：
+  trades.csv          交易记录（backtrader 策略在回测过程中分批写入）
+  log.txt             grok 策略的日志（回测过程中分批写入）
+  trade_report.txt    回测报告（字段与 chatgpt_stratege.py 相同，另加策略、股票池和年化收益率；
+                      交易笔数统一为成交的买入 / 卖出订单数）
+  equity.csv          每日总资产
+  equity.png          总资产走势图（matplotlib Agg 后端，不弹窗）
+所有回测的汇总写入输出目录下的 summary.csv。
+
+策略：
+  chatgpt   chatgpt_stratege.py 的 MyStrategy
+  grok      grok_strategy.py 的 MyMultiStockStrategy（最多 min(n, 5) 只持仓）
+  vector    vector_sim.py 的向量化模拟（规则与 MyStrategy 相同，速度快得多）
+
+用法：
+    python batch_runner.py --pool stock_pool.csv --strategy chatgpt grok
+    python batch_runner.py --pool "stock_pool_*.csv" --strategy vector --start 20220101 --out-dir batch_results
+'''
+import matplotlib
+matplotlib.use('Agg')  # 必须在导入 pyplot 和策略脚本之前设置
+
+import argparse
+import glob
+import os
+import sys
+import traceback
+from datetime import datetime
+
+import backtrader as bt
+import matplotlib.pyplot as plt
+import pandas as pd
+
+import chatgpt_stratege
+import grok_strategy
+from indicator_cache import refresh_indicator_cache
+from numpy_feed import NumpyData
+from param_sweep import annual_return
+from result_writers import CsvRecordWriter, TextLineWriter
+from universe_loader import load_universe
+from universe_pruning import prune_universe
+from vector_sim import (COMMISSION, DAILY_DATA_TABLE, DB_FILE, INITIAL_CASH, MAX_POSITIONS,
+                        last_trade_date, run_vector_backtest, strategy_minperiod)
+
+# --- 配置参数 ---
+BATCH_OUT_DIR = 'batch_results'
+SUMMARY_CSV = 'summary.csv'
+STRATEGIES = ('chatgpt', 'grok', 'vector')
+PRUNE_UNIVERSE = True  # backtrader 策略只加入出现过买入信号的股票（结果不变，见 universe_pruning.py）
+
+
+class EquityCurve(bt.Analyzer):
+    '''记录策略开始运行后每个交易日结束时的总资产（与 vector_sim 的 start_row 之后一致）。'''
+    def __init__(self):
+        self.rows = []
+
+    def prenext(self):
+        pass
+
+    def next(self):
+        self.rows.append((int(self.strategy.datetime.date(0).strftime('%Y%m%d')), self.strategy.broker.getvalue()))
+
+    def get_analysis(self):
+        return self.rows
+
+
+class FillCount(bt.Analyzer):
+    '''成交的买入 / 卖出订单数，与 chatgpt / vector 的交易记录条数口径相同（grok 的交易记录另有“交易结束”行）。'''
+    def __init__(self):
+        self.fills = 0
+
+    def notify_order(self, order):
+        if order.status == order.Completed:
+            self.fills += 1
+
+    def get_analysis(self):
+        return self.fills
+
+
+def expand_pools(patterns):
+    '''股票池路径或通配符 -> 去重后的 CSV 路径列表（保持给出的顺序）。'''
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            print(f"警告: 没有找到与 {pattern} 匹配的股票池文件")
+        paths.extend(matches)
+    return list(dict.fromkeys(paths))
+
+
+def read_pool(path):
+    return pd.read_csv(path, encoding='utf-8')['ts_code'].dropna().astype(str).tolist()
+
+
+def _run_bt(strategy, codes, fromdate, todate, db_file, table, run_dir=None):
+    '''
+    用 backtrader 运行 chatgpt / grok 的策略，返回与 vector_sim 结果相同结构的字典。
+    给出 run_dir 时交易记录和日志在回测过程中写入 run_dir 下的 trades.csv / log.txt，
+    返回的 trades / log_messages 为已关闭的写出器，否则为列表；fills 为成交的订单数。
+    '''
+    # K 线不足最长均线周期的股票会让 backtrader 越界，与 vector_sim 一样先跳过
+    bars_by_code, skipped = load_universe(codes, fromdate, todate, db_file=db_file, table=table,
+                                          min_bars=strategy_minperiod())
+    if not bars_by_code:
+        raise ValueError('没有可回测的股票')
+    pool_codes = list(bars_by_code)  # 裁剪前的股票，报告中的回测股票数与 vector 口径相同
+    pool_size = len(pool_codes)
+    if PRUNE_UNIVERSE:
+        kept, _ = prune_universe(pool_codes, bars_by_code)
+        print(f"信息: 按买入信号裁剪股票池，{pool_size} 只中保留 {len(kept)} 只")
+        sys.stdout.flush()
+        bars_by_code = {code: bars_by_code[code] for code in kept}
+    refresh_indicator_cache(list(bars_by_code), db_file, table=table)
+
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.broker.setcash(INITIAL_CASH)
+    cerebro.broker.setcommission(commission=COMMISSION)
+    for code, bars in bars_by_code.items():
+        cerebro.adddata(NumpyData(bars=bars), name=code)
+    writers = []
+    if strategy == 'chatgpt':
+        if run_dir:
+            writers.append(CsvRecordWriter(os.path.join(run_dir, 'trades.csv'), chatgpt_stratege.TRADE_LOG_COLUMNS,
+                                           encoding='utf-8-sig'))
+        cerebro.addstrategy(chatgpt_stratege.MyStrategy, pool_size=pool_size, db_file=db_file,
+                            trade_writer=writers[0] if writers else None)
+    else:
+        if run_dir:
+            writers.append(CsvRecordWriter(os.path.join(run_dir, 'trades.csv'), grok_strategy.TRADE_RECORD_COLUMNS,
+                                           encoding='utf-8-sig'))
+            writers.append(TextLineWriter(os.path.join(run_dir, 'log.txt')))
+        cerebro.addstrategy(grok_strategy.MyMultiStockStrategy, max_positions=min(pool_size, MAX_POSITIONS),
+                            pool_size=pool_size, db_file=db_file, trade_writer=writers[0] if writers else None,
+                            log_writer=writers[1] if writers else None)
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
+    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
+    cerebro.addanalyzer(EquityCurve, _name='equity')
+    cerebro.addanalyzer(FillCount, _name='fills')
+    try:
+        strat = cerebro.run()[0]
+    finally:
+        for writer in writers:
+            writer.close()
+
+    curve = strat.analyzers.equity.get_analysis()
+    return {
+        'dates': [row[0] for row in curve],
+        'equity': [row[1] for row in curve],
+        'trades': strat.trade_log if strategy == 'chatgpt' else strat.trade_records,
+        'fills': strat.analyzers.fills.get_analysis(),
+        'final_value': cerebro.broker.getvalue(),
+        'max_drawdown': strat.analyzers.drawdown.get_analysis()['max']['drawdown'],
+        'sharpe': strat.analyzers.sharpe.get_analysis(),
+        'codes': pool_codes,
+        'log_messages': getattr(strat, 'log_messages', []),
+    }, skipped
+
+
+def run_one(strategy, pool_path, fromdate, todate, run_dir, db_file=DB_FILE, table=DAILY_DATA_TABLE):
+    '''运行一次回测并写出结果文件，返回汇总行。'''
+    codes = read_pool(pool_path)
+    if strategy == 'vector':
+        result, skipped = run_vector_backtest(codes, fromdate, todate, db_file=db_file, table=table)
+        result['dates'] = result['dates'][result['start_row']:]
+        result['equity'] = result['equity'][result['start_row']:]
+        result['fills'] = len(result['trades'])  # 每条记录一次成交
+    else:
+        os.makedirs(run_dir, exist_ok=True)
+        result, skipped = _run_bt(strategy, codes, fromdate, todate, db_file, table, run_dir=run_dir)
+    for ts_code, reason in skipped.items():
+        print(f"警告: 股票 {ts_code} {reason}")
+
+    os.makedirs(run_dir, exist_ok=True)
+    if strategy == 'vector':
+        # backtrader 策略的交易记录和日志已在回测过程中写入 run_dir
+        pd.DataFrame(result['trades']).to_csv(os.path.join(run_dir, 'trades.csv'), index=False, encoding='utf-8-sig')
+    equity = pd.DataFrame({'date': result['dates'], 'value': result['equity']})
+    equity.to_csv(os.path.join(run_dir, 'equity.csv'), index=False)
+
+    final_value = result['final_value']
+    anret = annual_return(equity['date'].to_numpy(), equity['value'].to_numpy(), 0, INITIAL_CASH)
+    report = {
+        '生成日期': datetime.today().strftime('%Y-%m-%d'),
+        '策略': strategy,
+        '股票池': f"{os.path.basename(pool_path)}（回测 {len(result['codes'])} 只，跳过 {len(skipped)} 只）",
+        '回测区间': f"{fromdate:%Y-%m-%d} 至 {todate:%Y-%m-%d}",
+        '初始资金': f"{INITIAL_CASH:.0f} 元",
+        '期末资产': f"{final_value:.2f} 元",
+        '收益': f"{final_value - INITIAL_CASH:.2f} 元",
+        '年化收益率': f"{anret * 100:.2f}%",
+        '最大回撤': f"{result['max_drawdown']:.2f}%",
+        '夏普比率': str(result['sharpe']),
+        '交易笔数': f"{result['fills']}"
+    }
+    with open(os.path.join(run_dir, 'trade_report.txt'), 'w', encoding='utf-8') as f:
+        f.write("=== 回测交易报告 ===\n")
+        for k, v in report.items():
+            f.write(f"{k}：{v}\n")
+
+    fig, ax = plt.subplots(figsize=(14, 7))
+    ax.plot(pd.to_datetime(equity['date'].astype(str), format='%Y%m%d'), equity['value'])
+    ax.set_title(f"{strategy} / {os.path.basename(pool_path)}")
+    ax.grid(True)
+    fig.tight_layout()
+    fig.savefig(os.path.join(run_dir, 'equity.png'))
+    plt.close(fig)
+
+    return {
+        'final_value': final_value,
+        'annual_return': anret,
+        'max_drawdown': result['max_drawdown'],
+        'sharpe': result['sharpe']['sharperatio'],
+        'trades': result['fills'],
+        'stocks': len(result['codes']),
+    }
+
+
+def run_batch(pool_paths, strategies, fromdate, todate, out_dir=BATCH_OUT_DIR, db_file=DB_FILE,
+              table=DAILY_DATA_TABLE):
+    '''对每个股票池依次运行每个策略，单次回测失败不影响其余回测。返回汇总 DataFrame。'''
+    rows = []
+    for pool_path in pool_paths:
+        pool_name = os.path.splitext(os.path.basename(pool_path))[0]
+        for strategy in strategies:
+            run_dir = os.path.join(out_dir, f"{pool_name}_{strategy}")
+            print(f"信息: 回测 {pool_path} / {strategy} -> {run_dir}")
+            sys.stdout.flush()
+            row = {'pool': pool_path, 'strategy': strategy, 'run_dir': run_dir}
+            try:
+                row.update(run_one(strategy, pool_path, fromdate, todate, run_dir, db_file, table))
+                row['status'] = 'ok'
+            except Exception as e:
+                print(f"错误: 回测 {pool_path} / {strategy} 失败: {e}")
+                traceback.print_exc()
+                row['status'] = f"{type(e).__name__}: {e}"
+            sys.stdout.flush()
+            rows.append(row)
+
+    columns = ['pool', 'strategy', 'status', 'stocks', 'final_value', 'annual_return', 'max_drawdown',
+               'sharpe', 'trades', 'run_dir']
+    summary = pd.DataFrame(rows, columns=columns)
+    os.makedirs(out_dir, exist_ok=True)
+    summary.to_csv(os.path.join(out_dir, SUMMARY_CSV), index=False, encoding='utf-8-sig')
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='批量回测（无图形界面）')
+    parser.add_argument('--pool', nargs='+', default=[chatgpt_stratege.STOCK_POOL_CSV],
+                        help='股票池 CSV 路径或通配符，如 "stock_pool_*.csv"')
+    parser.add_argument('--strategy', nargs='+', choices=STRATEGIES, default=['chatgpt'])
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--table', default=DAILY_DATA_TABLE)
+    parser.add_argument('--start', default='20220101')
+    parser.add_argument('--end', default=None, help='默认为数据库最后一个交易日')
+    parser.add_argument('--out-dir', default=BATCH_OUT_DIR)
+    args = parser.parse_args()
+
+    pool_paths = expand_pools(args.pool)
+    if not pool_paths:
+        print("错误: 没有可用的股票池文件")
+        sys.stdout.flush()
+        sys.exit(1)
+    fromdate = datetime.strptime(args.start, '%Y%m%d')
+    todate = datetime.strptime(args.end, '%Y%m%d') if args.end else last_trade_date(args.db, args.table)
+
+    summary = run_batch(pool_paths, args.strategy, fromdate, todate, out_dir=args.out_dir,
+                        db_file=args.db, table=args.table)
+    failed = int((summary['status'] != 'ok').sum())
+    print(f"信息: 共 {len(summary)} 次回测，失败 {failed} 次，汇总已写入 "
+          f"{os.path.join(args.out_dir, SUMMARY_CSV)}")
+    sys.stdout.flush()
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,102 @@
+'''
+数据访问层耗时基准
+
+在合成数据库上对比两种访问方式：
+  1. 原做法：每次查询 sqlite3.connect() + execute + close()，不设置 PRAGMA
+  2. db_access：从只读连接池借出调优过的连接，语句编译结果按连接缓存
+场景与脚本中的实际调用一致：
+  - 最后交易日：MAX(trade_date)（get_last_trade_date / run_backtest 的预检查）
+  - 单只股票区间：每个数据源 start 时的 WHERE ts_code = ? AND trade_date BETWEEN ? AND ?
+  - 最新行情：选股工具的 GROUP BY 自连接（每只股票最后一个交易日）
+
+用法：
+    python bench_db_access.py --stocks 1000 --start 20200101 --end 20231231
+'''
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import db_access
+from synthetic_data import DAILY_DATA_TABLE, create_synthetic_db, synthetic_codes
+
+MAX_DATE_SQL = f"SELECT MAX(trade_date) FROM {DAILY_DATA_TABLE}"
+RANGE_SQL = f"""
+    SELECT trade_date, open, high, low, close, vol
+    FROM {DAILY_DATA_TABLE}
+    WHERE ts_code = ? AND trade_date BETWEEN ? AND ?
+    ORDER BY trade_date ASC
+"""
+LATEST_SQL = f"""
+    SELECT t1.ts_code, t1.trade_date, t1.close, t1.pe_ttm, t1.pb, t1.total_mv
+    FROM {DAILY_DATA_TABLE} t1
+    INNER JOIN (
+        SELECT ts_code, MAX(trade_date) AS max_trade_date FROM {DAILY_DATA_TABLE} GROUP BY ts_code
+    ) t2 ON t1.ts_code = t2.ts_code AND t1.trade_date = t2.max_trade_date
+"""
+
+
+def query_per_connection(db_file, sql, params=()):
+    '''原脚本中的做法，仅作为基准对照。'''
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def time_calls(func, db_file, calls):
+    t0 = time.perf_counter()
+    rows = 0
+    for sql, params in calls:
+        rows += len(func(db_file, sql, params))
+    return time.perf_counter() - t0, rows
+
+
+def run_benchmark(n_stocks, start, end, repeats, workdir):
+    db_file = os.path.join(workdir, 'bench_daily_data.db')
+    print(f"生成合成数据库: {n_stocks} 只股票, {start} - {end}")
+    sys.stdout.flush()
+    create_synthetic_db(db_file, n_stocks, start, end, seed=1)
+    conn = sqlite3.connect(db_file)
+    # 与覆盖目录 / 日线下载建立的索引一致，MAX(trade_date) 不必扫描全表
+    conn.execute(f"CREATE INDEX idx_{DAILY_DATA_TABLE}_trade_date ON {DAILY_DATA_TABLE} (trade_date)")
+    conn.close()
+    codes = synthetic_codes(n_stocks)
+
+    scenarios = (
+        ('最后交易日', [(MAX_DATE_SQL, ())] * (repeats * 100)),
+        ('单只股票区间', [(RANGE_SQL, (code, start, end)) for code in codes] * repeats),
+        ('最新行情', [(LATEST_SQL, ())] * repeats),
+    )
+    results = []
+    for label, calls in scenarios:
+        db_access.close_all()
+        old, rows_old = time_calls(query_per_connection, db_file, calls)
+        new, rows_new = time_calls(db_access.fetch_all, db_file, calls)
+        assert rows_old == rows_new
+        results.append((label, len(calls), old, new))
+    db_access.close_all()
+
+    print(f"\n{'场景':<12}{'查询数':>8}{'每次连接(s)':>14}{'连接池(s)':>12}{'加速':>8}")
+    for label, n, old, new in results:
+        print(f"{label:<12}{n:>8}{old:>14.3f}{new:>12.3f}{old / new:>8.1f}x")
+    sys.stdout.flush()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='数据访问层耗时基准')
+    parser.add_argument('--stocks', type=int, default=1000)
+    parser.add_argument('--start', default='20200101')
+    parser.add_argument('--end', default='20231231')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='bench_db_')
+    try:
+        run_benchmark(args.stocks, args.start, args.end, args.repeats, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,143 @@
+'''
+数据源加载耗时基准
+
+对比四种加载路径，在合成数据库上按 cerebro 的预加载流程（reset/_start/preload）
+加载 N 只股票，输出折算到每 1000 只股票的耗时：
+  1. 逐行 SQLiteData：原 chatgpt/grok 脚本的做法（每行 strptime + date2num + float）
+  2. PandasData：原 Gemini 脚本的做法（read_sql_query + to_datetime + PandasData）
+  3. NumpyData（SQLite）：一次查询 + 向量化转换 + 整段写入 lines
+  4. NumpyData（列式存储）：memmap 切片 + 整段写入 lines
+
+用法：
+    python bench_feed_load.py --stocks 1000 --start 20200101 --end 20231231
+'''
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import backtrader as bt
+import pandas as pd
+
+import bar_store
+from bar_store import build_bar_store
+from numpy_feed import NumpyData, load_numpy_bars
+from synthetic_data import DAILY_DATA_TABLE, create_synthetic_db, synthetic_codes
+
+
+class RowByRowSQLiteData(bt.feeds.DataBase):
+    '''原脚本中的逐行数据源，仅作为基准对照。'''
+    params = (('dataname', None), ('db_file', None), ('fromdate', None), ('todate', None))
+
+    def start(self):
+        super().start()
+        conn = sqlite3.connect(self.p.db_file)
+        self.rows = conn.execute(f"""
+            SELECT trade_date, open, high, low, close, vol
+            FROM {DAILY_DATA_TABLE}
+            WHERE ts_code = ? AND trade_date BETWEEN ? AND ?
+            ORDER BY trade_date ASC
+        """, (self.p.dataname, self.p.fromdate.strftime('%Y%m%d'), self.p.todate.strftime('%Y%m%d'))).fetchall()
+        conn.close()
+        self.pos = 0
+
+    def _load(self):
+        if self.pos >= len(self.rows):
+            return False
+        row = self.rows[self.pos]
+        self.pos += 1
+        dt = datetime.strptime(row[0], '%Y%m%d')
+        self.lines.datetime[0] = bt.date2num(dt)
+        self.lines.open[0] = float(row[1]) if row[1] is not None else float('nan')
+        self.lines.high[0] = float(row[2]) if row[2] is not None else float('nan')
+        self.lines.low[0] = float(row[3]) if row[3] is not None else float('nan')
+        self.lines.close[0] = float(row[4]) if row[4] is not None else float('nan')
+        self.lines.volume[0] = float(row[5]) if row[5] is not None else float('nan')
+        self.lines.openinterest[0] = float('nan')
+        return True
+
+
+def make_row_by_row(code, db_file, fromdate, todate):
+    return RowByRowSQLiteData(dataname=code, db_file=db_file, fromdate=fromdate, todate=todate)
+
+
+def make_pandas(code, db_file, fromdate, todate):
+    conn = sqlite3.connect(db_file)
+    df = pd.read_sql_query(f"""
+        SELECT trade_date, open, high, low, close, vol
+        FROM {DAILY_DATA_TABLE}
+        WHERE ts_code = ? AND trade_date BETWEEN ? AND ?
+        ORDER BY trade_date ASC
+    """, conn, params=(code, fromdate.strftime('%Y%m%d'), todate.strftime('%Y%m%d')))
+    conn.close()
+    df.columns = ['datetime', 'open', 'high', 'low', 'close', 'volume']
+    df['datetime'] = pd.to_datetime(df['datetime'], format='%Y%m%d')
+    df.set_index('datetime', inplace=True)
+    df['openinterest'] = 0.0
+    return bt.feeds.PandasData(dataname=df)
+
+
+def make_numpy(code, db_file, fromdate, todate):
+    bars = load_numpy_bars(code, fromdate, todate, db_file, DAILY_DATA_TABLE)
+    return NumpyData(bars=bars, fromdate=fromdate, todate=todate)
+
+
+def time_feeds(factory, codes, db_file, fromdate, todate):
+    '''按 cerebro 的顺序创建并预加载数据源，返回 (耗时秒数, 总 K 线数)。'''
+    cerebro = bt.Cerebro()
+    t0 = time.perf_counter()
+    bars = 0
+    for code in codes:
+        data = factory(code, db_file, fromdate, todate)
+        cerebro.adddata(data, name=code)
+        data.reset()
+        data._start()
+        data.preload()
+        bars += data.buflen()
+    return time.perf_counter() - t0, bars
+
+
+def run_benchmark(n_stocks, start, end, workdir):
+    db_file = os.path.join(workdir, 'bench_daily_data.db')
+    print(f"生成合成数据库: {n_stocks} 只股票, {start} - {end}")
+    sys.stdout.flush()
+    create_synthetic_db(db_file, n_stocks, start, end, seed=1)
+    codes = synthetic_codes(n_stocks)
+    fromdate = datetime.strptime(start, '%Y%m%d')
+    todate = datetime.strptime(end, '%Y%m%d')
+
+    results = []
+    bar_store._shared_stores.clear()
+    for label, factory in (('逐行 SQLiteData', make_row_by_row),
+                           ('PandasData', make_pandas),
+                           ('NumpyData (SQLite)', make_numpy)):
+        elapsed, bars = time_feeds(factory, codes, db_file, fromdate, todate)
+        results.append((label, elapsed, bars))
+
+    build_bar_store(db_file, table=DAILY_DATA_TABLE)
+    bar_store._shared_stores.clear()
+    elapsed, bars = time_feeds(make_numpy, codes, db_file, fromdate, todate)
+    results.append(('NumpyData (列式存储)', elapsed, bars))
+
+    print(f"\n{'路径':<22}{'总耗时(s)':>12}{'每1000只(s)':>14}{'K线数':>12}")
+    for label, elapsed, bars in results:
+        print(f"{label:<22}{elapsed:>12.3f}{elapsed / n_stocks * 1000:>14.3f}{bars:>12}")
+    sys.stdout.flush()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='数据源加载耗时基准')
+    parser.add_argument('--stocks', type=int, default=1000)
+    parser.add_argument('--start', default='20200101')
+    parser.add_argument('--end', default='20231231')
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='bench_feed_')
+    try:
+        run_benchmark(args.stocks, args.start, args.end, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,204 @@
+'''
+策略日志的开销基准
+
+对比 Gemini_strategy 原来的日志写法（每条日志 print 一次并 sys.stdout.flush()，
+sys.stdout 为按行缓冲的 TextIOWrapper，同时写入日志文件）与 bt_logging 的几种级别：
+  INFO            控制台 + 日志文件，经队列由后台线程写出
+  INFO 只写文件   不输出到控制台
+  WARNING         INFO 日志在 isEnabledFor 处返回（策略的日志几乎都是 INFO）
+  OFF             关闭全部日志
+  1. 单独写 --messages 条与策略相同格式的日志（计时含 stop() 等待队列写完）；
+  2. 在合成数据库上运行 Gemini 的 MyMultiStockStrategy，比较回测总耗时，并校验交易记录一致。
+控制台输出默认写入一个伪终端（--console pty，由子进程 cat 读走并丢弃），接近在终端中运行的情况；
+--console file 写入临时文件，每次 flush 的代价最小，是对原写法最有利的情况。
+
+用法：
+    python bench_logging.py --messages 200000 --stocks 300 --start 20180101 --end 20231231
+    python bench_logging.py --console file
+'''
+import argparse
+import contextlib
+import io
+import os
+import pty
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import backtrader as bt
+
+import Gemini_strategy
+from bench_scheduler import TradeCollector, _rsi_zero_division
+from bt_logging import INFO, get_log, start_logging
+from numpy_feed import NumpyData
+from result_writers import TextLineWriter
+from synthetic_data import DAILY_DATA_TABLE, create_synthetic_db, synthetic_codes
+from universe_loader import load_universe
+
+MODES = (
+    ('原写法', None),
+    ('INFO', {'level': 'INFO', 'console_level': 'INFO'}),
+    ('INFO 只写文件', {'level': 'INFO', 'console_level': None}),
+    ('WARNING', {'level': 'WARNING', 'console_level': 'WARNING'}),
+    ('OFF', {'level': 'OFF', 'console_level': None}),
+)
+
+
+CONSOLE = 'pty'
+
+
+@contextlib.contextmanager
+def console_sink(path, line_buffering):
+    '''把 sys.stdout 换成写入伪终端（CONSOLE == 'pty'）或 path 的 TextIOWrapper（原写法按行缓冲）。'''
+    saved, reader = sys.stdout, None
+    if CONSOLE == 'pty':
+        master, slave = pty.openpty()
+        reader = subprocess.Popen(['cat'], stdin=master, stdout=subprocess.DEVNULL)
+        os.close(master)
+        raw = open(slave, 'wb')
+    else:
+        raw = open(path, 'wb')
+    sys.stdout = io.TextIOWrapper(raw, encoding='utf-8', line_buffering=line_buffering)
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = saved
+        if reader is not None:
+            reader.wait()
+
+
+def legacy_log(log_messages, dt, ts_code, message):
+    '''Gemini_strategy 原来的 MyMultiStockStrategy.log。'''
+    message = f'{dt.isoformat()}, [{ts_code}] {message}'
+    log_messages.append(message)
+    print(message)
+    sys.stdout.flush()
+
+
+class LegacyLogStrategy(Gemini_strategy.MyMultiStockStrategy):
+    params = (('log_file', None),)
+
+    def __init__(self):
+        super().__init__()
+        self.log_messages = TextLineWriter(self.p.log_file)
+
+    def log(self, txt, *args, dt=None, data=None, **fields):
+        dt = dt or self.datas[0].datetime.date(0)
+        ts_code_str = f"[{data._name}] " if data else ""
+        message = f'{dt.isoformat()}, {ts_code_str}{txt % args if args else txt}'
+        self.log_messages.append(message)
+        print(message)
+        sys.stdout.flush()
+
+    def stop(self):
+        self.log_messages.close()
+
+
+def bench_messages(n, workdir):
+    '''单独写 n 条日志，返回 {模式: 耗时}。'''
+    days = [date(2020, 1, 1) + timedelta(days=i % 1500) for i in range(n)]
+    console, log_file = os.path.join(workdir, 'console.txt'), os.path.join(workdir, 'log.txt')
+    fmt = '买入执行, 股票: %s, 价格: %.2f, 数量: %.2f, 成本: %.2f, 佣金: %.2f'
+    timings = {}
+    for label, kwargs in MODES:
+        with console_sink(console, line_buffering=kwargs is None):
+            t0 = time.perf_counter()
+            if kwargs is None:
+                with TextLineWriter(log_file) as writer:
+                    for i, dt in enumerate(days):
+                        price, size = 10.0 + i % 50, 100.0 * (i % 30 + 1)
+                        legacy_log(writer, dt, '000001.SZ', fmt % ('000001.SZ', price, size, price * size, 5.0))
+            else:
+                log = get_log('bench')
+                with start_logging('bench', log_file=log_file, **kwargs):
+                    for i, dt in enumerate(days):
+                        price, size = 10.0 + i % 50, 100.0 * (i % 30 + 1)
+                        log.log(INFO, fmt, '000001.SZ', price, size, price * size, 5.0,
+                                date=dt, ts_code='000001.SZ', event='buy_filled', price=price, size=size)
+            timings[label] = time.perf_counter() - t0
+    return timings
+
+
+def run_gemini(cls, bars_by_code, logging_kwargs, workdir):
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.broker.setcash(300000.0)
+    cerebro.broker.setcommission(commission=0.0003)
+    for code, bars in bars_by_code.items():
+        cerebro.adddata(NumpyData(bars=bars, openinterest=0.0), name=code)
+    log_file = os.path.join(workdir, 'backtest_log.txt')
+    if os.path.exists(log_file):
+        os.remove(log_file)
+    cerebro.addstrategy(cls, **({'log_file': log_file} if logging_kwargs is None else {}))
+    cerebro.addanalyzer(TradeCollector, _name='collector')
+    with console_sink(os.path.join(workdir, 'console.txt'), line_buffering=logging_kwargs is None):
+        t0 = time.perf_counter()
+        if logging_kwargs is None:
+            strat = cerebro.run()[0]
+        else:
+            with start_logging('gemini', log_file=log_file, **logging_kwargs):
+                strat = cerebro.run()[0]
+        elapsed = time.perf_counter() - t0
+    lines = 0
+    if os.path.exists(log_file):
+        with open(log_file, encoding='utf-8') as f:
+            lines = sum(1 for _ in f)
+    return elapsed, lines, strat.analyzers.collector.trades
+
+
+def run_benchmark(n_messages, n_stocks, start, end, workdir):
+    print(f"信息: 单独写 {n_messages} 条日志")
+    sys.stdout.flush()
+    messages = bench_messages(n_messages, workdir)
+
+    db_file = os.path.join(workdir, 'bench_daily_data.db')
+    print(f"生成合成数据库: {n_stocks} 只股票, {start} - {end}（停牌概率 5%）")
+    sys.stdout.flush()
+    create_synthetic_db(db_file, n_stocks, start, end, seed=1, suspend_prob=0.05)
+    bars_by_code, _ = load_universe(synthetic_codes(n_stocks), start, end, db_file=db_file, table=DAILY_DATA_TABLE)
+    bars_by_code = {code: bars for code, bars in bars_by_code.items()
+                    if not any(_rsi_zero_division(bars['close'], period) for period in (6, 13))}
+
+    backtests = {}
+    cwd = os.getcwd()
+    os.chdir(workdir)  # 策略按相对路径查找指标缓存，这里没有缓存，使用 bt 指标
+    try:
+        for label, kwargs in MODES:
+            cls = LegacyLogStrategy if kwargs is None else Gemini_strategy.MyMultiStockStrategy
+            backtests[label] = run_gemini(cls, bars_by_code, kwargs, workdir)
+            print(f"信息: Gemini {label} 完成，用时 {backtests[label][0]:.1f} 秒，日志 {backtests[label][1]} 行")
+            sys.stdout.flush()
+    finally:
+        os.chdir(cwd)
+
+    base_msg, base_bt = messages['原写法'], backtests['原写法'][0]
+    print(f"\n{'模式':<14}{'写日志(s)':>10}{'相对原写法':>12}{'回测(s)':>10}{'相对原写法':>12}{'日志行数':>10}")
+    for label, _ in MODES:
+        elapsed, lines, _ = backtests[label]
+        print(f"{label:<14}{messages[label]:>10.2f}{messages[label] / base_msg:>12.0%}"
+              f"{elapsed:>10.1f}{elapsed / base_bt:>12.0%}{lines:>10}")
+    same = all(result[2] == backtests['原写法'][2] for result in backtests.values())
+    print(f"交易记录{'一致' if same else '不一致'}（{len(backtests['原写法'][2])} 笔）")
+    sys.stdout.flush()
+    if not same:
+        sys.exit(1)
+    return messages, backtests
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='策略日志的开销基准')
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--stocks', type=int, default=300)
+    parser.add_argument('--start', default='20180101')
+    parser.add_argument('--end', default='20231231')
+    parser.add_argument('--console', choices=('pty', 'file'), default=CONSOLE)
+    args = parser.parse_args()
+    CONSOLE = args.console
+    workdir = tempfile.mkdtemp(prefix='bench_logging_')
+    try:
+        run_benchmark(args.messages, args.stocks, args.start, args.end, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
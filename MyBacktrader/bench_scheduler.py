@@ -0,0 +1,274 @@
+'''
+策略 next() 候选调度的耗时基准
+
+在含停牌日的合成数据库上，分别运行三个策略的原写法（逐只遍历全部数据源，仅作为基准对照）
+和 candidate_scheduler 调度后的写法，输出回测总耗时、其中 next() 的耗时和每根 K 线平均检查的股票数，
+并校验两种写法的交易记录完全相同。
+Gemini_strategy 的原写法调用了不存在的 has_a_future() 和 bt.Order.Open，对照版本换成 has_next_bar() 和 bt.Order.Market；
+MyStrategy 的对照版本同样在数据源的最后一根 K 线上跳过买入信号（原写法 data.open[1] 越界），其余不变。
+
+用法：
+    python bench_scheduler.py --stocks 1000 --start 20200101 --end 20231231
+    python bench_scheduler.py --stocks 1000 --profile   # 额外输出原写法 next() 的 cProfile 前几项
+'''
+import argparse
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+import chatgpt_stratege
+import Gemini_strategy
+import grok_strategy
+from candidate_scheduler import has_next_bar
+from numpy_feed import NumpyData
+from synthetic_data import DAILY_DATA_TABLE, create_synthetic_db, synthetic_codes
+from universe_loader import load_universe
+
+
+class LegacyChatgpt(chatgpt_stratege.MyStrategy):
+    def next(self):
+        p = min(len(self.datas), 5)
+        m = len([d for d in self.datas if self.getposition(d).size > 0])
+        available_cash = self.broker.get_cash()
+
+        for data in self.datas:
+            i = self.inds[data]
+            pos = self.getposition(data)
+            if len(data) < 240 or self.orders[data]:
+                continue
+
+            if pos and data.close[0] < i['ma20'][0]:
+                self.orders[data] = self.close(data)
+            elif not pos and m < p:
+                conds = [
+                    data.close[0] > i['ma240'][0],
+                    i['ma240'][0] > i['ma240'][-1],
+                    i['ma60'][0] > i['ma60'][-1] or i['ma20'][0] > i['ma20'][-1],
+                    i['rsi6'][0] > 70 and i['rsi13'][0] > 50,
+                    i['vol_ma3'][0] > i['vol_ma8'][0] and i['vol_ma3'][0] > i['vol_ma3'][-1] and i['vol_ma8'][0] > i['vol_ma8'][-1]
+                ]
+                if all(conds) and has_next_bar(data):
+                    allocation = 1 / (p - m)
+                    amount = available_cash * allocation
+                    size = int((amount / data.open[1]) // 100 * 100)
+                    if size > 0:
+                        self.orders[data] = self.buy(data=data, size=size)
+
+
+class LegacyGrok(grok_strategy.MyMultiStockStrategy):
+    def next(self):
+        for d in self.datas:
+            ind = self.indicators[d]
+            required_bars = max(ind['ma240'].params.period, ind['ma60'].params.period,
+                                ind['ma20'].params.period, ind['vol_ma3'].params.period,
+                                ind['vol_ma8'].params.period, ind['rsi13'].params.period,
+                                ind['rsi6'].params.period)
+            if len(d) <= required_bars:
+                continue
+            if any(ind[key][0] is None for key in ind):
+                continue
+            if d in self.order:
+                continue
+            position = self.getposition(d)
+            if position:
+                if len(d) > 1 and d.close[-1] < ind['ma20'][-1]:
+                    self.log(f'触发卖出信号 (跌破20均线), 股票: {d._name}, 当前价: {d.close[-1]:.2f}, 20日均线: {ind["ma20"][-1]:.2f}', data=d)
+                    self.order[d] = self.sell(data=d, size=position.size, exectype=bt.Order.Market, valid=1)
+                continue
+            if self.num_positions < self.max_positions:
+                cond1 = d.close[0] > ind['ma240'][0]
+                cond2 = len(ind['ma240']) > 1 and ind['ma240'][0] > ind['ma240'][-1]
+                cond3 = (len(ind['ma60']) > 1 and ind['ma60'][0] > ind['ma60'][-1]) or \
+                        (len(ind['ma20']) > 1 and ind['ma20'][0] > ind['ma20'][-1])
+                cond4 = ind['rsi6'][0] > 70 and ind['rsi13'][0] > 50
+                cond5 = ind['vol_ma3'][0] > ind['vol_ma8'][0] and \
+                        len(ind['vol_ma3']) > 1 and ind['vol_ma3'][0] > ind['vol_ma3'][-1] and \
+                        len(ind['vol_ma8']) > 1 and ind['vol_ma8'][0] > ind['vol_ma8'][-1]
+                if all([cond1, cond2, cond3, cond4, cond5]):
+                    available_cash = self.broker.getcash()
+                    if self.num_positions < self.max_positions:
+                        fraction = 1.0 / (self.max_positions - self.num_positions)
+                        buy_amount = available_cash * fraction
+                        if buy_amount > 0:
+                            size = (buy_amount // d.close[0]) // 100 * 100  # 按100股整数倍买入
+                            if size > 0:
+                                self.log(f'发出买入信号, 股票: {d._name}, 建议买入数量: {size}, 占用资金: {size * d.close[0]:.2f}', data=d)
+                                self.order[d] = self.buy(data=d, size=size, exectype=bt.Order.Market, valid=1)
+
+
+class LegacyGemini(Gemini_strategy.MyMultiStockStrategy):
+    def next(self):
+        current_num_positions = len([d for d in self.positions if self.positions[d].size != 0])
+
+        for d in self.datas:
+            if not has_next_bar(d):
+                continue
+
+            ind = self.inds[d]
+            max_period = max([ind[key].params.period for key in ind if hasattr(ind[key], 'params')])
+            if len(d) <= max_period:
+                continue
+
+            if any(ind[key][0] is None or pd.isna(ind[key][0]) for key in ind):
+                continue
+
+            if d in self.orders and self.orders[d] is not None:
+                continue
+
+            position = self.getposition(d)
+
+            if position:
+                ma20_current = ind['ma20'][0]
+                if d.close[0] < ma20_current:
+                    self.log(f'触发卖出信号 (跌破20均线), 股票: {d._name}, 当前价: {d.close[0]:.2f}, 20日均线: {ma20_current:.2f}', data=d)
+                    self.orders[d] = self.close(data=d, exectype=bt.Order.Market)
+                continue
+
+            if not position and current_num_positions < self.p.max_positions:
+                cond1 = d.close[0] > ind['ma240'][0]
+                cond2 = ind['ma240'][0] > ind['ma240'][-1]
+                cond3 = (ind['ma60'][0] > ind['ma60'][-1]) or (ind['ma20'][0] > ind['ma20'][-1])
+                cond4 = ind['rsi6'][0] > 70 and ind['rsi13'][0] > 50
+                cond5 = (ind['vol_ma3'][0] > ind['vol_ma8'][0]) and \
+                        (ind['vol_ma3'][0] > ind['vol_ma3'][-1]) and \
+                        (ind['vol_ma8'][0] > ind['vol_ma8'][-1])
+                if all([cond1, cond2, cond3, cond4, cond5]):
+                    available_cash = self.broker.getcash()
+                    if available_cash > 0:
+                        denominator = self.p.max_positions - current_num_positions
+                        if denominator <= 0:
+                            continue
+                        funds_to_invest = available_cash / denominator
+                        price_to_buy = d.open[1]
+                        if price_to_buy is not None and not pd.isna(price_to_buy) and price_to_buy > 0:
+                            size = funds_to_invest // price_to_buy
+                            if size > 0:
+                                self.log(f'发出买入信号, 股票: {d._name}, 建议买入数量: {size}, 占用资金: {size * price_to_buy:.2f}', data=d)
+                                self.orders[d] = self.buy(data=d, size=size, exectype=bt.Order.Market)
+
+
+def _rsi_zero_division(close, period):
+    '''backtrader 默认 RSI 在前 period 个涨跌幅全部非负时除零（与 parity_check 相同的排除规则）。'''
+    diffs = np.diff(close[:period + 1])
+    return len(diffs) == period and not (diffs < 0).any()
+
+
+def timed(cls):
+    '''给策略类加上 next() 计时和每根 K 线检查的股票数统计。'''
+    class Timed(cls):
+        def __init__(self):
+            super().__init__()
+            self.next_seconds = 0.0
+            self.next_calls = 0
+            self.checked = 0
+
+        def next(self):
+            t0 = time.perf_counter()
+            super().next()
+            self.next_seconds += time.perf_counter() - t0
+            self.next_calls += 1
+            scheduler = getattr(self, 'scheduler', None)
+            legacy = cls.__name__.startswith('Legacy')
+            self.checked += len(self.datas) if legacy or scheduler is None else len(scheduler.held | scheduler.active)
+
+    Timed.__name__ = cls.__name__
+    return Timed
+
+
+class TradeCollector(bt.Analyzer):
+    def __init__(self):
+        self.trades = []
+
+    def notify_order(self, order):
+        if order.status == order.Completed:
+            self.trades.append((bt.num2date(order.executed.dt).date(), order.data._name,
+                                order.executed.size, round(order.executed.price, 6)))
+
+
+def run_strategy(cls, bars_by_code, kwargs, profile=False):
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.broker.setcash(300000.0)
+    cerebro.broker.setcommission(commission=0.0003)
+    for code, bars in bars_by_code.items():
+        cerebro.adddata(NumpyData(bars=bars), name=code)
+    cerebro.addstrategy(timed(cls), **kwargs)
+    cerebro.addanalyzer(TradeCollector, _name='collector')
+    profiler = cProfile.Profile() if profile else None
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # Gemini 策略逐笔打印日志
+        if profiler:
+            profiler.enable()
+        strat = cerebro.run()[0]
+        if profiler:
+            profiler.disable()
+    elapsed = time.perf_counter() - t0
+    if profiler:
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('tottime').print_stats(8)
+        print(out.getvalue())
+    return elapsed, strat.next_seconds, strat.next_calls, strat.checked, strat.analyzers.collector.trades
+
+
+def run_benchmark(n_stocks, start, end, workdir, profile=False):
+    db_file = os.path.join(workdir, 'bench_daily_data.db')
+    print(f"生成合成数据库: {n_stocks} 只股票, {start} - {end}（停牌概率 5%）")
+    sys.stdout.flush()
+    create_synthetic_db(db_file, n_stocks, start, end, seed=1, suspend_prob=0.05)
+    bars_by_code, _ = load_universe(synthetic_codes(n_stocks), start, end, db_file=db_file, table=DAILY_DATA_TABLE)
+    bars_by_code = {code: bars for code, bars in bars_by_code.items()
+                    if not any(_rsi_zero_division(bars['close'], period) for period in (6, 13))}
+
+    pairs = (
+        ('chatgpt MyStrategy', LegacyChatgpt, chatgpt_stratege.MyStrategy, {}),
+        ('grok', LegacyGrok, grok_strategy.MyMultiStockStrategy, {}),
+        ('Gemini', LegacyGemini, Gemini_strategy.MyMultiStockStrategy, {}),
+    )
+    rows = []
+    cwd = os.getcwd()
+    os.chdir(workdir)  # 策略按相对路径查找指标缓存，这里没有缓存，使用 bt 指标
+    try:
+        for label, legacy, current, kwargs in pairs:
+            old = run_strategy(legacy, bars_by_code, kwargs, profile)
+            new = run_strategy(current, bars_by_code, kwargs)
+            same = old[4] == new[4]
+            rows.append((label, old, new, same))
+            print(f"信息: {label} 完成，交易 {len(new[4])} 笔，交易记录{'一致' if same else '不一致'}")
+            sys.stdout.flush()
+    finally:
+        os.chdir(cwd)
+
+    print(f"\n{'策略':<20}{'写法':<8}{'总耗时(s)':>10}{'next(s)':>10}{'next占比':>10}{'每根检查':>10}")
+    for label, old, new, same in rows:
+        for name, (elapsed, next_s, calls, checked, _) in (('原写法', old), ('调度', new)):
+            print(f"{label:<20}{name:<8}{elapsed:>10.2f}{next_s:>10.2f}{next_s / elapsed:>10.0%}"
+                  f"{checked / max(calls, 1):>10.1f}")
+        print(f"{'':<20}{'next 加速':<8}{old[1] / max(new[1], 1e-9):>10.1f}x"
+              f"   总耗时加速 {old[0] / new[0]:.2f}x")
+    sys.stdout.flush()
+    if not all(same for *_, same in rows):
+        sys.exit(1)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='策略 next() 候选调度的耗时基准')
+    parser.add_argument('--stocks', type=int, default=1000)
+    parser.add_argument('--start', default='20200101')
+    parser.add_argument('--end', default='20231231')
+    parser.add_argument('--profile', action='store_true')
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='bench_sched_')
+    try:
+        run_benchmark(args.stocks, args.start, args.end, workdir, args.profile)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,104 @@
+'''
+全市场回测的内存和耗时基准
+
+在一个含停牌日和中途上市股票的合成数据库上，按不同股票数分别运行：
+  1. 原做法：vector_sim.run_vector_backtest，一次读入整个股票池并计算全部指标
+  2. universe_backtest：按内存预算分块计算信号，只保留开盘价、收盘价和买卖信号
+每次运行都在一个新的子进程中进行，输出子进程自己的峰值常驻内存（ru_maxrss，含解释器和库）和墙钟耗时；
+两种方式都关闭 SQLite 内存映射，否则映射的数据库页面会计入常驻内存。
+原做法要求所有股票都满 240 根 K 线才开始交易，含中途上市股票的股票池往往一笔交易都没有，
+交易笔数一栏因此不可比，这里只比较内存和耗时。
+backtrader（Gemini_strategy.py）在这个规模上无法在合理时间内完成，不参与对比。
+
+用法：
+    python bench_universe.py --sizes 500 2000 5000 --start 20210101 --end 20231231 --budget-mb 512
+'''
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from synthetic_data import DAILY_DATA_TABLE, create_synthetic_db, synthetic_codes
+
+
+def _prepare_db(db_file, n_stocks, start, end):
+    from db_access import write_connection
+    from universe_loader import refresh_coverage_catalog
+
+    create_synthetic_db(db_file, n_stocks, start, end, seed=1, suspend_prob=0.05, late_listing_prob=0.3)
+    # 预先建好覆盖目录，第一次运行不必承担全表统计
+    with write_connection(db_file) as conn:
+        refresh_coverage_catalog(conn, DAILY_DATA_TABLE, rebuild=True)
+
+
+def _child(queue, mode, db_file, codes, start, end, budget_mb):
+    import db_access
+    from universe_backtest import UNIVERSE_MMAP_SIZE, peak_rss_mb, run_universe_backtest
+    from vector_sim import run_vector_backtest
+
+    # 两种方式都关闭内存映射，峰值内存只反映数组本身（与 universe_backtest.py 命令行一致）
+    db_access.MMAP_SIZE = UNIVERSE_MMAP_SIZE
+
+    fromdate, todate = datetime.strptime(start, '%Y%m%d'), datetime.strptime(end, '%Y%m%d')
+    base = peak_rss_mb()
+    t0 = time.perf_counter()
+    if mode == 'universe':
+        result, _ = run_universe_backtest(codes, fromdate, todate, db_file, DAILY_DATA_TABLE, budget_mb=budget_mb)
+    else:
+        result, _ = run_vector_backtest(codes, fromdate, todate, db_file, DAILY_DATA_TABLE)
+    queue.put((time.perf_counter() - t0, base, peak_rss_mb(), len(result['trades'])))
+
+
+def measure(mode, db_file, codes, start, end, budget_mb):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(queue, mode, db_file, codes, start, end, budget_mb))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def run_benchmark(sizes, start, end, budget_mb, workdir):
+    db_file = os.path.join(workdir, 'bench_daily_data.db')
+    n_stocks = max(sizes)
+    print(f"生成合成数据库: {n_stocks} 只股票, {start} - {end}（停牌概率 5%，30% 的股票中途上市）")
+    sys.stdout.flush()
+    # 在子进程中生成，避免本进程的峰值内存被子进程继承（Linux 上 exec 后 ru_maxrss 不清零）
+    ctx = mp.get_context('spawn')
+    proc = ctx.Process(target=_prepare_db, args=(db_file, n_stocks, start, end))
+    proc.start()
+    proc.join()
+    codes = synthetic_codes(n_stocks)
+
+    rows = []
+    for n in sizes:
+        for mode, label in (('vector', '原做法'), ('universe', f'分块 ({budget_mb} MB)')):
+            elapsed, base, peak, trades = measure(mode, db_file, codes[:n], start, end, budget_mb)
+            rows.append((n, label, elapsed, base, peak, trades))
+            print(f"信息: {n} 只股票 {label} 完成，用时 {elapsed:.1f} 秒，峰值内存 {peak:.0f} MB")
+            sys.stdout.flush()
+
+    print(f"\n{'股票数':>6}  {'方式':<16}{'耗时(s)':>10}{'导入后(MB)':>12}{'峰值(MB)':>10}{'交易笔数':>10}")
+    for n, label, elapsed, base, peak, trades in rows:
+        print(f"{n:>6}  {label:<16}{elapsed:>10.1f}{base:>12.0f}{peak:>10.0f}{trades:>10}")
+    sys.stdout.flush()
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='全市场回测的内存和耗时基准')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000, 5000])
+    parser.add_argument('--start', default='20210101')
+    parser.add_argument('--end', default='20231231')
+    parser.add_argument('--budget-mb', type=int, default=512)
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='bench_universe_')
+    try:
+        run_benchmark(args.sizes, args.start, args.end, args.budget_mb, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
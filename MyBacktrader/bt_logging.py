@@ -0,0 +1,234 @@
+'''
+回测脚本的日志
+
+策略原来每条日志都 print 一次并 sys.stdout.flush()，脚本还把 sys.stdout 换成按行缓冲的 TextIOWrapper，
+信号多的回测在控制台输出上花掉不少时间。这里提供：
+  - 日志分级：沿用标准库 logging 的级别（DEBUG / INFO / WARNING / ERROR），另加 OFF 关闭；
+    低于级别的日志在比较级别后直接返回，消息使用 % 参数，写出时才格式化；
+  - 结构化字段：每条日志是一个 __slots__ 记录，带 date、ts_code、event（事件类型）、price、size，
+    文本格式与原来相同（"日期, [股票] 内容"），日志文件以 .jsonl 结尾时每行写一个 JSON 对象；
+  - 环形缓冲：保留最近 RING_SIZE 条日志记录，出错时可以输出最近的日志；
+  - 异步输出：控制台和文件各由一个后台线程每 FLUSH_SECONDS 秒（或积累 BATCH_RECORDS 条时）
+    格式化并一次写出一批，回测线程只把记录追加到缓冲区。
+没有直接用标准库 logging：一条 LogRecord 的构造就要约 4.5 微秒（与原来 print 一条的总开销相当），
+QueueHandler 还要逐条复制并格式化，StreamHandler 逐条 flush，实测比原来的 print 更慢。
+
+用法：
+    logs = start_logging('gemini', log_file='backtest_log.txt')
+    try:
+        cerebro.run()      # 策略中 get_log('gemini').log(INFO, '...%s', x, date=..., ts_code=..., event=...)
+    finally:
+        logs.stop()
+
+开销对比见 bench_logging.py。
+'''
+import json
+import logging
+import sys
+import threading
+from collections import deque
+from datetime import date
+
+# --- 配置参数 ---
+LOG_LEVEL = 'INFO'
+CONSOLE_LOG_LEVEL = 'INFO'
+RING_SIZE = 1000
+FLUSH_SECONDS = 0.5
+BATCH_RECORDS = 5000
+FIELDS = ('date', 'ts_code', 'event', 'price', 'size')
+
+DEBUG, INFO, WARNING, ERROR = logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR
+OFF = logging.CRITICAL + 10
+_LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING, 'ERROR': ERROR, 'CRITICAL': logging.CRITICAL,
+           'OFF': OFF}
+
+
+def to_level(level):
+    ''''INFO' 等级别名或数值 -> 数值。'''
+    return _LEVELS[level.upper()] if isinstance(level, str) else level
+
+
+class LogEvent:
+    '''一条日志：级别、% 格式串和参数、结构化字段。'''
+    __slots__ = ('level', 'msg', 'args', '_text') + FIELDS
+
+    def __init__(self, level, msg, args, date=None, ts_code=None, event=None, price=None, size=None):
+        self.level = level
+        self.msg = msg
+        self.args = args
+        self.date = date
+        self.ts_code = ts_code
+        self.event = event
+        self.price = price
+        self.size = size
+        self._text = None
+
+    @property
+    def message(self):
+        return self.msg % self.args if self.args else self.msg
+
+    def text(self):
+        '''与原来策略日志相同的文本格式："2022-01-05, [000001.SZ] 买入执行, ..."（控制台和文件共用，只格式化一次）。'''
+        if self._text is None:
+            message = f'[{self.ts_code}] {self.message}' if self.ts_code else self.message
+            self._text = f'{self.date.isoformat()}, {message}' if self.date is not None else message
+        return self._text
+
+    def json(self):
+        '''level、有值的结构化字段和 message 组成的 JSON 对象。'''
+        row = {'level': logging.getLevelName(self.level)}
+        for field in FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                row[field] = value.isoformat() if isinstance(value, date) else value
+        row['message'] = self.message
+        return json.dumps(row, ensure_ascii=False)
+
+
+class AsyncLogWriter:
+    '''
+    把日志记录写到 stream（文件路径时以覆盖方式打开，close 时关闭）。
+    append 只把记录追加到缓冲区，后台线程每 flush_seconds 秒（或缓冲区满 batch_records 条时）
+    把缓冲区中的记录格式化后一次写出并 flush。
+    '''
+
+    def __init__(self, stream, level=DEBUG, json_lines=False, flush_seconds=FLUSH_SECONDS,
+                 batch_records=BATCH_RECORDS):
+        self.level = to_level(level)
+        self.json_lines = json_lines
+        self.owns_stream = isinstance(stream, str)
+        self.stream = open(stream, 'w', encoding='utf-8') if self.owns_stream else stream
+        self.flush_seconds = flush_seconds
+        self.batch_records = batch_records
+        self.buffer = deque()  # append / popleft 是原子操作，两个线程之间不需要加锁
+        self.wakeup = threading.Event()
+        self.closing = False
+        self.thread = threading.Thread(target=self._run, name='AsyncLogWriter', daemon=True)
+        self.thread.start()
+
+    def append(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_records:
+            self.wakeup.set()
+
+    def _write_pending(self):
+        records = [self.buffer.popleft() for _ in range(len(self.buffer))]
+        if records:
+            if self.json_lines:
+                self.stream.write(''.join(record.json() + '\n' for record in records))
+            else:
+                self.stream.write(''.join(record.text() + '\n' for record in records))
+            self.stream.flush()
+
+    def _run(self):
+        while not self.closing:
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            self._write_pending()
+
+    def close(self):
+        '''等后台线程退出后写出剩余记录。'''
+        if not self.closing:
+            self.closing = True
+            self.wakeup.set()
+            self.thread.join()
+            self._write_pending()
+            if self.owns_stream:
+                self.stream.close()
+
+
+class BacktestLog:
+    '''
+    一个策略的日志：级别过滤、环形缓冲和若干 AsyncLogWriter 输出。
+    没有调用 start_logging 时只保留在环形缓冲中，不输出（parity_check 等直接运行策略时不刷屏）。
+    '''
+
+    def __init__(self, level=LOG_LEVEL, ring_size=RING_SIZE):
+        self.level = to_level(level)
+        self.ring = deque(maxlen=ring_size)
+        self.outputs = []
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, msg, *args, **fields):
+        '''msg 为 % 格式串，args 在写出时才格式化；fields 为 FIELDS 中的结构化字段。'''
+        if level < self.level:
+            return
+        record = LogEvent(level, msg, args, **fields)
+        self.ring.append(record)
+        for output in self.outputs:
+            if level >= output.level:
+                output.append(record)
+
+    def recent(self, n=None):
+        '''环形缓冲中最近 n 条日志（文本格式）。'''
+        records = list(self.ring)[-n:] if n else list(self.ring)
+        return [record.text() for record in records]
+
+
+_logs = {}
+
+
+def get_log(name):
+    '''按名称取策略的日志对象（同名返回同一个，类似 logging.getLogger）。'''
+    if name not in _logs:
+        _logs[name] = BacktestLog()
+    return _logs[name]
+
+
+class BacktestLogging:
+    '''
+    name           策略日志名（get_log(name)）
+    level          日志级别，低于此级别的日志直接丢弃（'OFF' 关闭全部日志）
+    log_file       日志文件，None 时不写文件；以 .jsonl 结尾时写结构化的 JSON Lines
+    console_level  控制台输出级别，None 时不输出到控制台
+    ring_size      环形缓冲保留的日志条数
+    '''
+
+    def __init__(self, name, level=LOG_LEVEL, log_file=None, console_level=CONSOLE_LOG_LEVEL,
+                 ring_size=RING_SIZE):
+        self.log = get_log(name)
+        self.level = to_level(level)
+        self.log_file = log_file
+        self.console_level = console_level
+        self.ring_size = ring_size
+        self.started = False
+
+    def start(self):
+        '''设置级别、清空环形缓冲并启动输出；已启动时不重复启动（start_logging 的返回值也可以用于 with）。'''
+        if self.started:
+            return self
+        self.started = True
+        self.log.level = self.level
+        self.log.ring = deque(maxlen=self.ring_size)
+        outputs = []
+        if self.console_level is not None:
+            outputs.append(AsyncLogWriter(sys.stdout, level=self.console_level))
+        if self.log_file:
+            outputs.append(AsyncLogWriter(self.log_file, json_lines=self.log_file.endswith('.jsonl')))
+        self.log.outputs = outputs
+        return self
+
+    def stop(self):
+        '''等后台线程写出缓冲区中的全部日志并关闭文件，环形缓冲保留。'''
+        if not self.started:
+            return
+        self.started = False
+        outputs, self.log.outputs = self.log.outputs, []
+        for output in outputs:
+            output.close()
+        sys.stdout.flush()
+
+    def recent(self, n=None):
+        return self.log.recent(n)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def start_logging(name, **kwargs):
+    return BacktestLogging(name, **kwargs).start()
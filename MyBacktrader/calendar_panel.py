@@ -0,0 +1,145 @@
+'''
+交易日历对齐的稠密面板
+
+回测前先把选定股票对齐到同一个交易日历上，得到 (交易日 x 股票) 的稠密面板：
+  - 交易日历为 daily_ingest.py 缓存的 trade_calendar 表（开市日）与日线表中出现过的全部交易日
+    （走 trade_date 索引）之并：日历表没有或只覆盖了部分区间时，日线表中的交易日仍然都在日历上；
+    进程内按数据库文件指纹缓存；
+  - 显式的掩码：present（当天有 K 线）、listed（已上市，即第一根 K 线当天及之后）、
+    suspended（已上市但当天无 K 线，包括退市后的日期）；
+  - 停牌日的填充策略由 FILL_POLICY 指定：收盘价等沿用上一根 K 线（ffill），
+    开高低取上一根 K 线的收盘价（last_close），成交量为 0（zero）；上市前始终为 NaN。
+
+面板供向量化引擎（vector_sim、param_sweep、universe_backtest、universe_pruning）使用：
+读取未填充的原始值 panel.values，NaN 即无 K 线，指标按每只股票自己的 K 线序列计算，
+与原来的 build_panel 结果相同。backtrader 策略仍使用各自长度的 NumpyData：
+等长数据源并不降低同步开销（见 bench_panel_sync.py），填充值还会改变策略的指标。
+'''
+import os
+import sys
+from functools import lru_cache
+
+import numpy as np
+
+from bar_store import date_to_int
+from db_access import fetch_all, fetch_one, file_signature
+from universe_loader import load_universe
+
+# --- 配置参数 ---
+DB_FILE = 'daily_data.db'
+DAILY_DATA_TABLE = 'daily_data'
+CALENDAR_TABLE = 'trade_calendar'   # daily_ingest.py 写入的交易日历
+EXCHANGE = 'SSE'
+PANEL_FIELDS = ('open', 'high', 'low', 'close', 'vol')
+
+# 停牌日（已上市但无 K 线）的填充方式：ffill 沿用上一根 K 线的值，
+# last_close 取上一根 K 线的收盘价，zero 为 0，nan 保持缺失
+FILL_POLICY = {'open': 'last_close', 'high': 'last_close', 'low': 'last_close', 'close': 'ffill', 'vol': 'zero'}
+DEFAULT_FILL = 'ffill'
+
+
+@lru_cache(maxsize=8)
+def _cached_calendar(db_file, table, exchange, signature):
+    has_calendar = fetch_one(db_file, "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+                             (CALENDAR_TABLE,))[0]
+    rows = fetch_all(db_file, f"SELECT DISTINCT trade_date FROM {table} ORDER BY trade_date")
+    if has_calendar:
+        rows += fetch_all(db_file, f"SELECT cal_date FROM {CALENDAR_TABLE} "
+                                   f"WHERE exchange = ? AND is_open = 1 ORDER BY cal_date", (exchange,))
+    return np.unique(np.asarray([int(r[0]) for r in rows], dtype=np.int32))
+
+
+def trading_calendar(db_file=DB_FILE, table=DAILY_DATA_TABLE, fromdate=None, todate=None, exchange=EXCHANGE):
+    '''[fromdate, todate] 内的交易日（YYYYMMDD 整数数组）。'''
+    signature = tuple(sorted(file_signature(db_file).items()))
+    dates = _cached_calendar(os.path.abspath(db_file), table, exchange, signature)
+    lo = np.searchsorted(dates, date_to_int(fromdate), side='left') if fromdate else 0
+    hi = np.searchsorted(dates, date_to_int(todate), side='right') if todate else len(dates)
+    return dates[lo:hi]
+
+
+class DensePanel:
+    '''
+    dates     交易日（YYYYMMDD 整数数组）
+    codes     股票代码列表
+    values    字段 -> (交易日 x 股票) 的原始值，无 K 线处为 NaN
+    present   当天有 K 线
+    listed    已上市（第一根 K 线当天及之后）
+    '''
+
+    def __init__(self, dates, codes, values, present):
+        self.dates = np.asarray(dates, dtype=np.int32)
+        self.codes = list(codes)
+        self.values = values
+        self.present = present
+        self.listed = np.logical_or.accumulate(present, axis=0) if len(present) else present.copy()
+
+    @property
+    def suspended(self):
+        return self.listed & ~self.present
+
+    @property
+    def shape(self):
+        return self.present.shape
+
+    def last_row(self):
+        '''每个交易日对应该股票最后一根 K 线的行号（停牌日沿用），上市前为 -1。'''
+        rows = np.where(self.present, np.arange(len(self.dates))[:, None], -1)
+        return np.maximum.accumulate(rows, axis=0) if len(rows) else rows
+
+    def filled(self, field, policy=None):
+        '''按填充策略补齐停牌日的 field，上市前为 NaN。'''
+        policy = policy or FILL_POLICY.get(field, DEFAULT_FILL)
+        raw = self.values[field]
+        if policy == 'nan':
+            return raw.copy()
+        if policy == 'zero':
+            return np.where(self.suspended, 0.0, raw)
+        if policy not in ('ffill', 'last_close'):
+            raise ValueError(f"未知的填充策略: {policy}")
+        source = self.values['close'] if policy == 'last_close' else raw
+        last = self.last_row()
+        cols = np.arange(len(self.codes))
+        out = np.where(last >= 0, source[np.maximum(last, 0), cols], np.nan)
+        return np.where(self.present, raw, out)
+
+
+def align_to_calendar(bars_by_code, calendar, fields=PANEL_FIELDS):
+    '''
+    把 {ts_code: 列数组字典} 放到交易日历的行上，返回 DensePanel。
+    不在日历中的 K 线会被丢弃并打印警告（日历与日线表不一致时）。
+    '''
+    calendar = np.asarray(calendar, dtype=np.int32)
+    codes = list(bars_by_code)
+    values = {f: np.full((len(calendar), len(codes)), np.nan) for f in fields}
+    present = np.zeros((len(calendar), len(codes)), dtype=bool)
+    dropped = 0
+    for j, code in enumerate(codes):
+        bars = bars_by_code[code]
+        dates = np.asarray(bars['trade_date'], dtype=np.int32)
+        rows = np.minimum(np.searchsorted(calendar, dates), max(len(calendar) - 1, 0))
+        ok = calendar[rows] == dates if len(calendar) else np.zeros(len(dates), dtype=bool)
+        dropped += int((~ok).sum())
+        present[rows[ok], j] = True
+        for f in fields:
+            values[f][rows[ok], j] = np.asarray(bars[f], dtype=np.float64)[ok]
+    if dropped:
+        print(f"警告: {dropped} 根 K 线的日期不在交易日历中，已忽略")
+        sys.stdout.flush()
+    return DensePanel(calendar, codes, values, present)
+
+
+def load_dense_panel(ts_codes, fromdate, todate, db_file=DB_FILE, table=DAILY_DATA_TABLE,
+                     fields=PANEL_FIELDS, min_bars=1, exchange=EXCHANGE):
+    '''
+    加载股票池并对齐到交易日历，返回 (panel, skipped)。
+    skipped 与 universe_loader.load_universe 相同；只保留至少一只股票有 K 线的日历区间。
+    '''
+    bars_by_code, skipped = load_universe(ts_codes, fromdate, todate, db_file=db_file, table=table,
+                                          min_bars=min_bars, fields=tuple(fields))
+    calendar = trading_calendar(db_file, table, fromdate, todate, exchange)
+    if bars_by_code:
+        first = min(int(b['trade_date'][0]) for b in bars_by_code.values())
+        last = max(int(b['trade_date'][-1]) for b in bars_by_code.values())
+        calendar = calendar[(calendar >= first) & (calendar <= last)]
+    return align_to_calendar(bars_by_code, calendar, fields), skipped
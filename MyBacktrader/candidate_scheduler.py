@@ -0,0 +1,114 @@
+'''
+策略 next() 的候选股票调度
+
+三个回测策略（chatgpt_stratege.MyStrategy、grok_strategy / Gemini_strategy 的 MyMultiStockStrategy）
+原来每根 K 线都遍历全部数据源：用列表推导重数持仓数、从指标参数重算最长周期、
+对每只股票都计算五个买入条件。股票池有上千只时，绝大多数股票当天根本不可能满足条件。
+这里改为只检查两类股票：
+  - 有持仓的：持仓集合在 notify_order 中随成交增量维护，持仓数即集合大小；
+  - 通过预筛选的：收盘价高于 MA240 且 MA240 向上（买入条件 cond1、cond2），
+    其余条件只在这个小集合上计算。
+
+预筛选在第一次调用时一次算好：runonce 模式下（cerebro 默认）指标在调用 next() 之前已整段计算，
+直接用数据源和 MA240 的数组算出每只股票预筛选结果翻转的日期，按日期排成事件表；
+之后每根 K 线只应用当天的翻转事件，开销与翻转次数成正比，而不是与股票数成正比。
+停牌的股票没有新 K 线、没有事件，保留最后一根 K 线的结果，与策略读取 data.close[0] 的语义一致。
+指标数组不完整时（runonce=False 或 exactbars 模式）退回为每根 K 线逐只读取预筛选条件。
+
+耗时对比见 bench_scheduler.py。
+'''
+import numpy as np
+
+
+def warmup_bars(inds):
+    '''一组指标中最长的周期（原来在每根 K 线上重算）。'''
+    return max(ind.params.period for ind in inds.values() if hasattr(ind, 'params'))
+
+
+def has_next_bar(data):
+    '''数据源是否还有下一根已预加载的 K 线（下单时读取 data.open[1] 前检查）。'''
+    return len(data) < data.buflen()
+
+
+def _line_values(line, length):
+    return np.frombuffer(line.array, dtype=np.float64)[:length]
+
+
+class CandidateScheduler:
+    '''
+    strategy  策略实例（在策略的 __init__ 中创建）
+    inds      {data: {指标名: 指标}}，预筛选使用其中的 trend_key（默认 ma240）
+    '''
+
+    def __init__(self, strategy, inds, trend_key='ma240'):
+        self.strategy = strategy
+        self.datas = list(strategy.datas)
+        self.index = {d: j for j, d in enumerate(self.datas)}
+        self.trend = [inds[d][trend_key] for d in self.datas]
+        self.held = set()      # 有持仓的数据源序号
+        self.active = set()    # 最后一根 K 线通过预筛选的数据源序号
+        self._events = None    # (日期, 数据源序号, 是否通过)，按日期排序
+        self._next_event = 0
+        self._scan = False
+
+    @property
+    def positions(self):
+        '''当前持仓的股票数。'''
+        return len(self.held)
+
+    def update_position(self, data):
+        '''订单成交后调用（notify_order 中 order.Completed 分支）。'''
+        j = self.index[data]
+        if self.strategy.getposition(data).size:
+            self.held.add(j)
+        else:
+            self.held.discard(j)
+
+    def _build_events(self):
+        dates, rows, flags = [], [], []
+        for j, (d, trend) in enumerate(zip(self.datas, self.trend)):
+            n = d.buflen()
+            if len(trend.lines[0].array) < n or len(d.close.array) < n:
+                return False
+            close = _line_values(d.close, n)
+            ma = _line_values(trend.lines[0], n)
+            with np.errstate(invalid='ignore'):
+                passed = (close > ma) & (ma > np.concatenate(([np.nan], ma[:-1])))
+            flips = np.flatnonzero(np.diff(passed.astype(np.int8), prepend=0))
+            dates.append(_line_values(d.datetime, n)[flips])
+            rows.append(np.full(len(flips), j, dtype=np.int64))
+            flags.append(passed[flips])
+        if not dates:
+            self._events = (np.empty(0), np.empty(0, dtype=np.int64), np.empty(0, dtype=bool))
+            return True
+        dates, rows, flags = np.concatenate(dates), np.concatenate(rows), np.concatenate(flags)
+        order = np.argsort(dates, kind='stable')
+        self._events = (dates[order], rows[order].tolist(), flags[order].tolist())
+        return True
+
+    def _advance(self):
+        if self._events is None and not self._scan:
+            self._scan = not self._build_events()
+        if self._scan:
+            self.active = set()
+            for j, (d, trend) in enumerate(zip(self.datas, self.trend)):
+                if len(d) and len(trend) > 1 and d.close[0] > trend[0] and trend[0] > trend[-1]:
+                    self.active.add(j)
+            return
+        dates, rows, flags = self._events
+        end = int(np.searchsorted(dates, self.strategy.datetime[0], side='right'))
+        for k in range(self._next_event, end):
+            if flags[k]:
+                self.active.add(rows[k])
+            else:
+                self.active.discard(rows[k])
+        self._next_event = max(self._next_event, end)
+
+    def candidates(self, entries=True):
+        '''
+        本根 K 线需要检查的数据源，保持 datas 中的顺序（下单顺序与原来逐只遍历时相同）。
+        entries=False（持仓已满）时只返回有持仓的数据源。
+        '''
+        self._advance()
+        rows = self.held | self.active if entries else self.held
+        return [self.datas[j] for j in sorted(rows)]
@@ -1,10 +1,19 @@
 import backtrader as bt
-import sqlite3
 import pandas as pd
 import os
 from datetime import datetime
-import tkinter as tk
-from tkinter import messagebox
+try:
+    import tkinter as tk
+    from tkinter import messagebox
+except ImportError:  # 无图形界面的服务器上可以没有 tkinter，批量回测见 batch_runner.py
+    tk = messagebox = None
+from db_access import max_trade_date
+from numpy_feed import NumpyData, load_numpy_bars
+from indicator_cache import refresh_indicator_cache, strategy_indicators
+from candidate_scheduler import CandidateScheduler, has_next_bar
+from universe_loader import load_universe
+from universe_pruning import prune_universe
+from result_writers import CsvRecordWriter
 # import sys
 # import io
 
@@ -16,78 +25,51 @@ DB_FILE = 'daily_data.db'
 DAILY_DATA_TABLE = 'daily_data'
 STOCK_POOL_CSV = 'stock_pool.csv'
 TRADE_LOG_CSV = 'trades.csv'
+TRADE_LOG_COLUMNS = ('日期', '股票', '方向', '价格', '数量')
 REPORT_TXT = 'trade_report.txt'
+PRUNE_UNIVERSE = True  # 只把回测区间内出现过买入信号的股票加入为数据源（结果不变）
 
 from_date = datetime(2022, 1, 1)
 
 def get_last_trade_date():
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute(f"SELECT MAX(trade_date) FROM {DAILY_DATA_TABLE}")
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    return datetime.strptime(result[0], "%Y%m%d") if result and result[0] else datetime.today()
+    last = max_trade_date(DB_FILE, DAILY_DATA_TABLE)
+    return datetime.strptime(last, "%Y%m%d") if last else datetime.today()
 
-to_date = get_last_trade_date()
-
-class SQLiteData(bt.feeds.DataBase):
-    params = (('dataname', None), ('fromdate', from_date), ('todate', to_date))
+class SQLiteData(NumpyData):
+    # todate 为 None 时在加载数据时取数据库最后交易日（导入模块时不访问数据库）
+    params = (('dataname', None), ('fromdate', from_date), ('todate', None))
 
     def start(self):
-        self.conn = sqlite3.connect(DB_FILE)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute(f"""
-            SELECT trade_date, open, high, low, close, vol
-            FROM {DAILY_DATA_TABLE}
-            WHERE ts_code = ? AND trade_date BETWEEN ? AND ?
-            ORDER BY trade_date ASC
-        """, (self.p.dataname, self.p.fromdate.strftime('%Y%m%d'), self.p.todate.strftime('%Y%m%d')))
-        self.rows = self.cursor.fetchall()
-        self.pos = 0
-
-    def _load(self):
-        if self.pos >= len(self.rows):
-            return False
-        row = self.rows[self.pos]
-        self.pos += 1
-        dt = datetime.strptime(row[0], '%Y%m%d')
-        self.lines.datetime[0] = bt.date2num(dt)
-        self.lines.open[0] = float(row[1])
-        self.lines.high[0] = float(row[2])
-        self.lines.low[0] = float(row[3])
-        self.lines.close[0] = float(row[4])
-        self.lines.volume[0] = float(row[5])
-        self.lines.openinterest[0] = float('nan')
-        return True
-
-    def stop(self):
-        self.cursor.close()
-        self.conn.close()
+        if self.p.todate is None:
+            self.p.todate = get_last_trade_date()
+        # 一次性读取整段列数组（优先列式存储），预加载时整段写入 lines
+        self.p.bars = load_numpy_bars(self.p.dataname, self.p.fromdate, self.p.todate, DB_FILE, DAILY_DATA_TABLE)
+        super().start()
 
 class MyStrategy(bt.Strategy):
+    # pool_size 为裁剪前的股票数（持仓上限 min(n, 5) 的 n），None 时为数据源个数
+    # trade_writer 为 result_writers 的写出器时交易记录边回测边写出，None 时保存在列表中
+    # db_file 决定指标缓存的位置（数据库同目录下）
+    params = (('pool_size', None), ('trade_writer', None), ('db_file', DB_FILE))
+
     def __init__(self):
         self.inds = {}
         self.orders = {}
-        self.trade_log = []
+        self.trade_log = self.p.trade_writer if self.p.trade_writer is not None else []
         for data in self.datas:
-            self.inds[data] = {
-                'ma20': bt.ind.SMA(data.close, period=20),
-                'ma60': bt.ind.SMA(data.close, period=60),
-                'ma240': bt.ind.SMA(data.close, period=240),
-                'rsi6': bt.ind.RSI(data.close, period=6),
-                'rsi13': bt.ind.RSI(data.close, period=13),
-                'vol_ma3': bt.ind.SMA(data.volume, period=3),
-                'vol_ma8': bt.ind.SMA(data.volume, period=8)
-            }
+            # 优先读取指标缓存，缓存缺失时回退为 bt.ind.SMA / RSI
+            self.inds[data] = strategy_indicators(
+                data, ('ma20', 'ma60', 'ma240', 'rsi6', 'rsi13', 'vol_ma3', 'vol_ma8'), db_file=self.p.db_file)
             self.orders[data] = None
+        # 只检查有持仓和通过预筛选（close > MA240 且 MA240 向上）的股票，持仓数增量维护
+        self.scheduler = CandidateScheduler(self, self.inds)
 
     def next(self):
-        p = min(len(self.datas), 5)
-        m = len([d for d in self.datas if self.getposition(d).size > 0])
+        p = min(self.p.pool_size or len(self.datas), 5)
+        m = self.scheduler.positions
         available_cash = self.broker.get_cash()
 
-        for data in self.datas:
+        for data in self.scheduler.candidates(entries=m < p):
             i = self.inds[data]
             pos = self.getposition(data)
             if len(data) < 240 or self.orders[data]:
@@ -103,7 +85,8 @@ class MyStrategy(bt.Strategy):
                     i['rsi6'][0] > 70 and i['rsi13'][0] > 50,
                     i['vol_ma3'][0] > i['vol_ma8'][0] and i['vol_ma3'][0] > i['vol_ma3'][-1] and i['vol_ma8'][0] > i['vol_ma8'][-1]
                 ]
-                if all(conds):
+                # 数据源的最后一根 K 线上没有 data.open[1]，跳过该信号（与 vector_sim 的 skipped_signals 一致）
+                if all(conds) and has_next_bar(data):
                     allocation = 1 / (p - m)
                     amount = available_cash * allocation
                     size = int((amount / data.open[1]) // 100 * 100)
@@ -121,6 +104,7 @@ class MyStrategy(bt.Strategy):
                 '价格': round(order.executed.price, 2),
                 '数量': int(order.executed.size)
             })
+            self.scheduler.update_position(order.data)
             self.orders[order.data] = None
         elif order.status in [order.Canceled, order.Rejected]:
             self.orders[order.data] = None
@@ -130,20 +114,31 @@ def run_backtest(selected_codes):
     cerebro.broker.setcash(300000.0)
     cerebro.broker.setcommission(commission=0.0003)
 
-    for code in selected_codes:
+    codes = selected_codes
+    if PRUNE_UNIVERSE:
+        bars_by_code, _ = load_universe(selected_codes, from_date, get_last_trade_date(), DB_FILE,
+                                        DAILY_DATA_TABLE, fields=('close', 'vol'))
+        codes, _ = prune_universe(selected_codes, bars_by_code)
+        print(f"信息: 按买入信号裁剪股票池，{len(selected_codes)} 只中保留 {len(codes)} 只")
+
+    refresh_indicator_cache(codes, DB_FILE, table=DAILY_DATA_TABLE)
+    for code in codes:
         data = SQLiteData(dataname=code)
         cerebro.adddata(data, name=code)
 
-    strat = cerebro.addstrategy(MyStrategy)
+    # 交易记录在回测过程中分批写入 TRADE_LOG_CSV，中途出错时已成交的记录也在文件中
+    trade_writer = CsvRecordWriter(TRADE_LOG_CSV, TRADE_LOG_COLUMNS)
+    cerebro.addstrategy(MyStrategy, pool_size=len(selected_codes), trade_writer=trade_writer)
     cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
     cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
 
     print("开始回测...")
-    results = cerebro.run()
+    try:
+        results = cerebro.run()
+    finally:
+        trade_writer.close()
     strat = results[0]
 
-    pd.DataFrame(strat.trade_log).to_csv(TRADE_LOG_CSV, index=False)
-
     final_value = cerebro.broker.getvalue()
     generate_date = datetime.today().strftime('%Y-%m-%d')
     report = {
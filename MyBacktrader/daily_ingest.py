@@ -0,0 +1,291 @@
+'''
+全市场日线增量下载（按交易日）
+
+按交易日而不是按股票拉取：每个交易日调用一次 pro.daily 和一次 pro.daily_basic，
+即可得到全市场当天的开高低收量和 pe_ttm / pb / total_mv，合并后写入 daily_data 表
+（列与回测脚本、选股工具使用的完全相同）。更新一天只需 2 次接口调用，而不是约 5000 次。
+
+  - 交易日历缓存在 trade_calendar 表中，只有未覆盖到结束日期时才重新请求 pro.trade_cal；
+  - 需要下载的日期 = 日历中的开市日 - daily_data 中已有且带每日指标的日期；
+    pro.daily 有数据而 pro.daily_basic 为空（每日指标尚未更新）视为下载失败，该日不写入，下次运行再下载；
+  - 多个交易日并发下载（受每分钟调用次数限制，失败时指数退避重试），
+    每 BATCH_DATES 个交易日在一个事务中用 executemany 写入，
+    使用 db_access 的写连接（WAL 模式）；
+  - 一个交易日的全部行总在同一个事务中写入，中断后不会留下只写了一半的日期，
+    重新运行即从缺失的日期继续；
+  - 写入后刷新覆盖目录表（universe_loader）和最新行情快照表（latest_snapshot），
+    回测和选股工具读取时不必再持有写连接。
+
+pro 可以是 tushare.pro_api() 返回的对象，也可以是本文件中的 FakeProApi
+（由 synthetic_data.generate_bars 生成的本地假数据，用于演练和检查下载流程）。
+
+命令行用法：
+    python daily_ingest.py --fake --db test_daily.db --start 20230101 --end 20231231
+    python daily_ingest.py --token YOUR_TUSHARE_TOKEN --start 20180101
+'''
+import argparse
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from db_access import write_connection
+from latest_snapshot import refresh_latest_snapshot
+from synthetic_data import create_daily_table, generate_bars
+from universe_loader import refresh_coverage_catalog
+
+# --- 配置参数 ---
+DB_FILE = 'daily_data.db'
+DAILY_DATA_TABLE = 'daily_data'
+CALENDAR_TABLE = 'trade_calendar'
+EXCHANGE = 'SSE'
+START_DATE = '20180101'
+CALLS_PER_MINUTE = 200   # tushare 接口的每分钟调用上限，按账号权限调整
+MAX_WORKERS = 4
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 2.0    # 第 n 次重试前等待 BACKOFF_SECONDS * 2**n 秒
+BATCH_DATES = 20         # 每个事务写入的交易日数
+
+DAILY_FIELDS = ('open', 'high', 'low', 'close', 'vol')
+BASIC_FIELDS = ('pe_ttm', 'pb', 'total_mv')
+COLUMNS = ('ts_code', 'trade_date') + DAILY_FIELDS + BASIC_FIELDS
+
+
+class RateLimiter:
+    '''滑动窗口限速：任意 period 秒内最多 max_calls 次调用，可在多个线程间共享。'''
+
+    def __init__(self, max_calls=CALLS_PER_MINUTE, period=60.0, clock=time.monotonic, sleep=time.sleep):
+        self.max_calls = max_calls
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.max_calls:
+            return
+        while True:
+            with self.lock:
+                now = self.clock()
+                while self.calls and now - self.calls[0] >= self.period:
+                    self.calls.popleft()
+                if len(self.calls) < self.max_calls:
+                    self.calls.append(now)
+                    return
+                wait = self.period - (now - self.calls[0])
+            self.sleep(wait)
+
+
+class FakeProApi:
+    '''
+    本地假数据源，接口与 tushare 的 trade_cal / daily / daily_basic 相同。
+    行情来自 synthetic_data.generate_bars，与 create_synthetic_db 用相同参数生成的数据库逐行一致；
+    fail_prob 为每次调用抛出异常的概率，用于演练重试。
+    '''
+
+    def __init__(self, n_stocks=100, start='20200101', end='20231231', seed=0, suspend_prob=0.0,
+                 late_listing_prob=0.0, fail_prob=0.0):
+        self.dates, self.codes, self.bars = generate_bars(n_stocks, start, end, seed, suspend_prob,
+                                                          late_listing_prob)
+        self.rows = {d: i for i, d in enumerate(self.dates)}
+        self.fail_prob = fail_prob
+        self.rng = np.random.default_rng(seed + 1)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def _call(self, name):
+        with self.lock:
+            self.calls += 1
+            fail = self.rng.random() < self.fail_prob
+        if fail:
+            raise IOError(f"模拟接口错误: {name}")
+
+    def trade_cal(self, exchange=EXCHANGE, start_date=None, end_date=None):
+        self._call('trade_cal')
+        days = pd.date_range(pd.Timestamp(start_date), pd.Timestamp(end_date))
+        cal = pd.DataFrame({'exchange': exchange, 'cal_date': days.strftime('%Y%m%d'),
+                            'is_open': (days.dayofweek < 5).astype(int)})
+        return cal.iloc[::-1].reset_index(drop=True)  # 与 tushare 一样按日期倒序返回
+
+    def _frame(self, trade_date, fields):
+        row = self.rows.get(trade_date)
+        if row is None:
+            return pd.DataFrame(columns=['ts_code', 'trade_date', *fields])
+        present = ~np.isnan(self.bars['close'][row])
+        df = pd.DataFrame({'ts_code': np.asarray(self.codes)[present], 'trade_date': trade_date})
+        for name in fields:
+            df[name] = self.bars[name][row][present]
+        return df
+
+    def daily(self, trade_date):
+        self._call('daily')
+        return self._frame(trade_date, DAILY_FIELDS)
+
+    def daily_basic(self, trade_date, fields=None):
+        self._call('daily_basic')
+        return self._frame(trade_date, BASIC_FIELDS)
+
+
+def create_tables(conn, table=DAILY_DATA_TABLE):
+    '''确保日线表、交易日历表和按交易日的索引存在。'''
+    create_daily_table(conn, table)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CALENDAR_TABLE} (
+            exchange TEXT,
+            cal_date TEXT,
+            is_open INTEGER,
+            PRIMARY KEY (exchange, cal_date)
+        )
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_trade_date ON {table} (trade_date)")
+    conn.commit()
+
+
+def _with_retry(func, limiter, max_retries=MAX_RETRIES, backoff=BACKOFF_SECONDS, sleep=time.sleep):
+    '''调用接口，失败时指数退避重试，重试用尽后抛出最后一次的异常。'''
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            return func()
+        except Exception:
+            if attempt == max_retries:
+                raise
+            sleep(backoff * 2 ** attempt)
+
+
+def refresh_calendar(conn, pro, start_date, end_date, limiter, exchange=EXCHANGE, **retry):
+    '''缓存的日历未覆盖 [start_date, end_date] 时重新请求并写入，返回区间内的开市日列表。'''
+    lo, hi = conn.execute(f"SELECT MIN(cal_date), MAX(cal_date) FROM {CALENDAR_TABLE} WHERE exchange = ?",
+                          (exchange,)).fetchone()
+    if lo is None or lo > start_date or hi < end_date:
+        cal = _with_retry(lambda: pro.trade_cal(exchange=exchange, start_date=min(start_date, lo or start_date),
+                                                end_date=max(end_date, hi or end_date)), limiter, **retry)
+        rows = [(exchange, str(d), int(o)) for d, o in zip(cal['cal_date'], cal['is_open'])]
+        with conn:
+            conn.executemany(f"INSERT OR REPLACE INTO {CALENDAR_TABLE} VALUES (?, ?, ?)", rows)
+    return [row[0] for row in conn.execute(
+        f"SELECT cal_date FROM {CALENDAR_TABLE} WHERE exchange = ? AND is_open = 1 "
+        f"AND cal_date >= ? AND cal_date <= ? ORDER BY cal_date", (exchange, start_date, end_date))]
+
+
+def missing_dates(conn, open_dates, table=DAILY_DATA_TABLE):
+    '''
+    开市日中 daily_data 还没有数据，或全部行的 total_mv 都为空（写入时缺少每日指标）的日期。
+    '''
+    if not open_dates:
+        return []
+    have = {row[0] for row in conn.execute(
+        f"SELECT trade_date FROM {table} WHERE trade_date >= ? AND trade_date <= ? "
+        f"GROUP BY trade_date HAVING COUNT(total_mv) > 0",
+        (open_dates[0], open_dates[-1]))}
+    return [d for d in open_dates if d not in have]
+
+
+def fetch_trade_date(pro, trade_date, limiter, **retry):
+    '''
+    下载一个交易日的全市场日线并与每日指标合并，返回按 COLUMNS 排列的 DataFrame。
+    日线有数据而每日指标为空时（重试后仍为空）抛出 ValueError，不写入只有行情、没有指标的行。
+    '''
+    daily = _with_retry(lambda: pro.daily(trade_date=trade_date), limiter, **retry)
+    if daily is None or daily.empty:
+        return pd.DataFrame(columns=COLUMNS)
+
+    def fetch_basic():
+        basic = pro.daily_basic(trade_date=trade_date, fields='ts_code,trade_date,' + ','.join(BASIC_FIELDS))
+        if basic is None or basic.empty:
+            raise ValueError(f"交易日 {trade_date} 的每日指标为空（可能尚未更新）")
+        return basic
+
+    basic = _with_retry(fetch_basic, limiter, **retry)
+    df = pd.merge(daily[['ts_code', 'trade_date', *DAILY_FIELDS]], basic[['ts_code', *BASIC_FIELDS]],
+                  on='ts_code', how='left')
+    df['trade_date'] = df['trade_date'].astype(str)
+    return df[list(COLUMNS)]
+
+
+def write_dates(conn, frames, table=DAILY_DATA_TABLE):
+    '''把若干个交易日的数据在一个事务中写入（主键冲突时覆盖），返回写入行数。'''
+    rows = []
+    for df in frames:
+        values = df.astype(object).where(df.notna(), None)
+        rows.extend(values.itertuples(index=False, name=None))
+    with conn:
+        conn.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(COLUMNS)}) "
+                         f"VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+    return len(rows)
+
+
+def ingest_daily(pro, db_file=DB_FILE, table=DAILY_DATA_TABLE, start_date=START_DATE, end_date=None,
+                 calls_per_minute=CALLS_PER_MINUTE, max_workers=MAX_WORKERS, max_retries=MAX_RETRIES,
+                 backoff=BACKOFF_SECONDS, batch_dates=BATCH_DATES, sleep=time.sleep):
+    '''
+    下载 [start_date, end_date] 内 daily_data 中缺失的全部交易日。
+    返回 {'dates': 下载的交易日数, 'inserted': 写入行数, 'failed': {交易日: 错误信息}}。
+    '''
+    end_date = end_date or datetime.today().strftime('%Y%m%d')
+    retry = {'max_retries': max_retries, 'backoff': backoff, 'sleep': sleep}
+    limiter = RateLimiter(calls_per_minute, sleep=sleep)
+    # 数据库唯一的写连接（WAL 模式），下载期间选股工具和回测脚本仍可读取
+    with write_connection(db_file) as conn:
+        create_tables(conn, table)
+        todo = missing_dates(conn, refresh_calendar(conn, pro, start_date, end_date, limiter, **retry), table)
+        print(f"信息: 需要下载 {len(todo)} 个交易日")
+        sys.stdout.flush()
+
+        inserted, done, failed, pending = 0, 0, {}, []
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(fetch_trade_date, pro, d, limiter, **retry): d for d in todo}
+            for future in as_completed(futures):
+                trade_date = futures[future]
+                try:
+                    pending.append(future.result())
+                except Exception as e:
+                    failed[trade_date] = str(e)
+                    print(f"错误: 交易日 {trade_date} 下载失败: {e}")
+                if len(pending) >= batch_dates:
+                    inserted += write_dates(conn, pending, table)
+                    done += len(pending)
+                    pending = []
+                    print(f"信息: 已写入 {done}/{len(todo)} 个交易日，共 {inserted} 行")
+                    sys.stdout.flush()
+        if pending:
+            inserted += write_dates(conn, pending, table)
+            done += len(pending)
+        refresh_coverage_catalog(conn, table)
+        refresh_latest_snapshot(conn, table)
+    return {'dates': done, 'inserted': inserted, 'failed': failed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='全市场日线增量下载（按交易日）')
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--table', default=DAILY_DATA_TABLE)
+    parser.add_argument('--start', default=START_DATE)
+    parser.add_argument('--end', default=None, help='默认为今天')
+    parser.add_argument('--calls-per-minute', type=int, default=CALLS_PER_MINUTE)
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS)
+    parser.add_argument('--token', default=None, help='tushare token')
+    parser.add_argument('--fake', action='store_true', help='使用本地假数据源 FakeProApi')
+    parser.add_argument('--fake-stocks', type=int, default=100)
+    parser.add_argument('--fail-prob', type=float, default=0.0, help='假数据源每次调用失败的概率')
+    args = parser.parse_args()
+
+    if args.fake:
+        pro = FakeProApi(n_stocks=args.fake_stocks, start=args.start,
+                         end=args.end or datetime.today().strftime('%Y%m%d'),
+                         fail_prob=args.fail_prob)
+    else:
+        import tushare as ts
+        pro = ts.pro_api(args.token)
+
+    stats = ingest_daily(pro, args.db, args.table, args.start, args.end,
+                         calls_per_minute=args.calls_per_minute, max_workers=args.workers)
+    print(f"信息: 下载 {stats['dates']} 个交易日，写入 {stats['inserted']} 行，失败 {len(stats['failed'])} 个交易日")
+    sys.stdout.flush()
+    sys.exit(1 if stats['failed'] else 0)
@@ -0,0 +1,224 @@
+'''
+SQLite 数据访问层
+
+脚本中原来每次查询都 sqlite3.connect() / close() 一次（导入时取最后交易日、每个数据源的 start、
+选股工具载入……），每次都要重新打开文件、读取库结构、编译语句，且都没有设置任何 PRAGMA。
+这里统一为：
+  - 只读连接池：每个数据库文件最多 POOL_SIZE 个连接，以 mode=ro 打开，并设置
+    query_only、mmap_size、cache_size、temp_store；连接归还后复用，
+    sqlite3 按连接缓存已编译的语句（cached_statements），重复的查询不再重新编译；
+  - 写连接：每个数据库文件一个，WAL 模式（写入时读连接不被阻塞）、synchronous=NORMAL，
+    用锁保证同一时刻只有一个线程在写；
+  - 常用查询的辅助函数：fetch_one / fetch_all / read_frame / max_trade_date。
+
+连接可以在线程之间传递（check_same_thread=False），但同一时刻只由借出它的线程使用。
+数据库文件被替换或删除后（如重新生成合成数据库）应调用 close_all() 丢弃旧连接：
+空闲连接立即关闭，此时借出中的连接在归还时关闭。
+
+Index_Compare 通过 shared_path.py 导入本模块，两个子项目共用这一份实现。
+
+基准对比见 bench_db_access.py。
+'''
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+# --- 配置参数 ---
+POOL_SIZE = 4                    # 每个数据库文件的只读连接数上限
+MMAP_SIZE = 256 * 1024 * 1024    # 内存映射读取的字节数
+CACHE_SIZE_KB = 64 * 1024        # 每个连接的页缓存（KB）
+BUSY_TIMEOUT_MS = 5000           # 遇到写锁时的等待时间
+CACHED_STATEMENTS = 256          # 每个连接缓存的已编译语句数
+
+_pools = {}
+_writers = {}
+_registry_lock = threading.Lock()
+
+
+def _tune(conn):
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+
+
+def open_read_connection(db_file):
+    '''打开一个调优过的只读连接（数据库不存在时抛出 sqlite3.OperationalError，而不是新建空库）。'''
+    uri = 'file:' + os.path.abspath(db_file).replace('?', '%3f').replace('#', '%23') + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    _tune(conn)
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+class ReadPool:
+    '''一个数据库文件的只读连接池。'''
+
+    def __init__(self, db_file, size=POOL_SIZE):
+        self.db_file = db_file
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = self._open_or_wait()
+        if conn is None:  # 池已关闭：借出一个归还时即关闭的新连接
+            conn = open_read_connection(self.db_file)
+        return conn
+
+    def _open_or_wait(self):
+        with self.lock:
+            if self.closed:
+                return None
+            if self.opened < self.size:
+                conn = open_read_connection(self.db_file)
+                self.opened += 1
+                return conn
+        return self.idle.get()  # 连接都已借出时等待归还（池被关闭时收到 None）
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self.lock:
+            if not self.closed:
+                self.idle.put(conn)
+                return
+        # 借出期间池已被关闭（close_all）：连接不再放回，直接关闭，并唤醒可能在等待的线程
+        conn.close()
+        self.idle.put(None)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        '''关闭空闲连接；借出中的连接在归还时关闭（不打断正在进行的查询）。'''
+        with self.lock:
+            self.closed = True
+            idle = []
+            while True:
+                try:
+                    idle.append(self.idle.get_nowait())
+                except queue.Empty:
+                    break
+            self.opened = 0
+        for conn in idle:
+            if conn is not None:
+                conn.close()
+
+
+def get_read_pool(db_file):
+    key = os.path.abspath(db_file)
+    with _registry_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ReadPool(key)
+        return pool
+
+
+@contextmanager
+def read_connection(db_file):
+    '''从连接池借出一个只读连接，with 结束时归还。'''
+    with get_read_pool(db_file).connection() as conn:
+        yield conn
+
+
+def fetch_one(db_file, sql, params=()):
+    with read_connection(db_file) as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def fetch_all(db_file, sql, params=()):
+    with read_connection(db_file) as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def read_frame(db_file, sql, params=(), **kwargs):
+    '''pandas.read_sql_query 的连接池版本。'''
+    with read_connection(db_file) as conn:
+        return pd.read_sql_query(sql, conn, params=params, **kwargs)
+
+
+def max_trade_date(db_file, table):
+    '''日线表的最后交易日（YYYYMMDD 字符串），表为空时返回 None。'''
+    row = fetch_one(db_file, f"SELECT MAX(trade_date) FROM {table}")
+    return row[0] if row and row[0] else None
+
+
+def file_signature(db_file):
+    '''
+    数据库文件的大小和修改时间，供缓存判断数据库是否变化。
+    WAL 模式下新写入的数据先进入 -wal 文件，检查点之前主文件不变，因此 -wal 文件非空时同时包含它的状态；
+    空的 -wal 文件（只是打开过写连接、检查点后被清空）不影响签名。
+    签名不同不一定表示内容变化，需要精确判断的调用方（如 bar_store）应再比较表的内容指纹。
+    '''
+    st = os.stat(db_file)
+    signature = {'db_size': st.st_size, 'db_mtime': st.st_mtime}
+    try:
+        st = os.stat(db_file + '-wal')
+    except FileNotFoundError:
+        return signature
+    if st.st_size:
+        signature.update(wal_size=st.st_size, wal_mtime=st.st_mtime)
+    return signature
+
+
+def _open_writer(db_file):
+    conn = sqlite3.connect(db_file, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    _tune(conn)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+@contextmanager
+def write_connection(db_file):
+    '''
+    借出数据库文件唯一的写连接（不存在时新建数据库），同一时刻只有一个线程持有。
+    事务由调用方用 with conn: 控制；with 结束时未提交的修改会被回滚。
+    '''
+    key = os.path.abspath(db_file)
+    with _registry_lock:
+        entry = _writers.get(key)
+        if entry is None:
+            entry = _writers[key] = [None, threading.RLock()]
+    with entry[1]:
+        if entry[0] is None:
+            entry[0] = _open_writer(key)
+        conn = entry[0]
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+
+def close_all(db_file=None):
+    '''关闭 db_file（为 None 时为全部数据库）的池中连接和写连接。'''
+    key = os.path.abspath(db_file) if db_file else None
+    with _registry_lock:
+        pools = [p for k, p in _pools.items() if key in (None, k)]
+        writers = [w for k, w in _writers.items() if key in (None, k)]
+        for k in [k for k in _pools if key in (None, k)]:
+            del _pools[k]
+        for k in [k for k in _writers if key in (None, k)]:
+            del _writers[k]
+    for pool in pools:
+        pool.close()
+    for conn, lock in writers:
+        with lock:
+            if conn is not None:
+                conn.close()
@@ -0,0 +1,69 @@
+'''
+选股筛选索引
+
+载入数据时建立一次，之后每次筛选只需几次二分查找和位运算：
+  - 数值列（pe_ttm、pb、total_mv_billion）按值排好序，区间 [lo, hi] 用 searchsorted 找到
+    对应的一段行位置，NaN 不参与排序，因此永远不会被选中；
+  - 每个行业预先生成一个位图（np.packbits 压缩的 uint8 数组），选中的多个行业按位或，
+    再与各数值区间的位图按位与；
+  - 布尔列（如技术面扫描的五步条件）同样预先生成位图，要求为 True 时与位图按位与，
+    要求为 False 时与其取反按位与（缺失值视为 False）。
+筛选条件与 StockFilterApp 原来的布尔掩码完全相同：值非空且 lo <= 值 <= hi，
+选中了行业时只保留这些行业。
+'''
+import numpy as np
+import pandas as pd
+
+RANGE_COLUMNS = ('pe_ttm', 'pb', 'total_mv_billion')
+CATEGORY_COLUMN = 'industry'
+
+
+class FilterIndex:
+    def __init__(self, df, range_columns=RANGE_COLUMNS, category=CATEGORY_COLUMN, flag_columns=()):
+        self.n = len(df)
+        self.sorted_values, self.sorted_rows = {}, {}
+        for col in range_columns:
+            values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64)
+            rows = np.flatnonzero(~np.isnan(values))
+            order = np.argsort(values[rows], kind='stable')
+            self.sorted_values[col] = values[rows][order]
+            self.sorted_rows[col] = rows[order]
+
+        self.category_bits = {}
+        if category in df:
+            codes, names = pd.factorize(df[category])
+            for i, name in enumerate(names):
+                self.category_bits[name] = np.packbits(codes == i)
+        self.flag_bits = {col: np.packbits(df[col].eq(True).to_numpy()) for col in flag_columns}
+        self.all_bits = np.packbits(np.ones(self.n, dtype=bool))
+
+    def range_bits(self, col, lo, hi):
+        '''lo <= 值 <= hi 的行的位图。'''
+        values = self.sorted_values[col]
+        start = np.searchsorted(values, lo, side='left')
+        stop = np.searchsorted(values, hi, side='right')
+        mask = np.zeros(self.n, dtype=bool)
+        mask[self.sorted_rows[col][start:stop]] = True
+        return np.packbits(mask)
+
+    def category_bitmap(self, names):
+        '''names 中任一行业的行的位图；names 为空时不限制行业。'''
+        if not names:
+            return self.all_bits
+        bits = np.zeros_like(self.all_bits)
+        for name in names:
+            if name in self.category_bits:
+                bits |= self.category_bits[name]
+        return bits
+
+    def query(self, ranges, categories=None, flags=None):
+        '''
+        ranges 为 {列名: (lo, hi)}，categories 为选中的行业集合，
+        flags 为 {布尔列名: 要求的值}。返回满足全部条件的行位置（升序）。
+        '''
+        bits = self.category_bitmap(categories)
+        for col, (lo, hi) in ranges.items():
+            bits = bits & self.range_bits(col, lo, hi)
+        for col, required in (flags or {}).items():
+            bits = bits & (self.flag_bits[col] if required else ~self.flag_bits[col])
+        return np.flatnonzero(np.unpackbits(bits, count=self.n))
@@ -1,16 +1,21 @@
 import backtrader as bt
 import pandas as pd
 import sqlite3
-import tkinter as tk
-from tkinter import messagebox
+try:
+    import tkinter as tk
+    from tkinter import messagebox
+except ImportError:  # 无图形界面的服务器上可以没有 tkinter，批量回测见 batch_runner.py
+    tk = messagebox = None
 import os
 from datetime import datetime
 import sys
-import io
-
-# 确保标准输出编码为 UTF-8
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', line_buffering=True)
-os.environ["PYTHONIOENCODING"] = "utf-8"
+from db_access import max_trade_date
+from numpy_feed import NumpyData, load_numpy_bars
+from universe_loader import load_universe
+from indicator_cache import refresh_indicator_cache, strategy_indicators
+from candidate_scheduler import CandidateScheduler, warmup_bars
+from universe_pruning import prune_universe
+from result_writers import CsvRecordWriter, TextLineWriter
 
 # --- 配置参数 ---
 DB_FILE = 'daily_data.db'
@@ -18,6 +23,9 @@ DAILY_DATA_TABLE = 'daily_data'
 STOCK_POOL_CSV = 'stock_pool.csv'
 PLOT_RESULTS = True
 TRADES_CSV = 'trades.csv'
+TRADE_RECORD_COLUMNS = ('date', 'ts_code', 'type', 'price', 'size', 'value', 'commission', 'profit', 'net_profit')
+LOG_TXT = 'backtest_log.txt'
+PRUNE_UNIVERSE = True  # 只把回测区间内出现过买入信号的股票加入为数据源（结果不变）
 
 # --- Tkinter 界面 ---
 class StockSelectorApp:
@@ -96,7 +104,7 @@ class StockSelectorApp:
         self.root.destroy()
 
 # --- 自定义数据加载器 ---
-class SQLiteData(bt.feeds.DataBase):
+class SQLiteData(NumpyData):
     params = (
         ('dataname', None),
         ('fromdate', datetime(2000, 1, 1)),
@@ -108,79 +116,49 @@ class SQLiteData(bt.feeds.DataBase):
         ('nullvalue', float('NaN'))
     )
 
-    def __init__(self):
-        super().__init__()
-        self.conn = None
-        self.cursor = None
-
     def start(self):
+        # 一次性读取整段列数组（优先列式存储），NULL 列转为 NaN，预加载时整段写入 lines
+        # run_backtest 已通过 load_universe 批量加载时直接使用传入的 bars
+        if self.p.bars is not None:
+            super().start()
+            return
         try:
-            self.conn = sqlite3.connect(DB_FILE)
-            self.cursor = self.conn.cursor()
-            query = f"""
-                SELECT trade_date, open, high, low, close, vol
-                FROM {DAILY_DATA_TABLE}
-                WHERE ts_code = ? AND trade_date BETWEEN ? AND ?
-                ORDER BY trade_date ASC
-            """
-            from_date_str = self.p.fromdate.strftime('%Y%m%d')
-            to_date_str = self.p.todate.strftime('%Y%m%d')
-            self.cursor.execute(query, (self.p.dataname, from_date_str, to_date_str))
+            self.p.bars = load_numpy_bars(self.p.dataname, self.p.fromdate, self.p.todate,
+                                          DB_FILE, DAILY_DATA_TABLE)
         except sqlite3.Error as e:
             print(f"错误: 数据库连接或查询失败: {e}")
             sys.stdout.flush()
             raise
-
-    def stop(self):
-        if self.conn:
-            self.conn.close()
-
-    def _load(self):
-        row = self.cursor.fetchone()
-        if row is None:
-            return False
-        try:
-            dt = datetime.strptime(row[0], '%Y%m%d')
-            self.lines.datetime[0] = bt.date2num(dt)
-            self.lines.open[0] = float(row[1]) if row[1] is not None else float('nan')
-            self.lines.high[0] = float(row[2]) if row[2] is not None else float('nan')
-            self.lines.low[0] = float(row[3]) if row[3] is not None else float('nan')
-            self.lines.close[0] = float(row[4]) if row[4] is not None else float('nan')
-            self.lines.volume[0] = float(row[5]) if row[5] is not None else float('nan')
-            self.lines.openinterest[0] = float('NaN')
-            return True
-        except Exception as e:
-            print(f"错误: 数据处理失败: {e}, 数据: {row}")
-            sys.stdout.flush()
-            return False
+        super().start()
 
 # --- 策略 ---
 class MyMultiStockStrategy(bt.Strategy):
     params = (
         ('max_positions', 5),
+        ('pool_size', None),  # 裁剪前的股票数（持仓上限不超过它），None 时为数据源个数
+        ('trade_writer', None),  # 调用方提供的交易记录写出器（由调用方关闭），None 时交易记录保存在 trade_records 列表中
+        ('log_writer', None),  # 调用方提供的日志写出器，None 时日志保存在 log_messages 列表中
+        ('db_file', DB_FILE),  # 指标缓存的位置（数据库同目录下）
     )
 
     def __init__(self):
-        self.log_messages = []
-        self.trade_records = []
+        self.log_messages = self.p.log_writer if self.p.log_writer is not None else []
+        self.trade_records = self.p.trade_writer if self.p.trade_writer is not None else []
         self.order = {}
         self.bought_price = {}
         self.num_positions = 0
-        self.max_positions = min(self.p.max_positions, len(self.datas))
+        self.max_positions = min(self.p.max_positions, self.p.pool_size or len(self.datas))
         self.indicators = {}
         for d in self.datas:
-            self.indicators[d] = {
-                'ma240': bt.indicators.SMA(d.close, period=240, subplot=True),
-                'ma60': bt.indicators.SMA(d.close, period=60, subplot=True),
-                'ma20': bt.indicators.SMA(d.close, period=20, subplot=True),
-                'vol_ma3': bt.indicators.SMA(d.volume, period=3, subplot=True),
-                'vol_ma8': bt.indicators.SMA(d.volume, period=8, subplot=True),
-                'rsi13': bt.indicators.RSI(d.close, period=13, subplot=True),
-                'rsi6': bt.indicators.RSI(d.close, period=6, subplot=True),
-            }
+            # 优先读取指标缓存，缓存缺失时回退为 bt.indicators.SMA / RSI
+            self.indicators[d] = strategy_indicators(
+                d, ('ma240', 'ma60', 'ma20', 'vol_ma3', 'vol_ma8', 'rsi13', 'rsi6'), db_file=self.p.db_file, subplot=True)
+        self.required_bars = {d: warmup_bars(self.indicators[d]) for d in self.datas}
+        # 只检查有持仓和通过预筛选（close > MA240 且 MA240 向上）的股票
+        self.scheduler = CandidateScheduler(self, self.indicators)
 
     def log(self, txt, dt=None, data=None):
-        dt = dt or self.datas[0].datetime.date(0)
+        dt = dt or self.datetime.date(0)  # 策略时钟（各数据源日期的最大值），不受第一个数据源停牌影响
         ts_code_str = f"[{data._name}] " if data else ""
         message = f'{dt.isoformat()}, {ts_code_str}{txt}'
         self.log_messages.append(message)
@@ -195,7 +173,7 @@ class MyMultiStockStrategy(bt.Strategy):
                 data=order.data
             )
             self.trade_records.append({
-                'date': self.datas[0].datetime.date(0).isoformat(),
+                'date': self.datetime.date(0).isoformat(),
                 'ts_code': order.data._name,
                 'type': trade_type,
                 'price': order.executed.price,
@@ -210,6 +188,7 @@ class MyMultiStockStrategy(bt.Strategy):
                 if order.data in self.bought_price:
                     del self.bought_price[order.data]
                 self.num_positions -= 1
+            self.scheduler.update_position(order.data)
             self.order.pop(order.data, None)
         elif order.status in [order.Canceled, order.Margin, order.Rejected]:
             reason = order.info.get('status_text', '未知原因')
@@ -221,7 +200,7 @@ class MyMultiStockStrategy(bt.Strategy):
             return
         self.log(f'交易结束, 股票: {trade.data._name}, 总利润: {trade.pnl:.2f}, 净利润: {trade.pnlcomm:.2f}', data=trade.data)
         self.trade_records.append({
-            'date': self.datas[0].datetime.date(0).isoformat(),
+            'date': self.datetime.date(0).isoformat(),
             'ts_code': trade.data._name,
             'type': '交易结束',
             'price': trade.price,
@@ -233,13 +212,9 @@ class MyMultiStockStrategy(bt.Strategy):
         })
 
     def next(self):
-        for d in self.datas:
+        for d in self.scheduler.candidates(entries=self.num_positions < self.max_positions):
             ind = self.indicators[d]
-            required_bars = max(ind['ma240'].params.period, ind['ma60'].params.period,
-                                ind['ma20'].params.period, ind['vol_ma3'].params.period,
-                                ind['vol_ma8'].params.period, ind['rsi13'].params.period,
-                                ind['rsi6'].params.period)
-            if len(d) <= required_bars:
+            if len(d) <= self.required_bars[d]:
                 continue
             if any(ind[key][0] is None for key in ind):
                 continue
@@ -271,13 +246,6 @@ class MyMultiStockStrategy(bt.Strategy):
                                 self.log(f'发出买入信号, 股票: {d._name}, 建议买入数量: {size}, 占用资金: {size * d.close[0]:.2f}', data=d)
                                 self.order[d] = self.buy(data=d, size=size, exectype=bt.Order.Market, valid=1)
 
-    def stop(self):
-        # 保存交易记录到 CSV
-        if self.trade_records:
-            df = pd.DataFrame(self.trade_records)
-            df.to_csv(TRADES_CSV, index=False, encoding='utf-8')
-            print(f"交易记录已保存到 {TRADES_CSV}")
-
 # --- 进度分析器 ---
 class ProgressLogger(bt.Analyzer):
     def __init__(self):
@@ -374,47 +342,44 @@ def run_backtest(selected_ts_codes):
     cerebro.broker.setcommission(commission=commission_rate)
 
     from_date_obj = datetime(2022, 1, 1)
-    conn_check = sqlite3.connect(DB_FILE)
-    cursor_check = conn_check.cursor()
-    cursor_check.execute(f"SELECT MAX(trade_date) FROM {DAILY_DATA_TABLE}")
-    last_date_str = cursor_check.fetchone()[0]
+    last_date_str = max_trade_date(DB_FILE, DAILY_DATA_TABLE)
     if not last_date_str:
         print("错误: 数据库中无数据")
-        conn_check.close()
         return
     to_date_obj = datetime.strptime(last_date_str, '%Y%m%d')
     print(f"数据库最后日期: {to_date_obj.date()}")
     sys.stdout.flush()
 
+    # 一次批量查询加载全部股票，覆盖目录表用于跳过区间内无数据的股票
     try:
-        for ts_code in selected_ts_codes:
-            check_query = f"""
-                SELECT COUNT(*)
-                FROM {DAILY_DATA_TABLE}
-                WHERE ts_code = ? AND trade_date BETWEEN ? AND ?
-            """
-            from_date_str_check = from_date_obj.strftime('%Y%m%d')
-            to_date_str_check = to_date_obj.strftime('%Y%m%d')
-            cursor_check.execute(check_query, (ts_code, from_date_str_check, to_date_str_check))
-            count_rows = cursor_check.fetchone()[0]
-            if count_rows == 0:
-                print(f"警告: 股票 {ts_code} 在 {from_date_str_check} 到 {to_date_str_check} 之间无数据")
-                sys.stdout.flush()
-                continue
-            data = SQLiteData(dataname=ts_code, fromdate=from_date_obj, todate=to_date_obj)
-            cerebro.adddata(data)
-            print(f"股票 {ts_code} 的数据已添加")
-            sys.stdout.flush()
+        bars_by_code, skipped = load_universe(selected_ts_codes, from_date_obj, to_date_obj,
+                                              DB_FILE, DAILY_DATA_TABLE)
     except sqlite3.Error as e:
         print(f"错误: 数据库预检查失败: {e}")
         sys.stdout.flush()
         return
-    finally:
-        conn_check.close()
+
+    for ts_code, reason in skipped.items():
+        print(f"警告: 股票 {ts_code} {reason}")
+    pool_size = len(bars_by_code)
+    if PRUNE_UNIVERSE:
+        kept, _ = prune_universe(list(bars_by_code), bars_by_code)
+        print(f"信息: 按买入信号裁剪股票池，{len(bars_by_code)} 只中保留 {len(kept)} 只")
+        bars_by_code = {code: bars_by_code[code] for code in kept}
+    refresh_indicator_cache(list(bars_by_code), DB_FILE, table=DAILY_DATA_TABLE)
+    for ts_code, bars in bars_by_code.items():
+        data = SQLiteData(dataname=ts_code, fromdate=from_date_obj, todate=to_date_obj, bars=bars)
+        cerebro.adddata(data)
+        print(f"股票 {ts_code} 的数据已添加")
+    sys.stdout.flush()
 
     print("添加回测策略...")
     sys.stdout.flush()
-    cerebro.addstrategy(MyMultiStockStrategy, max_positions=min(len(selected_ts_codes), 5))
+    # 交易记录和日志在回测过程中分批写入 TRADES_CSV / LOG_TXT，回测结束后从日志文件逐行输出
+    trade_writer = CsvRecordWriter(TRADES_CSV, TRADE_RECORD_COLUMNS)
+    log_writer = TextLineWriter(LOG_TXT)
+    cerebro.addstrategy(MyMultiStockStrategy, max_positions=min(len(selected_ts_codes), 5), pool_size=pool_size,
+                        trade_writer=trade_writer, log_writer=log_writer)
     print("添加回测分析器...")
     sys.stdout.flush()
     cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
@@ -426,9 +391,14 @@ def run_backtest(selected_ts_codes):
     print('开始回测...')
     sys.stdout.flush()
     try:
-        strategies = cerebro.run()
+        try:
+            strategies = cerebro.run()
+        finally:
+            trade_writer.close()
+            log_writer.close()
         strategy = strategies[0]
         print('回测完成')
+        print(f"交易记录已保存到 {TRADES_CSV}")
         sys.stdout.flush()
 
         print("\n--- 回测统计 ---")
@@ -460,9 +430,10 @@ def run_backtest(selected_ts_codes):
                   f"数量: {trade['size']:.2f}, 净利润: {trade['net_profit']:.2f}")
         sys.stdout.flush()
 
-        print("\n--- 交易日志 ---")
-        for msg in strategy.log_messages:
-            print(msg)
+        print(f"\n--- 交易日志（{LOG_TXT}，共 {len(strategy.log_messages)} 条）---")
+        with open(LOG_TXT, encoding='utf-8') as f:
+            for msg in f:
+                print(msg, end='')
         sys.stdout.flush()
 
         if PLOT_RESULTS:
@@ -480,6 +451,11 @@ def run_backtest(selected_ts_codes):
 
 # --- 主程序 ---
 if __name__ == '__main__':
+    # 确保标准输出编码为 UTF-8（只在直接运行脚本时设置，被其他模块导入时不改动 sys.stdout）
+    # 不再按行缓冲，需要及时输出的地方显式 flush
+    sys.stdout.reconfigure(encoding='utf-8')
+    os.environ["PYTHONIOENCODING"] = "utf-8"
+
     print("--- 回测程序开始执行 ---")
     sys.stdout.flush()
     try:
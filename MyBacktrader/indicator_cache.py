@@ -0,0 +1,346 @@
+'''
+指标缓存
+
+把每只股票全部历史上的 SMA / RSI 序列保存到数据库同目录下的 indicator_cache/，
+每只股票一个 .npz，键为 指标_数据列_周期（如 sma_close_240、rsi_close_6），
+并记录所依据数据的指纹（行数 + close/vol 的 SHA1）。
+
+  - 数据库追加新交易日后只计算新增的 K 线：SMA 用新窗口的 math.fsum，
+    RSI 从缓存的平滑均值继续递推；历史数据有改动时整只股票重算；
+  - 数值与 backtrader 的 SMA（math.fsum / period）逐位一致；RSI 同样按 backtrader 的
+    递推计算，分母为 0 时按 safediv 规则取 100 / 50，不再抛出除零错误；
+  - CachedIndicator 把缓存序列按数据源的交易日整段写入 lines，并保留与原指标相同的
+    最小周期，策略的起始 K 线不变。缓存的 RSI 从股票在数据库中的第一根 K 线起递推，
+    数据源从更晚的回测起始日开始时，按数据源的收盘价从起始日重新递推（与 bt.ind.RSI、
+    vector_sim 相同），均线只取决于窗口内的 K 线，直接取缓存。
+
+命令行用法（回测前预先刷新缓存）：
+    python indicator_cache.py daily_data.db [--rebuild]
+'''
+import argparse
+import array
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import sys
+
+import backtrader as bt
+import numpy as np
+
+from numpy_feed import num_to_dates
+from universe_loader import load_universe
+
+# --- 配置参数 ---
+DB_FILE = 'daily_data.db'
+DAILY_DATA_TABLE = 'daily_data'
+CACHE_DIRNAME = 'indicator_cache'
+CACHE_VERSION = 1
+
+# 回测脚本用到的全部指标：(指标, 数据列, 周期)
+DEFAULT_SPECS = (
+    ('sma', 'close', 10), ('sma', 'close', 20), ('sma', 'close', 60),
+    ('sma', 'close', 120), ('sma', 'close', 240),
+    ('sma', 'vol', 3), ('sma', 'vol', 8),
+    ('rsi', 'close', 6), ('rsi', 'close', 13),
+)
+
+_NAME_PATTERN = re.compile(r'^(vol_ma|ma|rsi)(\d+)$')
+
+
+def cache_dir_for(db_file):
+    '''缓存目录放在数据库文件旁边。'''
+    return os.path.join(os.path.dirname(os.path.abspath(db_file)), CACHE_DIRNAME)
+
+
+def indicator_key(kind, source, period):
+    return f'{kind}_{source}_{period}'
+
+
+def parse_indicator_name(name):
+    '''策略中的指标名 -> (指标, 数据列, 周期)：ma20 / vol_ma3 / rsi6。'''
+    match = _NAME_PATTERN.match(name)
+    if not match:
+        raise KeyError(f"无法识别的指标名: {name}")
+    prefix, period = match.group(1), int(match.group(2))
+    if prefix == 'ma':
+        return 'sma', 'close', period
+    if prefix == 'vol_ma':
+        return 'sma', 'vol', period
+    return 'rsi', 'close', period
+
+
+def indicator_minperiod(kind, period):
+    '''与 backtrader 指标相同的最小周期：SMA 为 period，RSI 为 period + 1。'''
+    return period + 1 if kind == 'rsi' else period
+
+
+def data_digest(close, vol):
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(close, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(vol, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def _sma(x, period, start=0, out=None):
+    '''math.fsum 窗口均值，从 start 行开始计算（之前的行沿用 out 中已有的值）。'''
+    n = len(x)
+    values = np.full(n, np.nan) if out is None else out
+    xs = x.tolist()
+    for i in range(max(start, period - 1), n):
+        values[i] = math.fsum(xs[i - period + 1:i + 1]) / period
+    return values
+
+
+def _rsi(close, period, start=0, prev=None):
+    '''
+    backtrader RSI 的逐根递推。prev 为 (rsi, maup, madown) 三个已有序列，
+    start 之前的行直接沿用；返回新的三个序列。
+    '''
+    n = len(close)
+    rsi, maup, madown = (np.full(n, np.nan) for _ in range(3))
+    if prev is not None and start > 0:
+        for dst, src in zip((rsi, maup, madown), prev):
+            dst[:start] = src[:start]
+    if n <= period:
+        return rsi, maup, madown
+    diff = np.empty(n)
+    diff[0] = np.nan
+    diff[1:] = close[1:] - close[:-1]
+    up = np.maximum(diff, 0.0).tolist()
+    down = np.maximum(-diff, 0.0).tolist()
+
+    alpha = 1.0 / period
+    alpha1 = 1.0 - alpha
+    first = max(start, period)
+    if first == period:
+        maup[period] = math.fsum(up[1:period + 1]) / period
+        madown[period] = math.fsum(down[1:period + 1]) / period
+        first += 1
+    u, d = float(maup[first - 1]), float(madown[first - 1])
+    for i in range(first, n):
+        u = u * alpha1 + up[i] * alpha
+        d = d * alpha1 + down[i] * alpha
+        maup[i], madown[i] = u, d
+    lo = max(start, period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu, md = maup[lo:], madown[lo:]
+        rs = np.where(md == 0.0, np.where(mu == 0.0, 1.0, np.inf), mu / md)
+        rsi[lo:] = 100.0 - 100.0 / (1.0 + rs)
+    return rsi, maup, madown
+
+
+def compute_indicators(bars, specs=DEFAULT_SPECS, cached=None):
+    '''
+    计算一只股票的全部指标。bars 为全部历史（trade_date / close / vol）。
+    cached 为已有缓存（load_cached 的结果），数据只是在末尾追加时只算新增的行。
+    返回 (写入 .npz 的字典, 增量计算的起始行)，起始行为 0 表示全部重算。
+    '''
+    close = np.asarray(bars['close'], dtype=np.float64)
+    vol = np.asarray(bars['vol'], dtype=np.float64)
+    n = len(close)
+    start = 0
+    if cached is not None:
+        n_old = len(cached['trade_date'])
+        if (n_old <= n and np.array_equal(cached['trade_date'], bars['trade_date'][:n_old])
+                and str(cached['digest']) == data_digest(close[:n_old], vol[:n_old])):
+            start = n_old
+        else:
+            cached = None
+
+    result = {
+        'version': np.int32(CACHE_VERSION),
+        'trade_date': np.asarray(bars['trade_date'], dtype=np.int32),
+        'digest': np.array(data_digest(close, vol)),
+    }
+    sources = {'close': close, 'vol': vol}
+    for kind, source, period in specs:
+        key = indicator_key(kind, source, period)
+        has_old = cached is not None and key in cached
+        first = start if has_old else 0
+        x = sources[source]
+        if kind == 'sma':
+            out = np.full(n, np.nan)
+            if has_old:
+                out[:first] = cached[key][:first]
+            result[key] = _sma(x, period, first, out)
+        elif kind == 'rsi':
+            prev = (cached[key], cached[key + '_maup'], cached[key + '_madown']) if has_old else None
+            rsi, maup, madown = _rsi(x, period, first, prev)
+            result[key], result[key + '_maup'], result[key + '_madown'] = rsi, maup, madown
+        else:
+            raise KeyError(f"未知的指标类型: {kind}")
+    return result, start
+
+
+def _cache_file(cache_dir, ts_code):
+    return os.path.join(cache_dir, f'{ts_code}.npz')
+
+
+def load_cached(ts_code, cache_dir):
+    '''读取一只股票的缓存，不存在或版本不符时返回 None。'''
+    path = _cache_file(cache_dir, ts_code)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as f:
+            cached = {name: f[name] for name in f.files}
+    except (OSError, ValueError):
+        return None
+    if int(cached.get('version', -1)) != CACHE_VERSION:
+        return None
+    return cached
+
+
+def _save_cached(ts_code, cache_dir, values):
+    path = _cache_file(cache_dir, ts_code)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **values)
+    os.replace(tmp, path)
+
+
+def refresh_indicator_cache(ts_codes=None, db_file=DB_FILE, cache_dir=None, table=DAILY_DATA_TABLE,
+                            specs=DEFAULT_SPECS, rebuild=False):
+    '''
+    刷新指定股票（默认为数据库中全部股票）的指标缓存。
+    已是最新的股票直接跳过，追加了新交易日的股票只计算新增部分。
+    返回 {'unchanged': n, 'incremental': n, 'full': n}。
+    '''
+    cache_dir = cache_dir or cache_dir_for(db_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    if ts_codes is None:
+        conn = sqlite3.connect(db_file)
+        try:
+            ts_codes = [row[0] for row in conn.execute(f"SELECT DISTINCT ts_code FROM {table}")]
+        finally:
+            conn.close()
+
+    bars_by_code, _ = load_universe(ts_codes, '19000101', '99991231', db_file=db_file, table=table,
+                                    fields=('close', 'vol'))
+    stats = {'unchanged': 0, 'incremental': 0, 'full': 0}
+    keys = {indicator_key(*spec) for spec in specs}
+    for i, (code, bars) in enumerate(bars_by_code.items(), 1):
+        cached = None if rebuild else load_cached(code, cache_dir)
+        if (cached is not None and keys <= set(cached)
+                and np.array_equal(cached['trade_date'], bars['trade_date'])
+                and str(cached['digest']) == data_digest(bars['close'], bars['vol'])):
+            stats['unchanged'] += 1
+            continue
+        values, start = compute_indicators(bars, specs, cached)
+        stats['incremental' if start else 'full'] += 1
+        _save_cached(code, cache_dir, values)
+        if i % 500 == 0:
+            print(f"信息: 指标缓存已处理 {i}/{len(bars_by_code)} 只股票")
+            sys.stdout.flush()
+    return stats
+
+
+def latest_indicators(ts_codes, cache_dir, names):
+    '''
+    选股用：每只股票最后一根 K 线的指标值。
+    返回 {ts_code: {name: value}}，缓存中没有的股票不出现在结果里。
+    '''
+    result = {}
+    for code in ts_codes:
+        cached = load_cached(code, cache_dir)
+        if cached is None or not len(cached['trade_date']):
+            continue
+        row = {}
+        for name in names:
+            key = indicator_key(*parse_indicator_name(name))
+            if key in cached:
+                row[name] = float(cached[key][-1])
+        row['trade_date'] = int(cached['trade_date'][-1])
+        result[code] = row
+    return result
+
+
+def _feed_trade_dates(data):
+    '''数据源已预加载的全部 K 线日期（YYYYMMDD 整数）。'''
+    return num_to_dates(np.frombuffer(data.datetime.array, dtype=np.float64)[:data.buflen()])
+
+
+def _to_array(values):
+    out = array.array('d')
+    out.frombytes(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return out
+
+
+class CachedIndicator(bt.Indicator):
+    '''
+    从指标缓存读取的单线指标。params.period 与原指标相同，便于策略读取最长周期；
+    最小周期按原指标设置，最小周期之前的值为 NaN，与 backtrader 计算的结果一致。
+    '''
+    lines = ('value',)
+    params = (('values', None), ('period', 1), ('minperiod', 1))
+
+    def __init__(self):
+        self.addminperiod(self.p.minperiod)
+
+    def once(self, start, end):
+        # 整段写入，不逐根赋值
+        end = min(end, len(self.p.values))
+        if end > start:
+            self.lines.value.array[start:end] = self.p.values[start:end]
+
+    def next(self):
+        i = len(self) - 1
+        self.lines.value[0] = self.p.values[i] if i < len(self.p.values) else float('nan')
+
+
+def strategy_indicators(data, names, cache_dir=None, db_file=DB_FILE, **kwargs):
+    '''
+    为策略创建一组指标，返回 {name: 指标}。
+    缓存中有该股票且覆盖数据源的全部交易日时使用 CachedIndicator（RSI 按数据源的起始日重新递推），
+    否则回退为 bt.indicators.SMA / RSI（RSI 加 safediv=True，分母为 0 时与缓存一样取 100 / 50，
+    两条路径的行为相同）。kwargs 传给指标（如 subplot=True）。
+    '''
+    cache_dir = cache_dir or cache_dir_for(db_file)
+    cached = load_cached(data._name, cache_dir) if data._name else None
+    positions = None
+    if cached is not None and data.buflen() > 0:
+        feed_dates = _feed_trade_dates(data)
+        positions = np.searchsorted(cached['trade_date'], feed_dates)
+        if (positions >= len(cached['trade_date'])).any() or \
+                not np.array_equal(cached['trade_date'][np.minimum(positions, len(cached['trade_date']) - 1)],
+                                   feed_dates) or (np.diff(positions) != 1).any():
+            positions = None  # 缓存未覆盖数据源的全部交易日，或数据源不是连续的一段（需要刷新缓存）
+
+    inds = {}
+    feed_close = None
+    for name in names:
+        kind, source, period = parse_indicator_name(name)
+        key = indicator_key(kind, source, period)
+        if positions is not None and key in cached:
+            minperiod = indicator_minperiod(kind, period)
+            if kind == 'rsi' and positions[0] > 0:
+                # 数据源晚于股票的第一根 K 线开始：与 bt.ind.RSI 一样从数据源的第一根 K 线起递推
+                if feed_close is None:
+                    feed_close = np.frombuffer(data.close.array, dtype=np.float64)[:data.buflen()].copy()
+                values = _rsi(feed_close, period)[0]
+            else:
+                values = np.asarray(cached[key])[positions]
+            values[:minperiod - 1] = np.nan
+            inds[name] = CachedIndicator(data, values=_to_array(values), period=period,
+                                         minperiod=minperiod, **kwargs)
+            continue
+        line = data.close if source == 'close' else data.volume
+        if kind == 'sma':
+            inds[name] = bt.indicators.SMA(line, period=period, **kwargs)
+        else:
+            inds[name] = bt.indicators.RSI(line, period=period, safediv=True, **kwargs)
+    return inds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='刷新指标缓存')
+    parser.add_argument('db_file', nargs='?', default=DB_FILE)
+    parser.add_argument('--table', default=DAILY_DATA_TABLE)
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--rebuild', action='store_true', help='忽略已有缓存，全部重算')
+    args = parser.parse_args()
+    stats = refresh_indicator_cache(db_file=args.db_file, cache_dir=args.cache_dir, table=args.table,
+                                    rebuild=args.rebuild)
+    print(f"信息: 指标缓存刷新完成，未变 {stats['unchanged']} 只，增量 {stats['incremental']} 只，"
+          f"重算 {stats['full']} 只")
@@ -0,0 +1,119 @@
+'''
+最新行情快照表
+
+latest_snapshot 表为每只股票保存 daily_data 中最后一个交易日的那一行，
+选股工具载入时只需读取约 5000 行，不再对整张日线表做 GROUP BY 自连接。
+
+维护方式：
+  - 首次或 rebuild=True 时全量生成；
+  - 之后只处理 trade_date 大于上次记录日期的新行，按股票覆盖快照；
+  - 行数与记录不符（补录了历史数据或删改过行）时自动全量重建。
+同时建立 (ts_code, trade_date) 索引，全量生成和按股票查询最后一行都走索引。
+'''
+import sqlite3
+import sys
+
+from background_loader import read_sql_chunks
+from db_access import read_connection, write_connection
+
+# --- 配置参数 ---
+DB_FILE = 'daily_data.db'
+DAILY_DATA_TABLE = 'daily_data'
+SNAPSHOT_TABLE = 'latest_snapshot'
+SNAPSHOT_META_TABLE = 'latest_snapshot_meta'
+
+SNAPSHOT_FIELDS = ('open', 'high', 'low', 'close', 'vol', 'pe_ttm', 'pb', 'total_mv')
+
+
+def _create_snapshot_tables(conn, table):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SNAPSHOT_TABLE} (
+            ts_code TEXT PRIMARY KEY,
+            trade_date TEXT,
+            {', '.join(f'{name} REAL' for name in SNAPSHOT_FIELDS)}
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SNAPSHOT_META_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            max_trade_date TEXT,
+            row_count INTEGER
+        )
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_code_date ON {table} (ts_code, trade_date)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_trade_date ON {table} (trade_date)")
+
+
+def _insert_latest_rows(conn, table, since=None):
+    '''把每只股票（since 不为空时只看 trade_date > since 的行）的最后一行写入快照。'''
+    where = "WHERE trade_date > ?" if since is not None else ""
+    conn.execute(f"""
+        INSERT OR REPLACE INTO {SNAPSHOT_TABLE} (ts_code, trade_date, {', '.join(SNAPSHOT_FIELDS)})
+        SELECT t1.ts_code, t1.trade_date, {', '.join(f't1.{name}' for name in SNAPSHOT_FIELDS)}
+        FROM {table} t1
+        INNER JOIN (
+            SELECT ts_code, MAX(trade_date) AS max_trade_date
+            FROM {table}
+            {where}
+            GROUP BY ts_code
+        ) t2 ON t1.ts_code = t2.ts_code AND t1.trade_date = t2.max_trade_date
+    """, (since,) if since is not None else ())
+
+
+def refresh_latest_snapshot(conn, table=DAILY_DATA_TABLE, rebuild=False):
+    '''
+    维护快照表，返回本次处理的新行数（0 表示快照已是最新）。
+    全量重建时返回日线表总行数。
+    '''
+    _create_snapshot_tables(conn, table)
+    meta = conn.execute(f"SELECT max_trade_date, row_count FROM {SNAPSHOT_META_TABLE} WHERE table_name = ?",
+                        (table,)).fetchone()
+    db_max, db_count = conn.execute(f"SELECT MAX(trade_date), COUNT(*) FROM {table}").fetchone()
+
+    if meta is not None and not rebuild:
+        last_max, last_count = meta
+        if db_max == last_max and db_count == last_count:
+            return 0
+        new_rows = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE trade_date > ?",
+                                (last_max or '',)).fetchone()[0]
+        if last_max is not None and db_max > last_max and db_count == last_count + new_rows:
+            with conn:
+                _insert_latest_rows(conn, table, since=last_max)
+                conn.execute(f"INSERT OR REPLACE INTO {SNAPSHOT_META_TABLE} VALUES (?, ?, ?)",
+                             (table, db_max, db_count))
+            return new_rows
+        # 历史行被补录或删改，增量无法保证正确，全量重建
+
+    with conn:
+        conn.execute(f"DELETE FROM {SNAPSHOT_TABLE}")
+        _insert_latest_rows(conn, table)
+        conn.execute(f"INSERT OR REPLACE INTO {SNAPSHOT_META_TABLE} VALUES (?, ?, ?)", (table, db_max, db_count))
+    return db_count
+
+
+def load_latest_snapshot(db_file=DB_FILE, table=DAILY_DATA_TABLE, dtype=None, progress=None, cancel=None):
+    '''
+    刷新并读取快照，返回 DataFrame（ts_code, trade_date 及 SNAPSHOT_FIELDS）。
+    数据库只读或被锁定、无法刷新快照时返回 None，调用方应回退为直接查询日线表。
+    dtype / progress / cancel 传给 background_loader.read_sql_chunks，用于分块读取。
+    '''
+    try:
+        with write_connection(db_file) as conn:
+            refresh_latest_snapshot(conn, table)
+        with read_connection(db_file) as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM {SNAPSHOT_TABLE}").fetchone()[0]
+            return read_sql_chunks(conn, f"SELECT ts_code, trade_date, {', '.join(SNAPSHOT_FIELDS)} FROM {SNAPSHOT_TABLE}",
+                                   total=total, dtype=dtype, progress=progress, cancel=cancel)
+    except sqlite3.OperationalError as e:
+        print(f"警告: 无法刷新最新行情快照（{e}），改为直接查询 {table}")
+        sys.stdout.flush()
+        return None
+
+
+if __name__ == '__main__':
+    # 重建快照：python latest_snapshot.py [db_file] [table]
+    db_file = sys.argv[1] if len(sys.argv) > 1 else DB_FILE
+    table = sys.argv[2] if len(sys.argv) > 2 else DAILY_DATA_TABLE
+    with write_connection(db_file) as conn:
+        n = refresh_latest_snapshot(conn, table, rebuild=True)
+    print(f"信息: 最新行情快照已重建，统计 {n} 行")
@@ -0,0 +1,158 @@
+'''
+NumPy 数据源
+
+NumpyData 直接接收预先加载好的列数组（日期、开高低收、成交量），
+日期在加载时一次性向量化转换为 backtrader 的日期序数；
+cerebro 预加载（preload）时把整段数组一次写入各条 line，
+不再逐行调用 datetime.strptime / bt.date2num / float()。
+'''
+import array
+
+import backtrader as bt
+import numpy as np
+
+from bar_store import get_shared_store
+from db_access import fetch_all
+
+# 1970-01-01 的 proleptic 序数，bt.date2num 对零点日期返回的就是该序数
+_EPOCH_ORDINAL = 719163
+
+# line 名 -> bars 字典中可接受的键（按优先级）
+_LINE_SOURCES = {
+    'open': ('open',),
+    'high': ('high',),
+    'low': ('low',),
+    'close': ('close',),
+    'volume': ('volume', 'vol'),
+    'openinterest': ('openinterest',),
+}
+
+BAR_COLUMNS = ('trade_date', 'open', 'high', 'low', 'close', 'vol')
+
+
+def dates_to_num(trade_dates):
+    '''YYYYMMDD（整数或字符串）数组 -> backtrader 日期序数（float64），与 bt.date2num 一致。'''
+    d = np.asarray(trade_dates)
+    if d.dtype.kind in 'USO':
+        d = d.astype('U8').astype(np.int64)
+    else:
+        d = d.astype(np.int64)
+    years = (d // 10000 - 1970).astype('M8[Y]')
+    months = years.astype('M8[M]') + (d // 100 % 100 - 1).astype('m8[M]')
+    days = months.astype('M8[D]') + (d % 100 - 1).astype('m8[D]')
+    return days.astype(np.int64).astype(np.float64) + _EPOCH_ORDINAL
+
+
+def num_to_dates(nums):
+    '''backtrader 日期序数数组 -> YYYYMMDD 整数数组（dates_to_num 的逆运算，忽略时间部分）。'''
+    days = (np.floor(np.asarray(nums, dtype=np.float64)).astype(np.int64) - _EPOCH_ORDINAL).astype('M8[D]')
+    years = days.astype('M8[Y]')
+    months = days.astype('M8[M]')
+    return ((years.astype(np.int64) + 1970) * 10000
+            + (months - years.astype('M8[M]')).astype(np.int64) * 100 + 100
+            + (days - months.astype('M8[D]')).astype(np.int64) + 1)
+
+
+def bars_from_rows(rows, columns=BAR_COLUMNS):
+    '''把 SQLite 查询得到的行元组转为列数组字典，NULL 转为 NaN。'''
+    if not rows:
+        return {name: np.empty(0, dtype=np.int32 if name == 'trade_date' else np.float64)
+                for name in columns}
+    cols = list(zip(*rows))
+    bars = {}
+    for name, col in zip(columns, cols):
+        if name == 'trade_date':
+            bars[name] = np.asarray(col, dtype='U8').astype(np.int32)
+        else:
+            bars[name] = np.array(col, dtype=np.float64)
+    return bars
+
+
+def load_numpy_bars(ts_code, fromdate, todate, db_file, table_name):
+    '''
+    读取一只股票在日期范围内的列数组：优先取列式存储的切片，
+    否则执行一次 SQLite 查询并整体转换。
+    '''
+    store = get_shared_store(db_file)
+    if store is not None and store.meta.get('table') == table_name and ts_code in store:
+        return store.get(ts_code, fromdate, todate, fields=BAR_COLUMNS)
+    rows = fetch_all(db_file, f"""
+        SELECT trade_date, open, high, low, close, vol
+        FROM {table_name}
+        WHERE ts_code = ? AND trade_date BETWEEN ? AND ?
+        ORDER BY trade_date ASC
+    """, (ts_code, fromdate.strftime('%Y%m%d'), todate.strftime('%Y%m%d')))
+    return bars_from_rows(rows)
+
+
+class NumpyData(bt.feeds.DataBase):
+    '''
+    以列数组为输入的数据源。
+
+    参数 bars 为字典：
+      - 'datetime'（backtrader 日期序数）或 'trade_date'（YYYYMMDD）二选一
+      - 'open' / 'high' / 'low' / 'close' / 'volume'（或 'vol'）/ 'openinterest'
+    缺失的列以及 NaN 值原样保留为 NaN。子类新增的 line 从同名键读取。
+    '''
+    params = (
+        ('bars', None),
+        ('openinterest', float('nan')),  # bars 中没有持仓量时的填充值
+    )
+
+    def start(self):
+        super().start()
+        self._columns = self._prepare_columns(self.p.bars or {})
+        self._pos = 0
+
+    def _prepare_columns(self, bars):
+        if 'datetime' in bars:
+            dt = np.asarray(bars['datetime'], dtype=np.float64)
+        elif 'trade_date' in bars:
+            dt = dates_to_num(bars['trade_date'])
+        else:
+            dt = np.empty(0, dtype=np.float64)
+        n = len(dt)
+        columns = {'datetime': dt}
+        for alias in self.getlinealiases():
+            if alias == 'datetime':
+                continue
+            values = None
+            for key in _LINE_SOURCES.get(alias, (alias,)):
+                if key in bars:
+                    values = np.asarray(bars[key], dtype=np.float64)
+                    break
+            if values is None:
+                fill = self.p.openinterest if alias == 'openinterest' else float('nan')
+                values = np.full(n, fill, dtype=np.float64)
+            columns[alias] = values
+        return columns
+
+    def preload(self):
+        # 有过滤器、输入时区或使用环形缓冲（exactbars）时交给逐行加载，保证语义与 DataBase.load 一致
+        if self._filters or self._tzinput or not isinstance(self.lines.datetime.array, array.array):
+            return super().preload()
+
+        dt = self._columns['datetime']
+        lo = int(np.searchsorted(dt, self.fromdate, side='left'))
+        hi = int(np.searchsorted(dt, self.todate, side='right'))
+        n = hi - lo
+        for alias in self.getlinealiases():
+            line = getattr(self.lines, alias)
+            values = np.ascontiguousarray(self._columns[alias][lo:hi], dtype=np.float64)
+            line.array.frombytes(values.tobytes())
+            line.idx += n
+            line.lencount += n
+        self._pos = hi
+
+        self._last()
+        self.home()
+
+    def _load(self):
+        # 非预加载模式（例如 exactbars）下逐根写入，但不再做任何解析
+        if self._pos >= len(self._columns['datetime']):
+            return False
+        i = self._pos
+        self._pos += 1
+        for alias in self.getlinealiases():
+            getattr(self.lines, alias)[0] = float(self._columns[alias][i])
+        return True
@@ -0,0 +1,210 @@
+'''
+参数扫描
+
+对五步法的参数网格（卖出均线、RSI 阈值、均线周期、最大持仓数）以及单股 / 多股两种
+运行方式做批量回测，结果汇总为一张表（夏普比率、最大回撤、年化收益率、交易笔数）。
+
+  - 行情只在主进程加载一次，写成 .npy 后由各子进程以 numpy.memmap 只读共享；
+  - 同一组信号参数只计算一次信号矩阵，不同的 max_positions / 运行方式复用它；
+  - 回测使用 vector_sim.simulate，规则与 MyStrategy 一致。
+
+命令行用法：
+    python param_sweep.py --exit-ma 10 20 --max-positions 1 5 --mode multi single
+    python param_sweep.py --all --rsi-fast-min 60 70 80 --workers 8 --out sweep_results.csv
+'''
+import argparse
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from calendar_panel import load_dense_panel
+from signals import FIVE_STEP_PARAMS, compute_five_step, five_step_params
+from vector_sim import (DAILY_DATA_TABLE, DB_FILE, INITIAL_CASH, MAX_POSITIONS, STOCK_POOL_CSV,
+                        all_codes, last_trade_date, simulate, strategy_minperiod)
+
+SWEEP_RESULTS_CSV = 'sweep_results.csv'
+MODES = ('multi', 'single')
+PANEL_FIELDS = ('open', 'close', 'vol')
+
+# 子进程中共享的行情（memmap）
+_panel = None
+
+
+def expand_grid(grid):
+    '''
+    {参数名: [取值, ...]} -> 参数组合列表。
+    除五步法参数外还支持 max_positions 和 mode（'multi' / 'single'）。
+    '''
+    grid = dict(grid)
+    grid.setdefault('max_positions', [MAX_POSITIONS])
+    grid.setdefault('mode', ['multi'])
+    unknown = set(grid) - set(FIVE_STEP_PARAMS) - {'max_positions', 'mode'}
+    if unknown:
+        raise KeyError(f"未知的扫描参数: {sorted(unknown)}")
+    bad_modes = set(grid['mode']) - set(MODES)
+    if bad_modes:
+        raise ValueError(f"未知的运行方式: {sorted(bad_modes)}")
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def annual_return(dates, equity, start_row=0, initial_cash=INITIAL_CASH):
+    '''从策略开始运行的日期到最后一个交易日按自然日折算的年化收益率。'''
+    if start_row >= len(dates):
+        return 0.0
+    first = datetime.strptime(str(dates[start_row]), '%Y%m%d')
+    last = datetime.strptime(str(dates[-1]), '%Y%m%d')
+    days = (last - first).days
+    if days <= 0:
+        return 0.0
+    return (equity[-1] / initial_cash) ** (365.25 / days) - 1.0
+
+
+def save_panel(panel_dir, dates, codes, panel):
+    '''把对齐后的行情写成 .npy，供子进程 memmap 读取。'''
+    os.makedirs(panel_dir, exist_ok=True)
+    np.save(os.path.join(panel_dir, 'dates.npy'), np.asarray(dates))
+    np.save(os.path.join(panel_dir, 'codes.npy'), np.asarray(codes, dtype=str))
+    for field in PANEL_FIELDS:
+        np.save(os.path.join(panel_dir, f'{field}.npy'), np.ascontiguousarray(panel[field]))
+
+
+def load_panel(panel_dir):
+    panel = {field: np.load(os.path.join(panel_dir, f'{field}.npy'), mmap_mode='r') for field in PANEL_FIELDS}
+    dates = np.load(os.path.join(panel_dir, 'dates.npy'))
+    codes = np.load(os.path.join(panel_dir, 'codes.npy')).tolist()
+    return dates, codes, panel
+
+
+def _init_worker(panel_dir):
+    global _panel
+    _panel = load_panel(panel_dir)
+
+
+def _result_row(combo, ts_code, dates, result, initial_cash):
+    row = dict(combo)
+    row.update({
+        'ts_code': ts_code,
+        'sharpe': result['sharpe']['sharperatio'],
+        'max_drawdown': result['max_drawdown'],
+        'annual_return': annual_return(dates, result['equity'], result['start_row'], initial_cash),
+        'final_value': result['final_value'],
+        'trades': len(result['trades']),
+    })
+    return row
+
+
+def run_signal_group(signal_params, runs, initial_cash=INITIAL_CASH):
+    '''
+    在子进程中运行一组共享信号参数的回测。
+    runs 为 [{'max_positions': ..., 'mode': ...}, ...]，返回结果行列表。
+    '''
+    dates, codes, panel = _panel
+    params = five_step_params(**signal_params)
+    min_bars = strategy_minperiod(params)
+    open_, close = np.asarray(panel['open']), np.asarray(panel['close'])
+    sig = compute_five_step(close, panel['vol'], params)
+
+    rows = []
+    for run in runs:
+        combo = dict(signal_params, **run)
+        if run['mode'] == 'multi':
+            result = simulate(dates, codes, open_, close, sig['entry'], sig['exit'], cash=initial_cash,
+                              max_positions=run['max_positions'], min_bars=min_bars)
+            rows.append(_result_row(combo, '', dates, result, initial_cash))
+            continue
+        # 单股：每只股票单独回测，只使用该股票自己的交易日
+        for j, code in enumerate(codes):
+            own = ~np.isnan(close[:, j])
+            if own.sum() < min_bars:
+                continue
+            result = simulate(dates[own], [code], open_[own, j:j + 1], close[own, j:j + 1],
+                              sig['entry'][own, j:j + 1], sig['exit'][own, j:j + 1], cash=initial_cash,
+                              max_positions=run['max_positions'], min_bars=min_bars)
+            rows.append(_result_row(combo, code, dates[own], result, initial_cash))
+    return rows
+
+
+def run_sweep(codes, fromdate, todate, grid, db_file=DB_FILE, table=DAILY_DATA_TABLE,
+              workers=None, initial_cash=INITIAL_CASH):
+    '''
+    执行参数扫描，返回结果 DataFrame（每个参数组合一行，单股模式下每只股票一行）。
+    '''
+    combos = expand_grid(grid)
+    signal_keys = [k for k in combos[0] if k in FIVE_STEP_PARAMS]
+    groups = {}
+    for combo in combos:
+        key = tuple(combo[k] for k in signal_keys)
+        groups.setdefault(key, []).append({'max_positions': combo['max_positions'], 'mode': combo['mode']})
+
+    # 按所有组合中最长的指标周期加载，保证每只股票在任何参数下都能运行
+    min_bars = max(strategy_minperiod(five_step_params(**{k: combo[k] for k in signal_keys})) for combo in combos)
+    dense, skipped = load_dense_panel(codes, fromdate, todate, db_file=db_file, table=table,
+                                      fields=PANEL_FIELDS, min_bars=min_bars)
+    if skipped:
+        print(f"警告: 跳过 {len(skipped)} 只股票（数据不足或区间不重叠）")
+    if not dense.codes:
+        print("错误: 没有可回测的股票")
+        sys.stdout.flush()
+        return pd.DataFrame()
+    dates, codes, panel = dense.dates, dense.codes, dense.values
+    print(f"信息: {len(codes)} 只股票 x {len(dates)} 个交易日, {len(combos)} 个参数组合, "
+          f"{len(groups)} 组信号参数")
+    sys.stdout.flush()
+
+    panel_dir = tempfile.mkdtemp(prefix='sweep_panel_')
+    rows = []
+    try:
+        save_panel(panel_dir, dates, codes, panel)
+        del panel, dense
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(panel_dir,)) as pool:
+            futures = {pool.submit(run_signal_group, dict(zip(signal_keys, key)), runs, initial_cash): key
+                       for key, runs in groups.items()}
+            for done, future in enumerate(as_completed(futures), 1):
+                rows.extend(future.result())
+                print(f"进度: {done}/{len(futures)} 组完成")
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(panel_dir, ignore_errors=True)
+
+    columns = list(combos[0]) + ['ts_code', 'sharpe', 'max_drawdown', 'annual_return', 'final_value', 'trades']
+    results = pd.DataFrame(rows, columns=columns)
+    return results.sort_values(list(combos[0]) + ['ts_code']).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='五步法参数扫描')
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--table', default=DAILY_DATA_TABLE)
+    parser.add_argument('--all', action='store_true', help='使用数据库中的全部股票')
+    parser.add_argument('--start', default='20220101')
+    parser.add_argument('--end', default=None, help='默认为数据库最后一个交易日')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default=SWEEP_RESULTS_CSV)
+    for key, value in FIVE_STEP_PARAMS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", dest=key, nargs='+', type=type(value))
+    parser.add_argument('--max-positions', dest='max_positions', nargs='+', type=int)
+    parser.add_argument('--mode', nargs='+', choices=MODES)
+    args = parser.parse_args()
+
+    grid = {key: getattr(args, key) for key in list(FIVE_STEP_PARAMS) + ['max_positions', 'mode']
+            if getattr(args, key)}
+    if args.all:
+        codes = all_codes(args.db, args.table)
+    else:
+        codes = pd.read_csv(STOCK_POOL_CSV)['ts_code'].dropna().tolist()
+    fromdate = datetime.strptime(args.start, '%Y%m%d')
+    todate = datetime.strptime(args.end, '%Y%m%d') if args.end else last_trade_date(args.db, args.table)
+
+    results = run_sweep(codes, fromdate, todate, grid, db_file=args.db, table=args.table, workers=args.workers)
+    results.to_csv(args.out, index=False, encoding='utf-8-sig')
+    print(f"信息: 结果已写入 {args.out}（{len(results)} 行）")
+    sys.stdout.flush()
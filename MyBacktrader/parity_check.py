@@ -0,0 +1,374 @@
+'''
+向量化实现与 backtrader 的一致性校验
+
+在合成数据库（含停牌日和晚上市股票）上分别用 backtrader 和向量化模块计算，
+逐项比对，不一致时打印前几处差异并以非零状态退出。
+
+用法：
+    python parity_check.py signals --stocks 40 --start 20190101 --end 20231231
+    python parity_check.py simulator --stocks 40 --start 20210101 --end 20231231
+    python parity_check.py pruning --stocks 200 --start 20190101 --end 20231231
+    python parity_check.py cache --stocks 40 --start 20190101 --end 20231231
+
+simulator 直接运行 chatgpt_stratege.py 中的 MyStrategy（需要在合成数据库所在目录导入该模块），
+比对交易记录、期末资产、最大回撤和夏普比率。
+pruning 比对 MyStrategy 和 grok_strategy.py 中的 MyMultiStockStrategy 在完整股票池和按信号裁剪后的股票池
+（universe_pruning.py）上的同样几项；除整个股票池外，另取一个裁剪后不足 5 只股票的小股票池
+（持仓上限依赖裁剪前的股票数）。
+cache 比对 MyStrategy 不使用和使用指标缓存（indicator_cache.py）的两次回测，回测从数据库起始日
+CACHE_OFFSET_DAYS 天后开始，缓存的 RSI 从更早的 K 线起算，需要按回测起始日重新递推。
+'''
+import argparse
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import backtrader as bt
+import numpy as np
+
+from indicator_cache import CachedIndicator, cache_dir_for, refresh_indicator_cache
+from numpy_feed import NumpyData
+from signals import FIVE_STEP_PARAMS, build_panel, compute_five_step
+from synthetic_data import create_synthetic_db, synthetic_codes
+from universe_loader import load_universe
+from universe_pruning import prune_universe
+from vector_sim import build_report, run_vector_backtest, strategy_minperiod
+
+CONDITIONS = ('cond1', 'cond2', 'cond3', 'cond4', 'cond5', 'entry', 'exit')
+INDICATORS = ('ma_long', 'ma_mid', 'ma_short', 'ma_exit', 'rsi_fast', 'rsi_slow', 'vol_fast', 'vol_slow')
+MAX_REPORT = 10
+VALUE_RTOL = 1e-9  # 指标数值的相对容差；条件矩阵要求完全一致
+CACHE_OFFSET_DAYS = 365
+
+
+class SignalRecorder(bt.Strategy):
+    '''
+    按 MyStrategy 的写法计算指标和条件，记录每只股票每根新 K 线上的取值。
+    RSI 使用 safediv=True：分母不为 0 时与默认参数的结果完全相同，
+    分母为 0 时默认参数会直接抛出除零错误。
+    '''
+    params = (('dates', None), ('five_step', FIVE_STEP_PARAMS))
+
+    def __init__(self):
+        p = self.p.five_step
+        self.inds = {}
+        for data in self.datas:
+            self.inds[data] = {
+                'ma_long': bt.ind.SMA(data.close, period=p['ma_long']),
+                'ma_mid': bt.ind.SMA(data.close, period=p['ma_mid']),
+                'ma_short': bt.ind.SMA(data.close, period=p['ma_short']),
+                'ma_exit': bt.ind.SMA(data.close, period=p['exit_ma']),
+                'rsi_fast': bt.ind.RSI(data.close, period=p['rsi_fast'], safediv=True),
+                'rsi_slow': bt.ind.RSI(data.close, period=p['rsi_slow'], safediv=True),
+                'vol_fast': bt.ind.SMA(data.volume, period=p['vol_fast']),
+                'vol_slow': bt.ind.SMA(data.volume, period=p['vol_slow']),
+            }
+        shape = (len(self.p.dates), len(self.datas))
+        self.values = {name: np.full(shape, np.nan) for name in INDICATORS}
+        self.flags = {name: np.zeros(shape, dtype=bool) for name in CONDITIONS}
+        self.seen = np.zeros(shape, dtype=bool)
+        self.last_len = [0] * len(self.datas)
+
+    def prenext(self):
+        self.next()
+
+    def next(self):
+        p = self.p.five_step
+        for j, data in enumerate(self.datas):
+            if len(data) == self.last_len[j]:
+                continue  # 当日停牌，没有新 K 线
+            self.last_len[j] = len(data)
+            row = int(np.searchsorted(self.p.dates, int(data.datetime.date(0).strftime('%Y%m%d'))))
+            i = self.inds[data]
+            for name in INDICATORS:
+                self.values[name][row, j] = i[name][0]
+            conds = [
+                data.close[0] > i['ma_long'][0],
+                i['ma_long'][0] > i['ma_long'][-1],
+                i['ma_mid'][0] > i['ma_mid'][-1] or i['ma_short'][0] > i['ma_short'][-1],
+                i['rsi_fast'][0] > p['rsi_fast_min'] and i['rsi_slow'][0] > p['rsi_slow_min'],
+                i['vol_fast'][0] > i['vol_slow'][0] and i['vol_fast'][0] > i['vol_fast'][-1]
+                and i['vol_slow'][0] > i['vol_slow'][-1],
+            ]
+            for k, flag in enumerate(conds):
+                self.flags[f'cond{k + 1}'][row, j] = flag
+            self.flags['entry'][row, j] = all(conds)
+            self.flags['exit'][row, j] = data.close[0] < i['ma_exit'][0]
+            self.seen[row, j] = True
+
+
+def _report_mismatch(label, mask, dates, codes):
+    rows, cols = np.nonzero(mask)
+    print(f"  {label}: {len(rows)} 处不一致")
+    for r, c in list(zip(rows, cols))[:MAX_REPORT]:
+        print(f"    {dates[r]} {codes[c]}")
+
+
+def check_signals(db_file, codes, fromdate, todate):
+    # K 线少于最长均线周期的股票在 runonce 模式下会让 backtrader 越界，与原脚本一样先跳过
+    bars_by_code, skipped = load_universe(codes, fromdate, todate, db_file=db_file,
+                                          min_bars=FIVE_STEP_PARAMS['ma_long'])
+    dates, codes, panel = build_panel(bars_by_code)
+    res = compute_five_step(panel['close'], panel['vol'])
+
+    cerebro = bt.Cerebro(stdstats=False)
+    for code in codes:
+        cerebro.adddata(NumpyData(bars=bars_by_code[code]), name=code)
+    cerebro.addstrategy(SignalRecorder, dates=dates)
+    rec = cerebro.run()[0]
+
+    ok = True
+    if not np.array_equal(rec.seen, res['present']):
+        ok = False
+        _report_mismatch('K 线位置', rec.seen != res['present'], dates, codes)
+    for name in CONDITIONS:
+        diff = rec.flags[name] != res[name]
+        if diff.any():
+            ok = False
+            _report_mismatch(name, diff, dates, codes)
+    worst = 0.0
+    for name in INDICATORS:
+        a, b = rec.values[name], res[name]
+        with np.errstate(invalid='ignore'):
+            same = np.isclose(a, b, rtol=VALUE_RTOL, atol=0.0) | (np.isnan(a) & np.isnan(b))
+            if (~np.isnan(a)).any():
+                worst = max(worst, float(np.nanmax(np.abs(a - b) / np.maximum(np.abs(a), 1e-300))))
+        if not same.all():
+            ok = False
+            _report_mismatch(name, ~same, dates, codes)
+    print(f"指标最大相对偏差: {worst:.3e}")
+    print(f"信号校验: {len(codes)} 只股票 x {len(dates)} 个交易日，跳过 {len(skipped)} 只，"
+          f"买入信号 {int(res['entry'].sum())} 个，卖出信号 {int(res['exit'].sum())} 个")
+    print("结果: 一致" if ok else "结果: 不一致")
+    sys.stdout.flush()
+    return ok
+
+
+def run_chatgpt_backtest(workdir, codes, fromdate, todate, pool_size=None):
+    '''按 chatgpt_stratege.run_backtest 的配置运行 MyStrategy（不写文件、不弹窗）。'''
+    cwd = os.getcwd()
+    os.chdir(workdir)  # 策略脚本按相对路径读取 daily_data.db 和指标缓存
+    try:
+        chatgpt = importlib.import_module('chatgpt_stratege')
+        cerebro = bt.Cerebro()
+        cerebro.broker.setcash(300000.0)
+        cerebro.broker.setcommission(commission=0.0003)
+        for code in codes:
+            data = chatgpt.SQLiteData(dataname=code, fromdate=fromdate, todate=todate)
+            cerebro.adddata(data, name=code)
+        cerebro.addstrategy(chatgpt.MyStrategy, pool_size=pool_size)
+        cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
+        cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
+        strat = cerebro.run()[0]
+    finally:
+        os.chdir(cwd)
+    return strat, cerebro.broker.getvalue()
+
+
+def run_grok_backtest(workdir, codes, fromdate, todate, pool_size=None):
+    '''按 grok_strategy.run_backtest 的配置运行 MyMultiStockStrategy（不写文件、不弹窗）。'''
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        grok = importlib.import_module('grok_strategy')
+        cerebro = bt.Cerebro()
+        cerebro.broker.setcash(300000.0)
+        cerebro.broker.setcommission(commission=0.0003)
+        for code in codes:
+            data = grok.SQLiteData(dataname=code, fromdate=fromdate, todate=todate)
+            cerebro.adddata(data, name=code)
+        cerebro.addstrategy(grok.MyMultiStockStrategy, max_positions=min(pool_size or len(codes), 5),
+                            pool_size=pool_size)
+        cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
+        cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
+        strat = cerebro.run()[0]
+    finally:
+        os.chdir(cwd)
+    return strat, cerebro.broker.getvalue()
+
+
+# 裁剪校验的策略：(名称, 运行函数, 交易记录属性)
+PRUNING_STRATEGIES = (
+    ('chatgpt', run_chatgpt_backtest, 'trade_log'),
+    ('grok', run_grok_backtest, 'trade_records'),
+)
+
+
+def _bt_report(strat, final_value, records='trade_log'):
+    return {
+        '期末资产': f"{final_value:.2f} 元",
+        '最大回撤': f"{strat.analyzers.drawdown.get_analysis()['max']['drawdown']:.2f}%",
+        '夏普比率': str(strat.analyzers.sharpe.get_analysis()),
+        '交易笔数': f"{len(getattr(strat, records))}",
+    }
+
+
+def _rsi_zero_division(close, period):
+    '''backtrader 默认 RSI 在前 period 个涨跌幅全部非负时除零（madown 为 0）。'''
+    diffs = np.diff(close[:period + 1])
+    return len(diffs) == period and not (diffs < 0).any()
+
+
+def check_simulator(workdir, db_file, codes, fromdate, todate):
+    # 先排除会让原策略 RSI 除零的股票，两边使用相同的股票池
+    bars_by_code, _ = load_universe(codes, fromdate, todate, db_file=db_file, fields=('close',))
+    excluded = [code for code, bars in bars_by_code.items()
+                if any(_rsi_zero_division(bars['close'], FIVE_STEP_PARAMS[k]) for k in ('rsi_fast', 'rsi_slow'))]
+    codes = [code for code in codes if code not in excluded]
+    result, skipped = run_vector_backtest(codes, fromdate, todate, db_file=db_file)
+    codes = result['codes']
+    strat, final_value = run_chatgpt_backtest(workdir, codes, fromdate, todate)
+
+    ok = True
+    bt_trades, sim_trades = strat.trade_log, result['trades']
+    if bt_trades != sim_trades:
+        ok = False
+        n = next((i for i, (a, b) in enumerate(zip(bt_trades, sim_trades)) if a != b),
+                 min(len(bt_trades), len(sim_trades)))
+        print(f"  交易记录不一致: backtrader {len(bt_trades)} 笔, 向量化 {len(sim_trades)} 笔, 第 {n + 1} 笔起不同")
+        for row in (bt_trades[n:n + 1] + sim_trades[n:n + 1]):
+            print(f"    {row}")
+    bt_report = _bt_report(strat, final_value)
+    sim_report = build_report(result)
+    for key, value in bt_report.items():
+        if sim_report[key] != value:
+            ok = False
+            print(f"  {key}: backtrader {value} / 向量化 {sim_report[key]}")
+    if final_value != result['final_value']:
+        ok = False
+        print(f"  期末资产相差 {result['final_value'] - final_value:.3e}")
+    print(f"组合校验: {len(codes)} 只股票，跳过 {len(skipped) + len(excluded)} 只，交易 {len(sim_trades)} 笔，"
+          f"期末资产 {result['final_value']:.2f}，跳过末根 K 线信号 {result['skipped_signals']} 个")
+    print("结果: 一致" if ok else "结果: 不一致")
+    sys.stdout.flush()
+    return ok
+
+
+def check_pruning(workdir, db_file, codes, fromdate, todate):
+    # 与 batch_runner 相同：K 线不足最小周期的股票先跳过；排除会让 RSI 除零的股票
+    bars_by_code, skipped = load_universe(codes, fromdate, todate, db_file=db_file, min_bars=strategy_minperiod())
+    excluded = [code for code, bars in bars_by_code.items()
+                if any(_rsi_zero_division(bars['close'], FIVE_STEP_PARAMS[k]) for k in ('rsi_fast', 'rsi_slow'))]
+    codes = [code for code in codes if code in bars_by_code and code not in excluded]
+    kept, clock = prune_universe(codes, bars_by_code)
+    print(f"信息: {len(codes)} 只股票（跳过 {len(skipped) + len(excluded)} 只）")
+
+    # 小股票池：时钟数据源（开始日期不变）、两只有买入信号的股票和五只没有的，
+    # 裁剪后不足 5 只，持仓上限取决于裁剪前的股票数
+    signaled = [code for code in kept if code != clock][:2]
+    quiet = [code for code in codes if code not in kept][:5]
+    small = [code for code in codes if code == clock or code in signaled or code in quiet]
+
+    ok = True
+    for label, pool in (('完整股票池', codes), ('小股票池', small)):
+        pool_kept, pool_clock = prune_universe(pool, bars_by_code)
+        print(f"{label}: 数据源 {len(pool)} -> {len(pool_kept)}，时钟数据源 {pool_clock}")
+        for name, run, records in PRUNING_STRATEGIES:
+            ok = _check_pruned_run(workdir, name, run, records, pool, pool_kept, fromdate, todate) and ok
+    print("结果: 一致" if ok else "结果: 不一致")
+    sys.stdout.flush()
+    return ok
+
+
+def _check_pruned_run(workdir, name, run, records, codes, kept, fromdate, todate):
+    '''用 run 在完整股票池 codes 和裁剪后的 kept 上各回测一次，比对交易记录和报告。'''
+    full, full_value = run(workdir, codes, fromdate, todate)
+    pruned, pruned_value = run(workdir, kept, fromdate, todate, pool_size=len(codes))
+    full_records, pruned_records = getattr(full, records), getattr(pruned, records)
+
+    ok = True
+    if full_records != pruned_records:
+        ok = False
+        n = next((i for i, (a, b) in enumerate(zip(full_records, pruned_records)) if a != b),
+                 min(len(full_records), len(pruned_records)))
+        print(f"  {name} 交易记录不一致: 完整 {len(full_records)} 笔, 裁剪 {len(pruned_records)} 笔, 第 {n + 1} 笔起不同")
+    full_report, pruned_report = _bt_report(full, full_value, records), _bt_report(pruned, pruned_value, records)
+    for key, value in full_report.items():
+        if pruned_report[key] != value:
+            ok = False
+            print(f"  {name} {key}: 完整 {value} / 裁剪 {pruned_report[key]}")
+    print(f"  {name}: 交易记录 {len(full_records)} 条，期末资产 {full_value:.2f}，{'一致' if ok else '不一致'}")
+    sys.stdout.flush()
+    return ok
+
+
+def check_cache(workdir, db_file, codes, fromdate, todate):
+    fromdate = fromdate + timedelta(days=CACHE_OFFSET_DAYS)
+    bars_by_code, skipped = load_universe(codes, fromdate, todate, db_file=db_file, min_bars=strategy_minperiod())
+    excluded = [code for code, bars in bars_by_code.items()
+                if any(_rsi_zero_division(bars['close'], FIVE_STEP_PARAMS[k]) for k in ('rsi_fast', 'rsi_slow'))]
+    codes = [code for code in codes if code in bars_by_code and code not in excluded]
+
+    plain, plain_value = run_chatgpt_backtest(workdir, codes, fromdate, todate)
+    stats = refresh_indicator_cache(codes, db_file)
+    try:
+        cached, cached_value = run_chatgpt_backtest(workdir, codes, fromdate, todate)
+    finally:
+        shutil.rmtree(cache_dir_for(db_file), ignore_errors=True)  # 其余校验不使用缓存
+    served = sum(isinstance(ind, CachedIndicator) for inds in cached.inds.values() for ind in inds.values())
+
+    ok = served > 0
+    if not ok:
+        print("  回测没有使用指标缓存")
+    # 交易只在阈值附近才会受影响，另外逐个比对指标序列（要求逐位相同）
+    differ = []
+    for plain_data, cached_data in zip(plain.datas, cached.datas):
+        for name, ind in plain.inds[plain_data].items():
+            a = np.frombuffer(ind.lines[0].array, dtype=np.float64)
+            b = np.frombuffer(cached.inds[cached_data][name].lines[0].array, dtype=np.float64)
+            if not np.array_equal(a, b, equal_nan=True):
+                differ.append((plain_data._name, name))
+    if differ:
+        ok = False
+        print(f"  指标序列不一致 {len(differ)} 个: {differ[:MAX_REPORT]}")
+    if plain.trade_log != cached.trade_log:
+        ok = False
+        n = next((i for i, (a, b) in enumerate(zip(plain.trade_log, cached.trade_log)) if a != b),
+                 min(len(plain.trade_log), len(cached.trade_log)))
+        print(f"  交易记录不一致: 无缓存 {len(plain.trade_log)} 笔, 有缓存 {len(cached.trade_log)} 笔, 第 {n + 1} 笔起不同")
+        for row in (plain.trade_log[n:n + 1] + cached.trade_log[n:n + 1]):
+            print(f"    {row}")
+    plain_report, cached_report = _bt_report(plain, plain_value), _bt_report(cached, cached_value)
+    for key, value in plain_report.items():
+        if cached_report[key] != value:
+            ok = False
+            print(f"  {key}: 无缓存 {value} / 有缓存 {cached_report[key]}")
+    print(f"缓存校验: {len(codes)} 只股票（跳过 {len(skipped) + len(excluded)} 只），回测起始日 {fromdate.date()}，"
+          f"缓存重算 {stats['full']} 只，读取缓存的指标 {served} 个，交易 {len(plain.trade_log)} 笔，"
+          f"期末资产 {plain_value:.2f}")
+    print("结果: 一致" if ok else "结果: 不一致")
+    sys.stdout.flush()
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='向量化实现与 backtrader 的一致性校验')
+    parser.add_argument('check', choices=['signals', 'simulator', 'pruning', 'cache'])
+    parser.add_argument('--stocks', type=int, default=40)
+    parser.add_argument('--start', default='20190101')
+    parser.add_argument('--end', default='20231231')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='parity_')
+    try:
+        db_file = os.path.join(workdir, 'daily_data.db')
+        create_synthetic_db(db_file, args.stocks, args.start, args.end, seed=args.seed,
+                            suspend_prob=0.02, late_listing_prob=0.2)
+        fromdate = datetime.strptime(args.start, '%Y%m%d')
+        todate = datetime.strptime(args.end, '%Y%m%d')
+        codes = synthetic_codes(args.stocks)
+        if args.check == 'signals':
+            ok = check_signals(db_file, codes, fromdate, todate)
+        elif args.check == 'simulator':
+            ok = check_simulator(workdir, db_file, codes, fromdate, todate)
+        elif args.check == 'pruning':
+            ok = check_pruning(workdir, db_file, codes, fromdate, todate)
+        else:
+            ok = check_cache(workdir, db_file, codes, fromdate, todate)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0 if ok else 1)
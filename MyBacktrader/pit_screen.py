@@ -0,0 +1,294 @@
+'''
+历史时点选股（point-in-time）
+
+选股工具只能按每只股票最新一天的估值筛选。本模块把 daily_data 中的 close / pe_ttm / pb /
+total_mv 按交易日展开成 (交易日 x 股票) 的数组，保存在数据库同目录下的 fundamentals_index/：
+    meta.json          元信息：表名、数据库指纹（行数、最大交易日）
+    dates.npy          全部交易日（YYYYMMDD 整数，升序）
+    codes.npy          全部股票代码
+    last_row.npy       last_row[d, i] 为股票 i 在第 d 个交易日及之前最后一根 K 线所在的交易日行号，没有为 -1
+    <field>.npy        各字段在有 K 线的交易日上的数值，其余为 NaN
+读取时用 mmap 打开，任一日期的全市场估值就是一行数组。
+
+在日期 D 上的取值只使用 D 及之前的数据（无未来函数）：股票在 D 当天停牌时沿用最近一根 K 线，
+但最多回看 MAX_STALE_DAYS 个交易日，更早退市或长期停牌的股票不会出现在股票池中。
+筛选条件与 StockFilterApp 相同：值非空且在 [lo, hi] 内（总市值以亿元计），选了行业时只保留这些行业。
+注意行业和名称来自当前的股票基础资讯 CSV，并非历史时点的数据。
+
+命令行用法：
+    python pit_screen.py --basic stock_basic.csv --date 20230601 --pe 0.1 30 --mv 50 1000
+    python pit_screen.py --basic stock_basic.csv --start 20220101 --end 20231231 --step 20 --out-dir pit_pools
+每个日期输出一个 stock_pool_<日期>.csv，格式与选股工具导出的股票池相同，可直接交给 batch_runner.py。
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+from background_loader import check_cancel
+from bar_store import date_to_int
+from db_access import read_connection
+
+# --- 配置参数 ---
+DB_FILE = 'daily_data.db'
+DAILY_DATA_TABLE = 'daily_data'
+FUNDAMENTALS_DIRNAME = 'fundamentals_index'
+INDEX_VERSION = 1
+FIELDS = ('close', 'pe_ttm', 'pb', 'total_mv')
+FETCH_CHUNK = 200000   # 每次从 SQLite 取出的行数
+MAX_STALE_DAYS = 10    # 停牌时最多沿用多少个交易日之前的数据
+DATE_BLOCK = 250       # 批量筛选时每次展开的交易日数
+PIT_OUT_DIR = 'pit_pools'
+
+META_FILE = 'meta.json'
+
+
+def fundamentals_dir_for(db_file):
+    '''默认的索引目录：与数据库文件放在同一目录下。'''
+    return os.path.join(os.path.dirname(os.path.abspath(db_file)), FUNDAMENTALS_DIRNAME)
+
+
+def _db_fingerprint(conn, table):
+    count, max_date = conn.execute(f"SELECT COUNT(*), MAX(trade_date) FROM {table}").fetchone()
+    return int(count or 0), (int(max_date) if max_date else 0)
+
+
+def build_fundamentals_index(db_file=DB_FILE, index_dir=None, table=DAILY_DATA_TABLE, progress=None, cancel=None):
+    '''
+    从日线表全量生成按交易日展开的估值数组，返回 (交易日数, 股票数)。
+    先取出全部交易日和股票代码，再每次 FETCH_CHUNK 行读取日线，逐块填入磁盘上的数组（open_memmap），
+    内存中只有一块行数据和 present 掩码。
+    progress(done, total) 在每块之后调用；cancel 被设置时抛出 LoadCancelled，不留下半成品。
+    '''
+    index_dir = index_dir or fundamentals_dir_for(db_file)
+    tmp_dir = index_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    try:
+        with read_connection(db_file) as conn:
+            conn.execute("BEGIN")  # 全部查询在同一个读事务中，构建期间的写入不会混入
+            fingerprint = _db_fingerprint(conn, table)
+            codes = np.unique(np.asarray([str(r[0]) for r in conn.execute(f"SELECT DISTINCT ts_code FROM {table}")],
+                                         dtype=str))
+            dates = np.unique(np.asarray([int(r[0]) for r in conn.execute(f"SELECT DISTINCT trade_date FROM {table}")],
+                                         dtype=np.int32))
+            present = np.zeros((len(dates), len(codes)), dtype=bool)
+            values = {}
+            for name in FIELDS:
+                values[name] = np.lib.format.open_memmap(os.path.join(tmp_dir, f'{name}.npy'), mode='w+',
+                                                         dtype=np.float64, shape=(len(dates), len(codes)))
+                values[name][:] = np.nan
+            cursor = conn.execute(f"SELECT ts_code, trade_date, {', '.join(FIELDS)} FROM {table}")
+            done = 0
+            while True:
+                rows = cursor.fetchmany(FETCH_CHUNK)
+                if not rows:
+                    break
+                cols = list(zip(*rows))
+                code_idx = np.searchsorted(codes, np.asarray(cols[0], dtype=str))
+                date_idx = np.searchsorted(dates, np.asarray(cols[1], dtype=str).astype(np.int32))
+                present[date_idx, code_idx] = True
+                for name, col in zip(FIELDS, cols[2:]):
+                    values[name][date_idx, code_idx] = pd.to_numeric(pd.Series(col), errors='coerce').to_numpy(
+                        dtype=np.float64)
+                done += len(rows)
+                if progress:
+                    progress(done, fingerprint[0])
+                check_cancel(cancel)
+            cursor.close()
+        for array in values.values():
+            array.flush()
+        del values
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    # 每个交易日及之前最后一根 K 线的行号（向前填充）
+    last_row = np.where(present, np.arange(len(dates), dtype=np.int32)[:, None], -1)
+    np.maximum.accumulate(last_row, axis=0, out=last_row)
+    np.save(os.path.join(tmp_dir, 'dates.npy'), dates)
+    np.save(os.path.join(tmp_dir, 'codes.npy'), codes)
+    np.save(os.path.join(tmp_dir, 'last_row.npy'), last_row.astype(np.int32))
+    meta = {'version': INDEX_VERSION, 'table': table, 'rows': fingerprint[0], 'max_trade_date': fingerprint[1]}
+    with open(os.path.join(tmp_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    if os.path.exists(index_dir):
+        shutil.rmtree(index_dir)
+    os.replace(tmp_dir, index_dir)
+    print(f"信息: 历史估值索引已写入 {index_dir}，共 {len(dates)} 个交易日、{len(codes)} 只股票")
+    sys.stdout.flush()
+    return len(dates), len(codes)
+
+
+class FundamentalsIndex:
+    '''只读的按交易日展开的估值数组（mmap）。'''
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, META_FILE), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"历史估值索引版本不匹配: {self.meta.get('version')}")
+        self.dates = np.load(os.path.join(index_dir, 'dates.npy'))
+        self.codes = np.load(os.path.join(index_dir, 'codes.npy'))
+        self.last_row = np.load(os.path.join(index_dir, 'last_row.npy'), mmap_mode='r')
+        self.values = {name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r') for name in FIELDS}
+
+    def date_row(self, date):
+        '''date 当天或之前最近一个交易日的行号；早于第一个交易日时返回 None。'''
+        row = int(np.searchsorted(self.dates, date_to_int(date), side='right')) - 1
+        return row if row >= 0 else None
+
+    def trading_dates(self, start=None, end=None, step=1):
+        '''[start, end] 内的交易日（每 step 个取一个）。'''
+        lo = 0 if start is None else int(np.searchsorted(self.dates, date_to_int(start), side='left'))
+        hi = len(self.dates) if end is None else int(np.searchsorted(self.dates, date_to_int(end), side='right'))
+        return self.dates[lo:hi:step]
+
+    def block(self, rows, max_stale=MAX_STALE_DAYS, columns=None):
+        '''
+        rows 个交易日上的取值：返回 (available, trade_date, {字段: 数组})，
+        数组形状均为 (len(rows), 股票数)；available 为该日可用（未超过 max_stale）的股票。
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.arange(len(self.codes)) if columns is None else np.asarray(columns)
+        last = np.asarray(self.last_row[rows][:, cols])
+        available = (last >= 0) & (rows[:, None] - last <= max_stale)
+        safe = np.where(available, last, 0)
+        values = {}
+        for name in FIELDS:
+            v = np.asarray(self.values[name])[safe, cols]
+            values[name] = np.where(available, v, np.nan)
+        trade_date = np.where(available, self.dates[safe], 0)
+        return available, trade_date, values
+
+    def snapshot(self, date, max_stale=MAX_STALE_DAYS):
+        '''date 时点上每只股票最近一根 K 线的估值，列与 latest_snapshot 相同（无开高低量）。'''
+        row = self.date_row(date)
+        if row is None:
+            return pd.DataFrame(columns=['ts_code', 'trade_date', *FIELDS])
+        available, trade_date, values = self.block([row], max_stale)
+        keep = available[0]
+        df = pd.DataFrame({'ts_code': self.codes[keep], 'trade_date': trade_date[0][keep].astype(str)})
+        for name in FIELDS:
+            df[name] = values[name][0][keep]
+        return df
+
+
+def open_fundamentals_index(db_file=DB_FILE, index_dir=None, table=DAILY_DATA_TABLE, rebuild=False,
+                            progress=None, cancel=None):
+    '''
+    打开索引；不存在、表名不同或数据库行数 / 最大交易日已变化时先重新生成
+    （progress / cancel 传给 build_fundamentals_index）。
+    '''
+    index_dir = index_dir or fundamentals_dir_for(db_file)
+    meta = None
+    if not rebuild and os.path.exists(os.path.join(index_dir, META_FILE)):
+        with open(os.path.join(index_dir, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    with read_connection(db_file) as conn:
+        rows, max_date = _db_fingerprint(conn, table)
+    if (meta is None or meta.get('version') != INDEX_VERSION or meta.get('table') != table
+            or meta.get('rows') != rows or meta.get('max_trade_date') != max_date):
+        build_fundamentals_index(db_file, index_dir, table, progress=progress, cancel=cancel)
+    return FundamentalsIndex(index_dir)
+
+
+def range_mask(values, ranges):
+    '''与 StockFilterApp 相同的区间条件：值非空且 lo <= 值 <= hi。ranges 的键可用 total_mv_billion（亿元）。'''
+    mask = None
+    for col, (lo, hi) in ranges.items():
+        v = values['total_mv'] / 10000.0 if col == 'total_mv_billion' else values[col]
+        with np.errstate(invalid='ignore'):
+            m = ~np.isnan(v) & (v >= lo) & (v <= hi)
+        mask = m if mask is None else mask & m
+    return mask
+
+
+def screen_dates(index, dates, ranges, industries=None, basic=None, max_stale=MAX_STALE_DAYS):
+    '''
+    在每个日期上按 ranges / industries 筛选，返回 {交易日: 股票池 DataFrame}。
+    basic 为股票基础资讯（至少有 ts_code，行业筛选需要 industry 列），只保留其中的股票并合并其列，
+    与选股工具载入数据时的 inner join 一致；非交易日按之前最近一个交易日筛选。
+    '''
+    columns = None
+    if basic is not None:
+        basic = basic.copy()
+        basic['ts_code'] = basic['ts_code'].astype(str)
+        in_basic = np.isin(index.codes, basic['ts_code'].to_numpy())
+        if industries:
+            allowed = basic.loc[basic['industry'].isin(list(industries)), 'ts_code'].to_numpy()
+            in_basic &= np.isin(index.codes, allowed)
+        columns = np.flatnonzero(in_basic)
+    elif industries:
+        raise ValueError("按行业筛选需要提供股票基础资讯 (basic)")
+    codes = index.codes if columns is None else index.codes[columns]
+
+    requested = [(date_to_int(d), index.date_row(d)) for d in dates]
+    pools = {}
+    for start in range(0, len(requested), DATE_BLOCK):
+        chunk = [(d, row) for d, row in requested[start:start + DATE_BLOCK] if row is not None]
+        if not chunk:
+            continue
+        available, trade_date, values = index.block([row for _, row in chunk], max_stale, columns)
+        mask = available & range_mask(values, ranges)
+        for k, (date, _) in enumerate(chunk):
+            keep = mask[k]
+            df = pd.DataFrame({'ts_code': codes[keep], 'trade_date': trade_date[k][keep].astype(str)})
+            for name in FIELDS:
+                df[name] = values[name][k][keep]
+            if basic is not None:
+                df = pd.merge(df, basic, on='ts_code', how='inner')
+            df['total_mv_billion'] = df['total_mv'] / 10000.0
+            pools[date] = df
+    return pools
+
+
+def write_pools(pools, out_dir=PIT_OUT_DIR):
+    '''每个日期写一个 stock_pool_<日期>.csv，返回文件路径列表。'''
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for date, df in pools.items():
+        path = os.path.join(out_dir, f"stock_pool_{date}.csv")
+        df.to_csv(path, index=False, encoding='utf-8-sig')
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='历史时点选股：按某一天（或一段时间内每个交易日）的估值生成股票池')
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--table', default=DAILY_DATA_TABLE)
+    parser.add_argument('--basic', default=None, help='股票基础资讯 CSV（含 ts_code、name、industry）')
+    parser.add_argument('--date', nargs='+', default=None, help='一个或多个筛选日期 YYYYMMDD')
+    parser.add_argument('--start', default=None, help='批量模式：起始日期')
+    parser.add_argument('--end', default=None, help='批量模式：结束日期，默认为最后一个交易日')
+    parser.add_argument('--step', type=int, default=1, help='批量模式：每隔多少个交易日筛选一次')
+    parser.add_argument('--pe', nargs=2, type=float, default=(0.1, 1000.0), metavar=('MIN', 'MAX'))
+    parser.add_argument('--pb', nargs=2, type=float, default=(0.1, 100.0), metavar=('MIN', 'MAX'))
+    parser.add_argument('--mv', nargs=2, type=float, default=(1.0, 10000.0), metavar=('MIN', 'MAX'),
+                        help='总市值范围（亿元）')
+    parser.add_argument('--industry', nargs='+', default=None)
+    parser.add_argument('--max-stale', type=int, default=MAX_STALE_DAYS)
+    parser.add_argument('--out-dir', default=PIT_OUT_DIR)
+    parser.add_argument('--rebuild', action='store_true', help='强制重新生成历史估值索引')
+    args = parser.parse_args()
+
+    if not args.date and not args.start:
+        parser.error('需要 --date 或 --start')
+    index = open_fundamentals_index(args.db, table=args.table, rebuild=args.rebuild)
+    dates = args.date or index.trading_dates(args.start, args.end, args.step).tolist()
+    basic = pd.read_csv(args.basic) if args.basic else None
+    ranges = {'pe_ttm': tuple(args.pe), 'pb': tuple(args.pb), 'total_mv_billion': tuple(args.mv)}
+
+    pools = screen_dates(index, dates, ranges, args.industry, basic, args.max_stale)
+    paths = write_pools(pools, args.out_dir)
+    for date, df in pools.items():
+        print(f"信息: {date} 筛选出 {len(df)} 只股票")
+    print(f"信息: 共写出 {len(paths)} 个股票池到 {args.out_dir}")
+    sys.stdout.flush()
@@ -0,0 +1,148 @@
+'''
+流式写出的回测记录
+
+策略和分析器原来把交易记录、日志、每日资产都累积在字典列表里，回测结束后才转成 DataFrame 写文件：
+长时间、多股票的回测内存随记录数一直增长，中途出错时已有的记录全部丢失。
+这里的写出器在回测过程中分批追加写出：
+  - 记录按列顺序存为元组（比每条一个字典小得多），缓冲区达到 BATCH_ROWS 条
+    或距上次写出超过 FLUSH_SECONDS 秒时写出一批，写出后立即 flush，进程中断时已写出的记录都在文件里；
+  - CsvRecordWriter 写 CSV（与原来 DataFrame.to_csv 的列和格式相同，缺失的列为空）；
+  - TextLineWriter 每条记录一行（日志）；
+  - SqliteRecordWriter 写入结果数据库的表，每次回测一个 run_id，多次回测可以写入同一张表。
+不提供 Parquet：环境中不一定有 pyarrow（与 screener_cache 相同的考虑）。
+
+写出器实现了 append() 和 len()，可以直接替代策略中原来的列表（self.trade_log.append(...)、len(...)）。
+'''
+import csv
+import math
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+from db_access import write_connection
+
+# --- 配置参数 ---
+BATCH_ROWS = 1000
+FLUSH_SECONDS = 5.0
+
+
+def _plain(value):
+    '''NumPy 标量转为 Python 类型；NaN 与 DataFrame.to_csv 一样写为空。'''
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class RecordWriter:
+    '''按列顺序缓冲记录并分批写出的基类，子类实现 _write(rows)。'''
+
+    def __init__(self, columns, batch_rows=BATCH_ROWS, flush_seconds=FLUSH_SECONDS):
+        self.columns = tuple(columns)
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.count = 0
+        self.last_flush = time.monotonic()
+        self.closed = False
+
+    def append(self, record):
+        '''record 为字典（按列名取值，缺失为空）或与 columns 顺序相同的序列。'''
+        if isinstance(record, dict):
+            row = tuple(_plain(record.get(c)) for c in self.columns)
+        else:
+            row = tuple(_plain(v) for v in record)
+        self.buffer.append(row)
+        self.count += 1
+        if len(self.buffer) >= self.batch_rows or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def __len__(self):
+        return self.count
+
+    def flush(self):
+        if self.buffer:
+            self._write(self.buffer)
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self._close()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, rows):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class CsvRecordWriter(RecordWriter):
+    def __init__(self, path, columns, encoding='utf-8', **kwargs):
+        super().__init__(columns, **kwargs)
+        self.path = path
+        self.file = open(path, 'w', newline='', encoding=encoding)
+        self.writer = csv.writer(self.file, lineterminator='\n')  # 与 DataFrame.to_csv 相同
+        self.writer.writerow(self.columns)
+        self.file.flush()
+
+    def _write(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def _close(self):
+        self.file.close()
+
+
+class TextLineWriter(RecordWriter):
+    '''每条记录一行文本（策略日志）。'''
+
+    def __init__(self, path, encoding='utf-8', **kwargs):
+        super().__init__(('line',), **kwargs)
+        self.path = path
+        self.file = open(path, 'w', encoding=encoding)
+
+    def append(self, record):
+        super().append((str(record),))
+
+    def _write(self, rows):
+        self.file.write(''.join(row[0] + '\n' for row in rows))
+        self.file.flush()
+
+    def _close(self):
+        self.file.close()
+
+
+class SqliteRecordWriter(RecordWriter):
+    '''
+    写入 db_file 中的 table（不存在时创建，列不声明类型），另加 run_id 列区分各次回测。
+    日期写为 ISO 字符串。通过 db_access 的写连接写入，每批一个事务。
+    '''
+
+    def __init__(self, db_file, table, columns, run_id=None, **kwargs):
+        super().__init__(columns, **kwargs)
+        self.db_file = db_file
+        self.table = table
+        self.run_id = run_id or datetime.now().strftime('%Y%m%d_%H%M%S')
+        names = ', '.join(f'"{c}"' for c in ('run_id',) + self.columns)
+        self.insert_sql = f'INSERT INTO "{table}" ({names}) VALUES ({", ".join("?" * (len(self.columns) + 1))})'
+        with write_connection(db_file) as conn:
+            with conn:
+                conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({names})')
+
+    def _write(self, rows):
+        rows = [(self.run_id,) + tuple(v.isoformat() if isinstance(v, (date, datetime)) else v for v in row)
+                for row in rows]
+        with write_connection(self.db_file) as conn:
+            with conn:
+                conn.executemany(self.insert_sql, rows)
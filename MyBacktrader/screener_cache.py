@@ -0,0 +1,102 @@
+'''
+选股数据缓存
+
+StockFilterApp 载入的合并数据（行情快照 + 股票基础资讯 + 总市值换算）按列保存为
+NumPy 数组的 pickle，放在数据库同目录下的 screener_cache/。缓存键为：
+  - 数据库文件（及 WAL 文件）的大小、修改时间和日线表的 MAX(trade_date)
+  - 日线表名、历史日期（最新数据为 latest）
+  - 股票基础资讯 CSV 的 SHA1
+键一致时直接读取（5000 行约几毫秒）；任何一项变化即视为过期，由调用方重新载入后写回。
+按列保存（category 列保存编码和类别）而不是直接 pickle DataFrame，
+升级 pandas 后缓存仍可读取；读取失败时同样视为过期。
+'''
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from db_access import file_signature, max_trade_date
+
+# --- 配置参数 ---
+SCREENER_CACHE_DIRNAME = 'screener_cache'
+CACHE_VERSION = 1
+HASH_CHUNK = 1 << 20  # 计算 CSV 哈希时每次读取的字节数
+
+
+def screener_cache_dir_for(db_file):
+    return os.path.join(os.path.dirname(os.path.abspath(db_file)), SCREENER_CACHE_DIRNAME)
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(db_file, table, basic_csv, as_of_date=None):
+    '''缓存键（字典），任何一项与缓存中的不同即视为过期。'''
+    key = file_signature(db_file)
+    key.update({
+        'max_trade_date': str(max_trade_date(db_file, table)),
+        'table': table,
+        'as_of_date': str(as_of_date or 'latest'),
+        'basic_sha1': file_sha1(basic_csv),
+    })
+    return key
+
+
+def _cache_file(db_file, key):
+    return os.path.join(screener_cache_dir_for(db_file), f"{key['table']}_{key['as_of_date']}.pkl")
+
+
+def _frame_to_columns(df):
+    columns = []
+    for name in df.columns:
+        s = df[name]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            columns.append((name, 'category', (s.cat.codes.to_numpy(), np.asarray(s.cat.categories, dtype=object))))
+        elif pd.api.types.is_numeric_dtype(s.dtype) or pd.api.types.is_bool_dtype(s.dtype):
+            columns.append((name, 'numeric', s.to_numpy()))
+        else:
+            columns.append((name, 'object', s.to_numpy(dtype=object)))
+    return columns
+
+
+def _columns_to_frame(columns):
+    data = {}
+    for name, kind, values in columns:
+        if kind == 'category':
+            codes, categories = values
+            data[name] = pd.Categorical.from_codes(codes, categories=list(categories))
+        else:
+            data[name] = values
+    return pd.DataFrame(data)
+
+
+def load_cached_frame(db_file, key):
+    '''键一致时返回缓存的 DataFrame，否则（不存在、过期、损坏）返回 None。'''
+    path = _cache_file(db_file, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            payload = pickle.load(f)
+        if payload.get('version') != CACHE_VERSION or payload.get('key') != key:
+            return None
+        return _columns_to_frame(payload['columns'])
+    except Exception:
+        return None
+
+
+def save_cached_frame(db_file, key, df):
+    path = _cache_file(db_file, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump({'version': CACHE_VERSION, 'key': key, 'columns': _frame_to_columns(df)}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
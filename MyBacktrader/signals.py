@@ -0,0 +1,252 @@
+'''
+五步法信号引擎（向量化）
+
+在 (日期 x 股票) 的二维数组上一次性计算五步法的全部条件：
+  - cond1: 收盘价高于 240 日均线
+  - cond2: 240 日均线向上
+  - cond3: 60 日或 20 日均线至少一条向上
+  - cond4: RSI6 > 70 且 RSI13 > 50
+  - cond5: 3 日成交量均线大于 8 日均线，且两者均向上
+  - 卖出: 收盘价跌破 exit_ma 日均线（默认 20）
+
+与 backtrader 逐 bar 一致的要点：
+  - 每只股票按自己的 K 线序列计算指标（停牌日不计入），与 len(data) 的含义相同；
+  - SMA 的“向上”用 x[t] > x[t-period] 判断，与 fsum 计算的均线比较结果完全等价；
+  - 收盘价与均线、两条量均线的比较在临界位置用 math.fsum 精确重算均线，
+    因此所有条件矩阵与 backtrader 逐 bar 完全相同，均线数值本身的差异在 1e-12 量级；
+  - RSI 按 backtrader 的 UpDay/DownDay + 平滑均线（首值为简单平均）逐步递推，
+    运算顺序与 backtrader 相同，数值逐位一致。
+二维数组中 NaN 表示该股票当日无 K 线。
+'''
+import math
+
+import numpy as np
+
+FIVE_STEP_PARAMS = {
+    'ma_long': 240,
+    'ma_mid': 60,
+    'ma_short': 20,
+    'rsi_fast': 6,
+    'rsi_slow': 13,
+    'rsi_fast_min': 70.0,
+    'rsi_slow_min': 50.0,
+    'vol_fast': 3,
+    'vol_slow': 8,
+    'exit_ma': 20,
+}
+
+
+def five_step_params(**overrides):
+    '''默认参数加上覆盖项，未知参数名直接报错。'''
+    unknown = set(overrides) - set(FIVE_STEP_PARAMS)
+    if unknown:
+        raise KeyError(f"未知的五步法参数: {sorted(unknown)}")
+    params = dict(FIVE_STEP_PARAMS)
+    params.update(overrides)
+    return params
+
+
+def build_panel(bars_by_code, fields=('open', 'close', 'vol')):
+    '''
+    把 {ts_code: 列数组字典} 对齐到所有股票交易日的并集上。
+    返回 (dates, codes, panel)，panel 为字段 -> (日期 x 股票) 数组，缺失处为 NaN。
+    '''
+    codes = list(bars_by_code)
+    if not codes:
+        return np.empty(0, dtype=np.int32), codes, {f: np.empty((0, 0)) for f in fields}
+    dates = np.unique(np.concatenate([np.asarray(bars_by_code[c]['trade_date']) for c in codes]))
+    panel = {f: np.full((len(dates), len(codes)), np.nan) for f in fields}
+    for j, code in enumerate(codes):
+        bars = bars_by_code[code]
+        rows = np.searchsorted(dates, bars['trade_date'])
+        for f in fields:
+            panel[f][rows, j] = bars[f]
+    return dates, codes, panel
+
+
+def _compact(present):
+    '''
+    每列把有 K 线的行稳定地排到前面，返回排列 order：
+    compact = take_along_axis(x, order)，第 i 行即该股票的第 i 根 K 线。
+    '''
+    return np.argsort(~present, axis=0, kind='stable')
+
+
+def _scatter(compact, order, fill):
+    '''把按 K 线序号排列的结果放回日期行，无 K 线的行为 fill。'''
+    out = np.full(compact.shape, fill, dtype=compact.dtype)
+    np.put_along_axis(out, order, compact, axis=0)
+    return out
+
+
+def _shift(x, n, fill=np.nan):
+    '''沿时间轴向后平移 n 行（x[t-n]），前 n 行为 fill。'''
+    out = np.full_like(x, fill)
+    if n < len(x):
+        out[n:] = x[:len(x) - n]
+    return out
+
+
+def rolling_sma(x, period):
+    '''
+    按 K 线序号排列的二维数组上的简单移动平均，前 period-1 行为 NaN。
+    用累加和相减计算，与 backtrader（math.fsum）的差异在 1e-12 量级；
+    窗口内数值全部相同时按 (period*x)/period 计算，与 fsum 的结果逐位一致。
+    '''
+    valid = ~np.isnan(x)
+    filled = np.where(valid, x, 0.0)
+    csum = np.cumsum(filled, axis=0)
+    out = np.full(x.shape, np.nan)
+    if period > len(x):
+        return out
+    window = csum[period - 1:].copy()
+    window[1:] -= csum[:len(x) - period]
+    out[period - 1:] = window / period
+
+    if period > 1:
+        same = np.zeros(x.shape, dtype=np.int64)
+        same[1:] = x[1:] == x[:-1]
+        csame = np.cumsum(same, axis=0)
+        run = csame - _shift(csame, period - 1, fill=0)
+        flat = run == period - 1
+        flat[:period - 1] = False
+        out = np.where(flat, (x * period) / period, out)
+    # 窗口内有 NaN 时结果为 NaN，与 fsum 的行为一致
+    counts = np.cumsum(valid, axis=0)
+    full = (counts - _shift(counts, period, fill=0)) == period
+    return np.where(full, out, np.nan)
+
+
+def _sma_error_bound(x, period):
+    '''rolling_sma 相对精确值（fsum）的误差上界：累加误差随行号线性增长。'''
+    cabs = np.cumsum(np.where(np.isnan(x), 0.0, np.abs(x)), axis=0)
+    rows = np.arange(1, len(x) + 1, dtype=np.float64)[:, None]
+    return 4.0 * np.finfo(np.float64).eps * rows * cabs / period
+
+
+def _refine_sma(x, period, ma, mask):
+    '''对 mask 标出的位置用 math.fsum 重新计算均线，结果与 backtrader 的 SMA 逐位一致。'''
+    rows, cols = np.nonzero(mask & ~np.isnan(ma))
+    for r, c in zip(rows, cols):
+        ma[r, c] = math.fsum(x[r - period + 1:r + 1, c]) / period
+
+
+def rolling_rsi(close, period):
+    '''
+    backtrader RSI（movav=SmoothedMovingAverage, lookback=1, safediv=False）的向量化实现。
+    输入为按 K 线序号排列的二维数组，前 period 行为 NaN。
+    madown 为 0 时按 safediv=True 的规则处理：只有上涨时 RSI=100，不涨不跌时 RSI=50
+    （默认参数的 backtrader 在这种情况下会抛出除零错误）。
+    '''
+    n_rows = len(close)
+    out = np.full(close.shape, np.nan)
+    if n_rows <= period:
+        return out
+    prev = _shift(close, 1)
+    up = np.maximum(close - prev, 0.0)
+    down = np.maximum(prev - close, 0.0)
+
+    alpha = 1.0 / period
+    alpha1 = 1.0 - alpha
+    maup = np.full(close.shape, np.nan)
+    madown = np.full(close.shape, np.nan)
+    # 首值：前 period 个涨跌幅的精确和（math.fsum）除以 period，与 backtrader 的 Average 一致
+    maup[period] = [math.fsum(col) / period for col in up[1:period + 1].T]
+    madown[period] = [math.fsum(col) / period for col in down[1:period + 1].T]
+    for i in range(period + 1, n_rows):
+        maup[i] = maup[i - 1] * alpha1 + up[i] * alpha
+        madown[i] = madown[i - 1] * alpha1 + down[i] * alpha
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = np.where(madown == 0.0, np.where(maup == 0.0, 1.0, np.inf), maup / madown)
+        out = 100.0 - 100.0 / (1.0 + rs)
+    return out
+
+
+def _rising(x, period):
+    '''均线向上：ma[t] > ma[t-1] 等价于 x[t] > x[t-period]（要求两根均线都已有值）。'''
+    with np.errstate(invalid='ignore'):
+        return x > _shift(x, period)
+
+
+def compute_five_step(close, volume, params=None):
+    '''
+    计算全市场五步法信号。
+
+    close / volume 为 (日期 x 股票) 数组，NaN 表示当日无 K 线。
+    返回字典：
+      entry / exit           布尔矩阵（只在有 K 线的日期可能为 True）
+      cond1 .. cond5         各买入条件
+      ma_long / ma_mid / ma_short / ma_exit / rsi_fast / rsi_slow / vol_fast / vol_slow
+                             指标值（无 K 线的日期为 NaN）
+      bar_index              每个日期对应该股票的 K 线序号（len(data)-1），无 K 线为 -1
+      present                是否有 K 线
+    '''
+    p = params or FIVE_STEP_PARAMS
+    close = np.asarray(close, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    present = ~np.isnan(close)
+    order = _compact(present)
+    c = np.take_along_axis(close, order, axis=0)
+    v = np.take_along_axis(volume, order, axis=0)
+    n_bars = present.sum(axis=0)
+    bar_rows = np.arange(len(c))[:, None]
+    has_bar = bar_rows < n_bars[None, :]
+    c = np.where(has_bar, c, np.nan)
+    v = np.where(has_bar, v, np.nan)
+
+    ind = {
+        'ma_long': rolling_sma(c, p['ma_long']),
+        'ma_mid': rolling_sma(c, p['ma_mid']),
+        'ma_short': rolling_sma(c, p['ma_short']),
+        'ma_exit': rolling_sma(c, p['exit_ma']),
+        'rsi_fast': rolling_rsi(c, p['rsi_fast']),
+        'rsi_slow': rolling_rsi(c, p['rsi_slow']),
+        'vol_fast': rolling_sma(v, p['vol_fast']),
+        'vol_slow': rolling_sma(v, p['vol_slow']),
+    }
+
+    # 累加求和的均线与 fsum 相差在 1e-12 量级，只在比较结果可能受影响的位置精确重算
+    bounds = {name: _sma_error_bound(src, p[key]) for name, src, key in (
+        ('ma_long', c, 'ma_long'), ('ma_exit', c, 'exit_ma'),
+        ('vol_fast', v, 'vol_fast'), ('vol_slow', v, 'vol_slow'))}
+    with np.errstate(invalid='ignore'):
+        _refine_sma(c, p['ma_long'], ind['ma_long'], np.abs(c - ind['ma_long']) <= bounds['ma_long'])
+        _refine_sma(c, p['exit_ma'], ind['ma_exit'], np.abs(c - ind['ma_exit']) <= bounds['ma_exit'])
+        near = np.abs(ind['vol_fast'] - ind['vol_slow']) <= bounds['vol_fast'] + bounds['vol_slow']
+        _refine_sma(v, p['vol_fast'], ind['vol_fast'], near)
+        _refine_sma(v, p['vol_slow'], ind['vol_slow'], near)
+
+        cond = {
+            'cond1': c > ind['ma_long'],
+            'cond2': _rising(c, p['ma_long']),
+            'cond3': _rising(c, p['ma_mid']) | _rising(c, p['ma_short']),
+            'cond4': (ind['rsi_fast'] > p['rsi_fast_min']) & (ind['rsi_slow'] > p['rsi_slow_min']),
+            'cond5': ((ind['vol_fast'] > ind['vol_slow'])
+                      & _rising(v, p['vol_fast']) & _rising(v, p['vol_slow'])),
+        }
+        exit_ = c < ind['ma_exit']
+    entry = cond['cond1'] & cond['cond2'] & cond['cond3'] & cond['cond4'] & cond['cond5']
+
+    result = {'entry': _scatter(entry, order, False), 'exit': _scatter(exit_, order, False)}
+    for name, values in cond.items():
+        result[name] = _scatter(values, order, False)
+    for name, values in ind.items():
+        result[name] = _scatter(values, order, np.nan)
+    bar_index = np.where(has_bar, bar_rows, -1)
+    result['bar_index'] = _scatter(bar_index, order, -1)
+    result['present'] = present
+    return result
+
+
+def latest_signals(close, volume, params=None):
+    '''只取每只股票最后一根 K 线的信号，供选股使用。返回字段 -> 一维数组。'''
+    res = compute_five_step(close, volume, params)
+    present = res['present']
+    has_any = present.any(axis=0)
+    last_row = len(present) - 1 - np.argmax(present[::-1], axis=0)
+    cols = np.arange(present.shape[1])
+    out = {name: values[last_row, cols] for name, values in res.items() if name != 'present'}
+    for name, values in out.items():
+        if values.dtype == bool:
+            out[name] = values & has_any
+    return out
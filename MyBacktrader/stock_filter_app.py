@@ -1,10 +1,63 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import pandas as pd
-import sqlite3
 from datetime import datetime
 import os
 import numpy as np # For handling potential inf values in data
+from background_loader import BackgroundTask, check_cancel, read_sql_chunks
+from bar_store import open_bar_store, store_dir_for
+from db_access import read_connection
+from filter_index import FilterIndex
+from latest_snapshot import load_latest_snapshot
+from pit_screen import open_fundamentals_index, screen_dates, write_pools
+from screener_cache import cache_key, load_cached_frame, save_cached_frame
+from tech_screen import CONDITION_COLUMNS, EXIT_MAS, scan_technical
+from virtual_grid import VirtualGrid, format_float
+
+FILTER_DEBOUNCE_MS = 200 # 輸入停止多久後自動重新篩選（毫秒）
+
+# 數據類型規劃：行業、名稱重複值多，用 category；價格和成交量只用於顯示，float32 足夠
+# PE、PB、總市值參與篩選比較（總市值以萬元計可達 1e8 以上），保留 float64
+CATEGORY_COLUMNS = ('industry', 'name')
+FLOAT32_COLUMNS = ('open', 'high', 'low', 'close', 'vol')
+
+# 技術篩選的勾選項：(列名, 說明)，五步條件要求為 True，跌破均線要求為 False
+TECH_CONDITIONS = [
+    ('cond1', '收盤價 > MA240'),
+    ('cond2', 'MA240 向上'),
+    ('cond3', 'MA60 或 MA20 向上'),
+    ('cond4', 'RSI6 > 70 且 RSI13 > 50'),
+    ('cond5', '量 MA3 > MA8 且均向上'),
+]
+TECH_EXITS = [(f'exit_ma{period}', f'排除跌破 MA{period}') for period in EXIT_MAS]
+TECH_COLUMNS = ['tech_date', *CONDITION_COLUMNS, 'entry', *(col for col, _ in TECH_EXITS), 'tech_state']
+
+
+def apply_dtype_plan(df):
+    for col in FLOAT32_COLUMNS:
+        if col in df:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(np.float32)
+    for col in CATEGORY_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype('category')
+    return df
+
+
+def merge_technical(df, scan):
+    # 把技術面掃描結果按 ts_code 合併到選股數據，並生成「技術狀態」列
+    df = df.drop(columns=[col for col in TECH_COLUMNS if col in df])
+    df = pd.merge(df, scan, on='ts_code', how='left')
+    df['tech_state'] = technical_state(df)
+    return df
+
+
+def technical_state(df):
+    # 結果表格中顯示的文字：五步全滿足或滿足幾個條件，以及跌破的均線
+    met = np.column_stack([df[col].eq(True).to_numpy() for col in CONDITION_COLUMNS]).sum(axis=1)
+    state = np.where(df['entry'].eq(True).to_numpy(), '五步全滿足', np.char.add(met.astype(str), '/5'))
+    for col, _ in TECH_EXITS:
+        state = np.where(df[col].eq(True).to_numpy(), np.char.add(state.astype(str), ' 破' + col[5:].upper()), state)
+    return np.where(df['tech_date'].notna().to_numpy(), state, '')
 
 class StockFilterApp:
     def __init__(self, master):
@@ -14,13 +67,22 @@ class StockFilterApp:
 
         self.df = pd.DataFrame() # 儲存載入的數據
         self.filtered_df = pd.DataFrame() # 儲存篩選後的數據
+        self.filtered_rows = np.empty(0, dtype=np.int64) # 篩選結果在 self.df 中的行位置
         self.all_industries = [] # 儲存所有唯一的行業列表
         self.selected_industries_cache = set() # 儲存已選中的行業名稱，用於持久化選擇狀態
+        self.filter_index = None # 載入數據時建立的篩選索引
+        self._filter_job = None # 等待執行的自動篩選 (after id)
+        self._industry_search_job = None # 等待執行的行業搜索 (after id)
+        self.tech_scanned = False # 當前數據是否已做過技術面掃描
+        self.task = None # 正在執行的後台任務 (BackgroundTask)
 
         # --- 檔案路徑變數 ---
         self.db_path_var = tk.StringVar(value="")
         self.basic_csv_path_var = tk.StringVar(value="")
         self.daily_table_name_var = tk.StringVar(value="daily_data") # 預設表名
+        self.as_of_date_var = tk.StringVar(value="") # 歷史篩選日期 (YYYYMMDD)，留空為最新
+        self.batch_end_date_var = tk.StringVar(value="") # 批量導出的結束日期
+        self.batch_step_var = tk.IntVar(value=20) # 批量導出時每隔多少個交易日篩選一次
 
         # --- GUI 介面設計 ---
         self._create_widgets()
@@ -44,8 +106,28 @@ class StockFilterApp:
         ttk.Label(input_frame, text="日線數據表名:").grid(row=2, column=0, padx=5, pady=5, sticky="w")
         ttk.Entry(input_frame, textvariable=self.daily_table_name_var, width=30).grid(row=2, column=1, padx=5, pady=5, sticky="w")
 
-        # 載入數據按鈕
-        ttk.Button(input_frame, text="載入數據", command=self._load_data_action).grid(row=3, column=0, columnspan=3, pady=10)
+        # 歷史時點：載入指定日期的估值；批量模式對日期區間內每隔 N 個交易日各導出一個股票池
+        pit_frame = ttk.Frame(input_frame)
+        pit_frame.grid(row=3, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+        ttk.Label(pit_frame, text="歷史日期 (留空為最新):").pack(side="left")
+        ttk.Entry(pit_frame, textvariable=self.as_of_date_var, width=10).pack(side="left", padx=2)
+        ttk.Label(pit_frame, text="批量至:").pack(side="left", padx=(10, 0))
+        ttk.Entry(pit_frame, textvariable=self.batch_end_date_var, width=10).pack(side="left", padx=2)
+        ttk.Label(pit_frame, text="每隔交易日:").pack(side="left", padx=(10, 0))
+        ttk.Entry(pit_frame, textvariable=self.batch_step_var, width=5).pack(side="left", padx=2)
+        ttk.Button(pit_frame, text="批量導出歷史股票池", command=self._export_history_pools).pack(side="left", padx=10)
+
+        # 載入數據按鈕、取消按鈕和進度條（載入在後台線程中進行，介面保持可操作）
+        load_frame = ttk.Frame(input_frame)
+        load_frame.grid(row=4, column=0, columnspan=3, pady=10)
+        self.load_button = ttk.Button(load_frame, text="載入數據", command=self._load_data_action)
+        self.load_button.pack(side="left", padx=5)
+        self.cancel_button = ttk.Button(load_frame, text="取消", command=self._cancel_task, state="disabled")
+        self.cancel_button.pack(side="left", padx=5)
+        self.progress_bar = ttk.Progressbar(load_frame, length=300, maximum=1.0)
+        self.progress_bar.pack(side="left", padx=5)
+        self.load_status_var = tk.StringVar(value="")
+        ttk.Label(load_frame, textvariable=self.load_status_var, width=40).pack(side="left", padx=5)
 
         input_frame.grid_columnconfigure(1, weight=1) # 讓路徑輸入框可伸縮
 
@@ -84,8 +166,8 @@ class StockFilterApp:
         self.industry_search_var = tk.StringVar()
         self.industry_search_entry = ttk.Entry(filter_frame, textvariable=self.industry_search_var, width=25)
         self.industry_search_entry.grid(row=0, column=5, padx=5, pady=2, sticky="ew")
-        # 綁定按鍵釋放事件，實時過濾行業列表
-        self.industry_search_entry.bind("<KeyRelease>", self._filter_industries)
+        # 綁定按鍵釋放事件，停止輸入後再過濾行業列表
+        self.industry_search_entry.bind("<KeyRelease>", self._schedule_industry_search)
 
         self.industry_listbox = tk.Listbox(filter_frame, selectmode=tk.MULTIPLE, height=6,
                                            selectbackground="blue", selectforeground="white") # 設置選中背景色
@@ -95,45 +177,46 @@ class StockFilterApp:
         self.industry_listbox.config(yscrollcommand=industry_scrollbar.set)
         filter_frame.grid_columnconfigure(5, weight=1) # 讓行業列表可伸縮
         filter_frame.grid_rowconfigure(1, weight=1) # 讓行業列表高度可伸縮
+        self.industry_listbox.bind("<<ListboxSelect>>", self._schedule_filter)
+
+        # 修改範圍或行業後自動重新篩選
+        for var in (self.pe_min_var, self.pe_max_var, self.pb_min_var, self.pb_max_var,
+                    self.mv_min_var, self.mv_max_var):
+            var.trace_add("write", self._schedule_filter)
 
         # 篩選按鈕
         ttk.Button(filter_frame, text="篩選股票", command=self._apply_filters).grid(row=3, column=0, columnspan=7, pady=10)
 
+        # --- 技術篩選框架 ---
+        tech_frame = ttk.LabelFrame(self.master, text="技術篩選 (五步法，最新一根K線)")
+        tech_frame.pack(padx=10, pady=5, fill="x")
+        self.tech_vars = {}
+        for i, (col, text) in enumerate(TECH_CONDITIONS + TECH_EXITS):
+            var = tk.BooleanVar(value=False)
+            var.trace_add("write", self._on_tech_option)
+            self.tech_vars[col] = var
+            ttk.Checkbutton(tech_frame, text=text, variable=var).grid(row=i // 5, column=i % 5, padx=5, pady=2, sticky="w")
+        ttk.Button(tech_frame, text="掃描技術條件", command=self._run_technical_scan).grid(row=0, column=5, rowspan=2, padx=10)
+
         # --- 結果顯示框架 (Treeview) ---
         result_frame = ttk.LabelFrame(self.master, text="篩選結果")
+        self.result_frame = result_frame
         result_frame.pack(padx=10, pady=10, fill="both", expand=True)
 
-        self.tree = ttk.Treeview(result_frame, columns=('ts_code', 'name', 'industry', 'close', 'pe_ttm', 'pb', 'total_mv_billion', 'trade_date'), show='headings')
-        self.tree.pack(fill="both", expand=True)
-
-        # 定義列標題
-        self.tree.heading('ts_code', text='股票代碼')
-        self.tree.heading('name', text='名稱')
-        self.tree.heading('industry', text='行業')
-        self.tree.heading('close', text='收盤價')
-        self.tree.heading('pe_ttm', text='PE_TTM')
-        self.tree.heading('pb', text='PB')
-        self.tree.heading('total_mv_billion', text='總市值(億元)')
-        self.tree.heading('trade_date', text='交易日期')
-
-        # 定義列寬
-        self.tree.column('ts_code', width=100, anchor='center')
-        self.tree.column('name', width=120, anchor='center')
-        self.tree.column('industry', width=120, anchor='center')
-        self.tree.column('close', width=80, anchor='center')
-        self.tree.column('pe_ttm', width=80, anchor='center')
-        self.tree.column('pb', width=80, anchor='center')
-        self.tree.column('total_mv_billion', width=120, anchor='center')
-        self.tree.column('trade_date', width=100, anchor='center')
-
-        # 捲軸
-        tree_scrollbar_y = ttk.Scrollbar(self.tree, orient="vertical", command=self.tree.yview)
-        tree_scrollbar_y.pack(side="right", fill="y")
-        self.tree.config(yscrollcommand=tree_scrollbar_y.set)
-
-        tree_scrollbar_x = ttk.Scrollbar(self.tree, orient="horizontal", command=self.tree.xview)
-        tree_scrollbar_x.pack(side="bottom", fill="x")
-        self.tree.config(xscrollcommand=tree_scrollbar_x.set)
+        # 虛擬化表格：只渲染可見的行，點擊列標題排序
+        self.grid = VirtualGrid(result_frame, columns=[
+            ('ts_code', '股票代碼', 100),
+            ('name', '名稱', 120),
+            ('industry', '行業', 120),
+            ('close', '收盤價', 80),
+            ('pe_ttm', 'PE_TTM', 80),
+            ('pb', 'PB', 80),
+            ('total_mv_billion', '總市值(億元)', 120),
+            ('trade_date', '交易日期', 100),
+            ('tech_state', '技術狀態', 130),
+        ], formatters={col: format_float for col in ('close', 'pe_ttm', 'pb', 'total_mv_billion')})
+        self.grid.pack(fill="both", expand=True)
+        self.tree = self.grid.tree
 
         # 保存結果按鈕
         ttk.Button(self.master, text="保存為股票池CSV", command=self._save_filtered_data).pack(pady=10)
@@ -152,6 +235,8 @@ class StockFilterApp:
         db_file = self.db_path_var.get()
         daily_table = self.daily_table_name_var.get()
         basic_csv = self.basic_csv_path_var.get()
+        as_of_date = self.as_of_date_var.get().strip() or None
+        scan_tech = any(var.get() for var in self.tech_vars.values()) # 已勾選技術條件時，載入後一併掃描
 
         if not db_file or not basic_csv:
             messagebox.showerror("錯誤", "請選擇SQLite資料庫和股票基礎資訊CSV檔案。")
@@ -161,25 +246,158 @@ class StockFilterApp:
             messagebox.showerror("錯誤", "請輸入日線數據表名。")
             return
 
-        try:
-            self.df = self._load_data(db_file, daily_table, basic_csv)
-            if not self.df.empty:
-                messagebox.showinfo("成功", f"數據載入完成！共 {len(self.df)} 支股票。")
-                self.all_industries = sorted(self.df['industry'].dropna().unique().tolist())
-                self._populate_industry_listbox(self.all_industries) # 初始填充所有行業
-                self._update_slider_ranges() # 更新篩選範圍的預設值和實際範圍
-                self._apply_filters() # 載入後預設篩選一次
-            else:
-                messagebox.showwarning("警告", "未能載入任何數據，請檢查檔案內容和表名。")
-        except Exception as e:
-            messagebox.showerror("錯誤", f"載入數據時發生錯誤: {e}")
+        def work(progress, cancel):
+            # 在後台線程中執行，不可操作任何 Tk 控件或變數
+            df = self._load_data_cached(db_file, daily_table, basic_csv, as_of_date, progress, cancel)
+            if scan_tech and not df.empty:
+                progress(0.95, "掃描技術條件…")
+                df = merge_technical(df, scan_technical(db_file, daily_table, as_of=as_of_date))
+                check_cancel(cancel)
+            return df, scan_tech
+
+        self._start_task(work, self._on_data_loaded, "載入數據")
+
+    def _on_data_loaded(self, result):
+        self.df, self.tech_scanned = result
+        if not self.df.empty:
+            messagebox.showinfo("成功", f"數據載入完成！共 {len(self.df)} 支股票。")
+            self._rebuild_index()
+            self.all_industries = sorted(self.df['industry'].dropna().unique().tolist())
+            self._populate_industry_listbox(self.all_industries) # 初始填充所有行業
+            self._update_slider_ranges() # 更新篩選範圍的預設值和實際範圍
+            self._apply_filters() # 載入後預設篩選一次
+            if not self.tech_scanned and any(var.get() for var in self.tech_vars.values()):
+                self._scan_technical_async() # 載入期間才勾選的技術條件
+        else:
+            messagebox.showwarning("警告", "未能載入任何數據，請檢查檔案內容和表名。")
+
+    def _start_task(self, work, on_done, title):
+        # 在後台線程中執行 work(progress, cancel)，完成後在主線程中調用 on_done(結果)
+        if self.task is not None and self.task.running:
+            messagebox.showwarning("警告", "請等待當前任務完成或先取消。")
+            return
 
-    def _load_data(self, db_file, daily_table, basic_csv):
-        conn = None
-        try:
-            conn = sqlite3.connect(db_file)
+        def finish(status):
+            self.task = None
+            self.load_button.config(state="normal")
+            self.cancel_button.config(state="disabled")
+            self.load_status_var.set(status)
 
-            # 1. 從SQLite資料庫載入股票最新的市場資料 (包含pe_ttm, pb, total_mv)
+        def done(result):
+            finish(f"{title}完成")
+            self.progress_bar['value'] = 1.0
+            try:
+                on_done(result)
+            except Exception as e:
+                messagebox.showerror("錯誤", f"{title}時發生錯誤: {e}")
+
+        def error(e):
+            finish(f"{title}失敗")
+            messagebox.showerror("錯誤", f"{title}時發生錯誤: {e}")
+
+        def progress(fraction, message):
+            self.progress_bar['value'] = fraction
+            self.load_status_var.set(message)
+
+        self.task = BackgroundTask(self.master, work, done, on_error=error, on_progress=progress,
+                                   on_cancelled=lambda: finish(f"已取消{title}"))
+        self.load_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.progress_bar['value'] = 0.0
+        self.load_status_var.set(f"{title}…")
+        self.task.start()
+
+    def _cancel_task(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.load_status_var.set("正在取消…")
+
+    def _load_data_cached(self, db_file, daily_table, basic_csv, as_of_date=None, progress=None, cancel=None):
+        # 資料庫（大小、修改時間、最後交易日）、表名、歷史日期和基礎資訊 CSV 都未變化時直接讀取緩存，
+        # 否則重新載入並寫回緩存
+        progress = progress or (lambda fraction, message: None)
+        if not os.path.exists(basic_csv):
+            raise FileNotFoundError(f"股票基礎資訊文件 '{basic_csv}' 不存在。")
+        key = cache_key(db_file, daily_table, basic_csv, as_of_date)
+        df = load_cached_frame(db_file, key)
+        if df is not None:
+            progress(0.9, "已從緩存載入")
+            return df
+        df = self._load_data(db_file, daily_table, basic_csv, as_of_date, progress, cancel)
+        try:
+            save_cached_frame(db_file, key, df)
+        except OSError as e:
+            print(f"警告: 無法寫入選股數據緩存: {e}")
+        return df
+
+    def _load_data(self, db_file, daily_table, basic_csv, as_of_date=None, progress=None, cancel=None):
+        # 可在後台線程中調用：progress(0~1, 說明) 報告進度，cancel (threading.Event) 被設置時拋出 LoadCancelled
+        progress = progress or (lambda fraction, message: None)
+
+        def rows_progress(done, total):
+            # SQL 分塊讀取佔整體進度的 5% ~ 80%
+            fraction = 0.05 + 0.75 * min(done / total, 1.0) if total else 0.5
+            progress(fraction, f"已讀取 {done} 行行情數據")
+
+        # 1. 從SQLite資料庫載入股票最新的市場資料 (包含pe_ttm, pb, total_mv)
+        #    指定了歷史日期時，從歷史估值索引取該日（停牌則為之前最近一日）的數據，不使用之後的數據
+        #    若資料庫旁有最新的列式存儲，直接取每支股票的最後一行，無需掃描整張表
+        #    否則分塊讀取維護好的 latest_snapshot 快照表（約 5000 行），快照無法刷新時才直接查詢日線表
+        progress(0.0, "讀取行情數據…")
+        dtype = {col: 'float32' for col in FLOAT32_COLUMNS}
+        if as_of_date:
+            df_daily_latest = open_fundamentals_index(db_file, table=daily_table).snapshot(as_of_date)
+        else:
+            df_daily_latest = self._load_latest_from_store(db_file, daily_table)
+        if df_daily_latest is None:
+            df_daily_latest = load_latest_snapshot(db_file, daily_table, dtype=dtype, progress=rows_progress,
+                                                   cancel=cancel)
+        if df_daily_latest is None:
+            df_daily_latest = self._load_latest_from_db(db_file, daily_table, dtype, rows_progress, cancel)
+        check_cancel(cancel)
+
+        # 確保估值資料是數值類型，將無效值轉換為NaN
+        for col in ['pe_ttm', 'pb', 'total_mv']:
+            df_daily_latest[col] = pd.to_numeric(df_daily_latest[col], errors='coerce')
+
+
+        # 2. 從CSV檔案載入股票基礎資訊
+        progress(0.85, "讀取股票基礎資訊…")
+        if not os.path.exists(basic_csv):
+            raise FileNotFoundError(f"股票基礎資訊文件 '{basic_csv}' 不存在。")
+
+        df_basic = pd.read_csv(basic_csv)
+        # 確保ts_code列類型一致，以便合併
+        df_basic['ts_code'] = df_basic['ts_code'].astype(str)
+        df_daily_latest['ts_code'] = df_daily_latest['ts_code'].astype(str)
+        check_cancel(cancel)
+
+        # 3. 合併資料
+        progress(0.9, "合併數據…")
+        df_merged = pd.merge(df_daily_latest, df_basic, on='ts_code', how='inner')
+
+        # 計算總市值 (億元)
+        df_merged['total_mv_billion'] = df_merged['total_mv'] / 10000.0 # 假設total_mv是萬元
+
+        return apply_dtype_plan(df_merged)
+
+    def _load_latest_from_store(self, db_file, daily_table):
+        store = open_bar_store(store_dir_for(db_file), db_file=db_file)
+        if store is None:
+            return None
+        if store.meta.get('table') != daily_table:
+            store.close()
+            return None
+        codes, latest = store.latest()
+        df = pd.DataFrame({'ts_code': codes})
+        df['trade_date'] = latest['trade_date'].astype(str)
+        for col in ['open', 'high', 'low', 'close', 'vol', 'pe_ttm', 'pb', 'total_mv']:
+            df[col] = latest[col]
+        store.close()
+        return df
+
+    def _load_latest_from_db(self, db_file, daily_table, dtype=None, progress=None, cancel=None):
+        with read_connection(db_file) as conn:
             query_latest_fundamentals = f"""
                 SELECT
                     t1.ts_code,
@@ -204,33 +422,11 @@ class StockFilterApp:
                         ts_code
                 ) t2 ON t1.ts_code = t2.ts_code AND t1.trade_date = t2.max_trade_date
             """
-            df_daily_latest = pd.read_sql_query(query_latest_fundamentals, conn)
-
-            # 確保估值資料是數值類型，將無效值轉換為NaN
-            for col in ['pe_ttm', 'pb', 'total_mv']:
-                df_daily_latest[col] = pd.to_numeric(df_daily_latest[col], errors='coerce')
-
-
-            # 2. 從CSV檔案載入股票基礎資訊
-            if not os.path.exists(basic_csv):
-                raise FileNotFoundError(f"股票基礎資訊文件 '{basic_csv}' 不存在。")
-
-            df_basic = pd.read_csv(basic_csv)
-            # 確保ts_code列類型一致，以便合併
-            df_basic['ts_code'] = df_basic['ts_code'].astype(str)
-            df_daily_latest['ts_code'] = df_daily_latest['ts_code'].astype(str)
-
-            # 3. 合併資料
-            df_merged = pd.merge(df_daily_latest, df_basic, on='ts_code', how='inner')
-
-            # 計算總市值 (億元)
-            df_merged['total_mv_billion'] = df_merged['total_mv'] / 10000.0 # 假設total_mv是萬元
-
-            return df_merged
-
-        finally:
-            if conn:
-                conn.close()
+            # 預計行數為股票數（走 (ts_code, trade_date) 主鍵索引，無需掃描數據）
+            total = conn.execute(f"SELECT COUNT(*) FROM (SELECT DISTINCT ts_code FROM {daily_table})").fetchone()[0]
+            df_daily_latest = read_sql_chunks(conn, query_latest_fundamentals, total=total, dtype=dtype,
+                                              progress=progress, cancel=cancel)
+            return df_daily_latest
 
     def _populate_industry_listbox(self, industries_to_display):
         # 獲取當前選中的行業，用於持久化
@@ -247,7 +443,13 @@ class StockFilterApp:
             if industry in self.selected_industries_cache:
                 self.industry_listbox.selection_set(i)
 
+    def _schedule_industry_search(self, event=None):
+        if self._industry_search_job is not None:
+            self.master.after_cancel(self._industry_search_job)
+        self._industry_search_job = self.master.after(FILTER_DEBOUNCE_MS, self._filter_industries)
+
     def _filter_industries(self, event=None):
+        self._industry_search_job = None
         search_text = self.industry_search_var.get().lower()
         if not self.all_industries: # 如果數據未載入
             return
@@ -257,6 +459,8 @@ class StockFilterApp:
             industry for industry in self.all_industries
             if search_text in industry.lower()
         ]
+        if filtered_industries == list(self.industry_listbox.get(0, tk.END)):
+            return # 列表沒有變化，無需重建
         self._populate_industry_listbox(filtered_industries)
 
 
@@ -287,77 +491,155 @@ class StockFilterApp:
             self.mv_max_var.set(round(max_mv, 0))
 
 
-    def _apply_filters(self):
+    def _rebuild_index(self):
+        self.grid.set_source(self.df) # 預先為每一列排序，篩選時只傳入行位置
+        # 數值列排序、行業位圖和技術條件位圖，篩選只需二分查找和位運算
+        flag_columns = [col for col in list(CONDITION_COLUMNS) + [c for c, _ in TECH_EXITS] if col in self.df]
+        self.filter_index = FilterIndex(self.df, flag_columns=flag_columns)
+
+    def _scan_technical_async(self, on_done=None):
+        # 全市場五步法掃描（約 250 根K線的窗口）在後台線程中進行，結果按 ts_code 合併到 self.df
+        db_file = self.db_path_var.get()
+        daily_table = self.daily_table_name_var.get()
+        as_of_date = self.as_of_date_var.get().strip() or None
+
+        def work(progress, cancel):
+            progress(0.1, "掃描技術條件…")
+            return scan_technical(db_file, daily_table, as_of=as_of_date)
+
+        def done(scan):
+            self.df = merge_technical(self.df, scan)
+            self.tech_scanned = True
+            self._rebuild_index()
+            count = self._run_filters()
+            if on_done:
+                on_done(count)
+
+        self._start_task(work, done, "技術掃描")
+
+    def _run_technical_scan(self):
         if self.df.empty:
             messagebox.showwarning("警告", "請先載入數據。")
             return
+        self._scan_technical_async(lambda count: messagebox.showinfo(
+            "掃描完成", f"五步全滿足 {int(self.df['entry'].eq(True).sum())} 支，當前篩選出 {count} 支股票。"))
+
+    def _on_tech_option(self, *args):
+        # 勾選技術條件時若尚未掃描，先在後台掃描一次（全市場約一兩秒），之後只需位運算
+        if self.filter_index is None:
+            return
+        if not self.tech_scanned and any(var.get() for var in self.tech_vars.values()):
+            if self.task is None:
+                self._scan_technical_async()
+            return
+        self._schedule_filter()
+
+    def _run_filters(self):
+        # 用篩選索引計算結果並刷新表格，返回篩選出的股票數；輸入無效時拋出異常
+        ranges = {
+            'pe_ttm': (self.pe_min_var.get(), self.pe_max_var.get()), # PE_TTM 篩選
+            'pb': (self.pb_min_var.get(), self.pb_max_var.get()), # PB 篩選
+            'total_mv_billion': (self.mv_min_var.get(), self.mv_max_var.get()), # Total_MV 篩選 (億元)
+        }
+
+        # 行業篩選
+        # 在應用篩選前，先將當前 Listbox 中的選中項目更新到緩存中
+        current_listbox_selection = {self.industry_listbox.get(i) for i in self.industry_listbox.curselection()}
+        self.selected_industries_cache = current_listbox_selection
+
+        # 技術篩選：勾選的五步條件要求滿足，勾選的跌破均線要求未跌破
+        flags = {col: not col.startswith('exit_') for col, var in self.tech_vars.items()
+                 if var.get() and col in self.filter_index.flag_bits}
+
+        self.filtered_rows = self.filter_index.query(ranges, self.selected_industries_cache, flags)
+        self.filtered_df = self.df.iloc[self.filtered_rows]
+        self._update_treeview()
+        self.result_frame.config(text=f"篩選結果 ({len(self.filtered_rows)} 支)")
+        return len(self.filtered_rows)
+
+    def _schedule_filter(self, *args):
+        # 輸入停止 FILTER_DEBOUNCE_MS 毫秒後再篩選，連續輸入時只執行最後一次
+        if self.filter_index is None:
+            return
+        if self._filter_job is not None:
+            self.master.after_cancel(self._filter_job)
+        self._filter_job = self.master.after(FILTER_DEBOUNCE_MS, self._live_filter)
 
-        filtered_df = self.df.copy()
+    def _live_filter(self):
+        self._filter_job = None
+        try:
+            self._run_filters()
+        except (tk.TclError, ValueError):
+            pass # 正在輸入的數字還不完整（如 "1." 或空白），保留上一次的結果
+
+    def _apply_filters(self):
+        if self.df.empty or self.filter_index is None:
+            messagebox.showwarning("警告", "請先載入數據。")
+            return
 
         try:
-            # PE_TTM 篩選
-            pe_min = self.pe_min_var.get()
-            pe_max = self.pe_max_var.get()
-            filtered_df = filtered_df[
-                (filtered_df['pe_ttm'].notna()) &
-                (filtered_df['pe_ttm'] >= pe_min) &
-                (filtered_df['pe_ttm'] <= pe_max)
-            ]
-
-            # PB 篩選
-            pb_min = self.pb_min_var.get()
-            pb_max = self.pb_max_var.get()
-            filtered_df = filtered_df[
-                (filtered_df['pb'].notna()) &
-                (filtered_df['pb'] >= pb_min) &
-                (filtered_df['pb'] <= pb_max)
-            ]
-
-            # Total_MV 篩選 (億元)
-            mv_min = self.mv_min_var.get()
-            mv_max = self.mv_max_var.get()
-            filtered_df = filtered_df[
-                (filtered_df['total_mv_billion'].notna()) &
-                (filtered_df['total_mv_billion'] >= mv_min) &
-                (filtered_df['total_mv_billion'] <= mv_max)
-            ]
-
-            # 行業篩選
-            # 在應用篩選前，先將當前 Listbox 中的選中項目更新到緩存中
-            current_listbox_selection = {self.industry_listbox.get(i) for i in self.industry_listbox.curselection()}
-            self.selected_industries_cache = current_listbox_selection
-
-
-            if self.selected_industries_cache: # 使用緩存的選中行業
-                filtered_df = filtered_df[filtered_df['industry'].isin(list(self.selected_industries_cache))]
-
-            self.filtered_df = filtered_df
-            self._update_treeview()
-            messagebox.showinfo("篩選完成", f"已篩選出 {len(self.filtered_df)} 支股票。")
-
-        except ValueError:
+            count = self._run_filters()
+            messagebox.showinfo("篩選完成", f"已篩選出 {count} 支股票。")
+
+        except (tk.TclError, ValueError):
             messagebox.showerror("輸入錯誤", "請確保PE、PB、總市值範圍輸入的是有效數字。")
         except Exception as e:
             messagebox.showerror("篩選錯誤", f"篩選過程中發生錯誤: {e}")
 
 
+    def _export_history_pools(self):
+        # 用當前的篩選條件，對 [歷史日期, 批量至] 內每隔 N 個交易日各導出一個 stock_pool_<日期>.csv
+        db_file = self.db_path_var.get()
+        daily_table = self.daily_table_name_var.get()
+        basic_csv = self.basic_csv_path_var.get()
+        start_date = self.as_of_date_var.get().strip()
+        end_date = self.batch_end_date_var.get().strip() or None
+        if not db_file or not basic_csv or not daily_table:
+            messagebox.showerror("錯誤", "請選擇SQLite資料庫、股票基礎資訊CSV檔案並輸入日線數據表名。")
+            return
+        if not start_date:
+            messagebox.showerror("錯誤", "請輸入歷史日期作為批量導出的起始日期。")
+            return
+
+        try:
+            ranges = {
+                'pe_ttm': (self.pe_min_var.get(), self.pe_max_var.get()),
+                'pb': (self.pb_min_var.get(), self.pb_max_var.get()),
+                'total_mv_billion': (self.mv_min_var.get(), self.mv_max_var.get()),
+            }
+            step = max(1, self.batch_step_var.get())
+        except (tk.TclError, ValueError):
+            messagebox.showerror("輸入錯誤", "請確保PE、PB、總市值範圍和交易日間隔輸入的是有效數字。")
+            return
+        industries = {self.industry_listbox.get(i) for i in self.industry_listbox.curselection()} or \
+            self.selected_industries_cache
+
+        out_dir = filedialog.askdirectory(title="選擇股票池輸出目錄")
+        if not out_dir:
+            return
+
+        def index_progress(done, total):
+            # 首次使用或資料庫更新後需要生成歷史估值索引，佔整體進度的 0% ~ 80%
+            fraction = 0.8 * min(done / total, 1.0) if total else 0.4
+            return fraction, f"生成歷史估值索引，已讀取 {done} 行"
+
+        def work(progress, cancel):
+            # 在後台線程中執行，不可操作任何 Tk 控件或變數
+            index = open_fundamentals_index(db_file, table=daily_table, cancel=cancel,
+                                            progress=lambda done, total: progress(*index_progress(done, total)))
+            dates = index.trading_dates(start_date, end_date, step)
+            progress(0.85, f"篩選 {len(dates)} 個交易日…")
+            pools = screen_dates(index, dates, ranges, industries, pd.read_csv(basic_csv))
+            check_cancel(cancel)
+            progress(0.95, "寫出股票池…")
+            return write_pools(pools, out_dir)
+
+        self._start_task(work, lambda paths: messagebox.showinfo(
+            "導出完成", f"已導出 {len(paths)} 個歷史股票池到:\n{out_dir}"), "批量導出歷史股票池")
+
     def _update_treeview(self):
-        # 清空 Treeview 中的所有行
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-
-        # 插入篩選後的數據
-        for index, row in self.filtered_df.iterrows():
-            self.tree.insert("", tk.END, values=(
-                row['ts_code'],
-                row['name'],
-                row['industry'],
-                f"{row['close']:.2f}",
-                f"{row['pe_ttm']:.2f}" if pd.notna(row['pe_ttm']) else "N/A",
-                f"{row['pb']:.2f}" if pd.notna(row['pb']) else "N/A",
-                f"{row['total_mv_billion']:.2f}" if pd.notna(row['total_mv_billion']) else "N/A",
-                row['trade_date']
-            ))
+        # 只傳入篩選結果的行位置，表格按需渲染可見窗口
+        self.grid.show_rows(self.filtered_rows)
 
     def _save_filtered_data(self):
         if self.filtered_df.empty:
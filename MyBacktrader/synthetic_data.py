@@ -0,0 +1,131 @@
+'''
+合成行情数据库
+
+生成与 daily_data 表结构一致的随机游走日线数据，供基准测试和一致性校验使用，
+不依赖真实行情。价格保留两位小数，成交量为整数手，可按概率插入停牌日。
+
+命令行用法：
+    python synthetic_data.py synthetic.db --stocks 1000 --start 20200101 --end 20231231
+'''
+import argparse
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+
+from db_access import close_all
+
+DAILY_DATA_TABLE = 'daily_data'
+
+
+def create_daily_table(conn, table=DAILY_DATA_TABLE):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            ts_code TEXT,
+            trade_date TEXT,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            vol REAL,
+            pe_ttm REAL,
+            pb REAL,
+            total_mv REAL,
+            PRIMARY KEY (ts_code, trade_date)
+        )
+    """)
+
+
+def synthetic_codes(n_stocks):
+    return [f'{600000 + i:06d}.SH' if i % 2 == 0 else f'{i:06d}.SZ' for i in range(n_stocks)]
+
+
+def generate_bars(n_stocks, start='20200101', end='20231231', seed=0, suspend_prob=0.0,
+                  late_listing_prob=0.0):
+    '''
+    生成 (trade_dates, codes, bars) ，bars 为字段 -> (日期 x 股票) 二维数组，
+    停牌或未上市的位置为 NaN。
+    '''
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(pd.Timestamp(start), pd.Timestamp(end)).strftime('%Y%m%d').tolist()
+    n_dates = len(dates)
+    codes = synthetic_codes(n_stocks)
+
+    # 带轻微趋势切换的随机游走，保证五步法的买入条件在样本中会出现
+    drift = rng.normal(0.0004, 0.0015, size=(1, n_stocks))
+    regime = np.sign(np.sin(np.arange(n_dates)[:, None] / rng.uniform(40, 160, size=(1, n_stocks))))
+    rets = rng.normal(0.0, 0.02, size=(n_dates, n_stocks)) + drift + 0.002 * regime
+    close = np.round(rng.uniform(5, 50, size=(1, n_stocks)) * np.exp(np.cumsum(rets, axis=0)), 2)
+    close = np.maximum(close, 0.01)
+    prev_close = np.vstack([close[:1], close[:-1]])
+    open_ = np.maximum(np.round(prev_close * (1 + rng.normal(0, 0.005, close.shape)), 2), 0.01)
+    high = np.round(np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, close.shape))), 2)
+    low = np.round(np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, close.shape))), 2)
+    vol = np.round(rng.lognormal(10, 0.5, close.shape) * (1 + 5 * np.abs(rets)))
+    pe_ttm = np.round(rng.uniform(5, 80, size=(1, n_stocks)) * close / close[:1], 2)
+    pb = np.round(rng.uniform(0.5, 8, size=(1, n_stocks)) * close / close[:1], 2)
+    total_mv = np.round(rng.uniform(2e5, 2e7, size=(1, n_stocks)) * close / close[:1], 2)
+
+    bars = {'open': open_, 'high': high, 'low': low, 'close': close, 'vol': vol,
+            'pe_ttm': pe_ttm, 'pb': pb, 'total_mv': total_mv}
+
+    missing = np.zeros(close.shape, dtype=bool)
+    if suspend_prob > 0:
+        missing |= rng.random(close.shape) < suspend_prob
+    if late_listing_prob > 0:
+        late = rng.random(n_stocks) < late_listing_prob
+        first = rng.integers(0, n_dates, size=n_stocks)
+        missing |= late[None, :] & (np.arange(n_dates)[:, None] < first[None, :])
+    for field in bars:
+        bars[field] = np.where(missing, np.nan, bars[field])
+    return dates, codes, bars
+
+
+def create_synthetic_db(db_file, n_stocks=100, start='20200101', end='20231231', seed=0,
+                        suspend_prob=0.0, late_listing_prob=0.0, table=DAILY_DATA_TABLE):
+    '''生成合成数据库（已存在则覆盖），返回写入的行数。'''
+    if os.path.exists(db_file):
+        close_all(db_file)  # 丢弃连接池中指向旧文件的连接
+        os.remove(db_file)
+    dates, codes, bars = generate_bars(n_stocks, start, end, seed, suspend_prob, late_listing_prob)
+    fields = ('open', 'high', 'low', 'close', 'vol', 'pe_ttm', 'pb', 'total_mv')
+    conn = sqlite3.connect(db_file)
+    total = 0
+    try:
+        create_daily_table(conn, table)
+        for j, code in enumerate(codes):
+            present = ~np.isnan(bars['close'][:, j])
+            cols = [bars[f][present, j].tolist() for f in fields]
+            rows = [(code, d) + vals for d, vals in
+                    zip(np.asarray(dates)[present].tolist(), zip(*cols))]
+            conn.executemany(f"INSERT INTO {table} VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+            total += len(rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return total
+
+
+def write_stock_pool(csv_file, codes):
+    pd.DataFrame({'ts_code': codes}).to_csv(csv_file, index=False, encoding='utf-8')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='生成合成的 daily_data 数据库')
+    parser.add_argument('db_file')
+    parser.add_argument('--stocks', type=int, default=100)
+    parser.add_argument('--start', default='20200101')
+    parser.add_argument('--end', default='20231231')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--suspend-prob', type=float, default=0.0, help='每个交易日随机停牌的概率')
+    parser.add_argument('--late-listing-prob', type=float, default=0.0, help='股票在区间中途上市的概率')
+    parser.add_argument('--pool-csv', default=None, help='同时写出包含全部代码的股票池 CSV')
+    args = parser.parse_args()
+    n = create_synthetic_db(args.db_file, args.stocks, args.start, args.end, args.seed,
+                            args.suspend_prob, args.late_listing_prob)
+    if args.pool_csv:
+        write_stock_pool(args.pool_csv, synthetic_codes(args.stocks))
+    print(f"信息: 已生成 {args.db_file}，共 {n} 行")
+    sys.stdout.flush()
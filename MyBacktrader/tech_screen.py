@@ -0,0 +1,158 @@
+'''
+全市场技术面扫描（五步法）
+
+一次读入全市场每只股票最近 TECH_WINDOW_BARS 根 K 线（数据库旁有最新的列式存储 bar_store 时直接切片，
+否则用一次带 ROW_NUMBER() 窗口函数的 SQL 查询），按股票右对齐成
+(K 线序号 x 股票) 的二维数组，再用 signals.compute_five_step 向量化计算每只股票
+最后一根 K 线上的五个买入条件，以及跌破 20 日 / 10 日均线的卖出条件。
+
+窗口为 250 根 K 线：足够计算 240 日均线及其“向上”（需要 241 根）；RSI 从窗口起点递推，
+与从上市首日递推的值在 240 根 K 线后相差小于 1e-8。停牌较多、窗口内不足 241 根 K 线的
+股票 cond1 / cond2 为 False（与回测中均线尚未就绪时不会买入一致）。
+最近 TECH_WINDOW_BARS + DATE_MARGIN 个交易日内没有任何 K 线的股票（已退市或长期停牌）不参与扫描。
+两种读取方式得到的股票和 K 线完全相同。
+
+命令行用法：
+    python tech_screen.py daily_data.db [--date 20230601] [--out tech_signals.csv]
+'''
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from bar_store import date_to_int, open_bar_store, store_dir_for
+from db_access import read_connection
+from signals import five_step_params, latest_signals, rolling_sma
+
+# --- 配置参数 ---
+DB_FILE = 'daily_data.db'
+DAILY_DATA_TABLE = 'daily_data'
+TECH_WINDOW_BARS = 250   # 每只股票参与计算的最近 K 线数
+DATE_MARGIN = 30         # 最后一根 K 线早于最近 window + DATE_MARGIN 个交易日的股票视为已退市
+EXIT_MAS = (20, 10)      # 扫描的卖出均线
+
+CONDITION_COLUMNS = ('cond1', 'cond2', 'cond3', 'cond4', 'cond5')
+
+
+def _trailing_from_store(store, window, as_of):
+    '''从列式存储中取每只股票最后 window 根 K 线，全部为 memmap 上的向量化索引。'''
+    starts = np.asarray(store.offsets, dtype=np.int64)
+    ends = starts + np.asarray(store.counts, dtype=np.int64)
+    dates = store.column('trade_date')
+    if as_of:
+        ends = np.array([start + np.searchsorted(dates[start:end], as_of, side='right')
+                         for start, end in zip(starts, ends)], dtype=np.int64)
+    # 最近 span 个交易日中任何一天有 K 线的股票，这一天必在它自己的最后 span 根 K 线内，
+    # 因此各股票最后 span 根 K 线的日期之并包含了最近 span 个交易日，从中取出截止日
+    span = window + DATE_MARGIN
+    recent = ends[None, :] - np.arange(1, span + 1)[:, None]
+    market = np.unique(np.asarray(dates)[recent[recent >= starts[None, :]]])
+    cutoff = market[-span] if len(market) >= span else (market[0] if len(market) else 0)
+    active = (ends > starts) & (np.asarray(dates)[np.maximum(ends - 1, 0)] >= cutoff)
+    codes = [code for code, ok in zip(store.codes, active) if ok]
+    starts, ends = starts[active], ends[active]
+    rows = ends[None, :] - window + np.arange(window)[:, None]
+    valid = rows >= starts[None, :]
+    rows = np.where(valid, rows, ends[None, :] - 1)
+    close = np.where(valid, np.asarray(store.column('close'))[rows], np.nan)
+    vol = np.where(valid, np.asarray(store.column('vol'))[rows], np.nan)
+    return codes, np.asarray(dates[ends - 1], dtype=np.int64), close, vol
+
+
+def load_trailing_bars(db_file=DB_FILE, table=DAILY_DATA_TABLE, window=TECH_WINDOW_BARS, as_of=None):
+    '''
+    读入每只股票（as_of 及之前）最近 window 根 K 线。
+    返回 (codes, last_dates, close, vol)：close / vol 为 (window x 股票) 数组，
+    每列右对齐（最后一行是该股票最后一根 K 线），不足 window 根时顶部为 NaN。
+    '''
+    as_of = date_to_int(as_of)
+    store = open_bar_store(store_dir_for(db_file), db_file=db_file)
+    if store is not None:
+        try:
+            if store.meta.get('table') == table:
+                return _trailing_from_store(store, window, as_of)
+        finally:
+            store.close()
+
+    as_of_sql = "AND trade_date <= ?" if as_of else ""
+    params = (str(as_of),) if as_of else ()
+    with read_connection(db_file) as conn:
+        dates = conn.execute(f"SELECT DISTINCT trade_date FROM {table} WHERE 1 {as_of_sql} "
+                             f"ORDER BY trade_date DESC LIMIT ?", params + (window + DATE_MARGIN,)).fetchall()
+        if not dates:
+            return [], np.empty(0, dtype=np.int64), np.empty((window, 0)), np.empty((window, 0))
+        cutoff = dates[-1][0]
+        # 每只股票自己的最后 window 根 K 线（而不是最近若干个交易日），与列式存储的切片一致
+        df = pd.read_sql_query(f"""
+            SELECT ts_code, trade_date, close, vol FROM (
+                SELECT ts_code, trade_date, close, vol,
+                       ROW_NUMBER() OVER (PARTITION BY ts_code ORDER BY trade_date DESC) AS bar_no
+                FROM {table}
+                WHERE ts_code IN (SELECT DISTINCT ts_code FROM {table} WHERE trade_date >= ? {as_of_sql})
+                  {as_of_sql}
+            )
+            WHERE bar_no <= ?
+            ORDER BY ts_code ASC, trade_date ASC
+        """, conn, params=(cutoff,) + params + params + (window,))
+
+    codes, starts, counts = np.unique(df['ts_code'].astype(str).to_numpy(), return_index=True, return_counts=True)
+    group = np.repeat(np.arange(len(codes)), counts)
+    # 每行在该股票中距最后一根 K 线的距离，0 为最后一根
+    from_end = np.repeat(starts + counts, counts) - 1 - np.arange(len(df))
+    keep = from_end < window
+    rows = window - 1 - from_end[keep]
+    close = np.full((window, len(codes)), np.nan)
+    vol = np.full((window, len(codes)), np.nan)
+    close[rows, group[keep]] = pd.to_numeric(df['close'], errors='coerce').to_numpy(dtype=np.float64)[keep]
+    vol[rows, group[keep]] = pd.to_numeric(df['vol'], errors='coerce').to_numpy(dtype=np.float64)[keep]
+    last_dates = df['trade_date'].astype(str).to_numpy()[starts + counts - 1].astype(np.int64)
+    return codes.tolist(), last_dates, close, vol
+
+
+def scan_technical(db_file=DB_FILE, table=DAILY_DATA_TABLE, window=TECH_WINDOW_BARS, as_of=None, params=None):
+    '''
+    全市场五步法扫描，返回 DataFrame，每只股票一行：
+      ts_code, tech_date（最后一根 K 线的日期）, cond1..cond5, entry（五个条件全部满足）,
+      exit_ma20 / exit_ma10（收盘价跌破对应均线）, rsi6, rsi13, ma240
+    '''
+    params = five_step_params(**(params or {}))
+    codes, last_dates, close, vol = load_trailing_bars(db_file, table, window, as_of)
+    result = pd.DataFrame({'ts_code': codes, 'tech_date': last_dates.astype(str)})
+    if not codes:
+        return result
+    sig = latest_signals(close, vol, params)
+    for name in CONDITION_COLUMNS + ('entry',):
+        result[name] = sig[name]
+    last_close = close[-1]
+    for period in EXIT_MAS:
+        ma = rolling_sma(close, period)[-1]
+        with np.errstate(invalid='ignore'):
+            result[f'exit_ma{period}'] = last_close < ma
+    result[f"rsi{params['rsi_fast']}"] = sig['rsi_fast']
+    result[f"rsi{params['rsi_slow']}"] = sig['rsi_slow']
+    result[f"ma{params['ma_long']}"] = sig['ma_long']
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='全市场五步法技术面扫描')
+    parser.add_argument('db_file', nargs='?', default=DB_FILE)
+    parser.add_argument('--table', default=DAILY_DATA_TABLE)
+    parser.add_argument('--date', default=None, help='扫描日期 YYYYMMDD，默认为最新')
+    parser.add_argument('--window', type=int, default=TECH_WINDOW_BARS)
+    parser.add_argument('--out', default=None, help='把扫描结果写入 CSV')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    result = scan_technical(args.db_file, args.table, args.window, args.date)
+    elapsed = time.perf_counter() - t0
+    entries = result[result['entry']] if len(result) else result
+    print(f"信息: 扫描 {len(result)} 只股票，用时 {elapsed:.2f} 秒，五步全满足 {len(entries)} 只")
+    for code, date in zip(entries['ts_code'], entries['tech_date']):
+        print(f"  {code}  {date}")
+    if args.out:
+        result.to_csv(args.out, index=False, encoding='utf-8-sig')
+        print(f"信息: 扫描结果已写入 {args.out}")
+    sys.stdout.flush()
@@ -0,0 +1,203 @@
+'''
+全市场回测（内存受限）
+
+在全部约 5000 只股票上运行五步法组合回测，内存占用不超过给定预算：
+  - 信号按股票分块计算：每只股票的指标只依赖它自己的 K 线，每块股票读入、对齐到交易日历、
+    计算五步法条件后，只保留开盘价、收盘价和买卖信号四个 (交易日 x 股票) 数组，
+    其余指标和中间结果随块释放；块的大小由内存预算和交易日数决定；
+  - 组合按 vector_sim.simulate 逐日模拟（规则与 chatgpt_stratege.MyStrategy 相同）；
+    与 backtrader 不同，不等待所有股票都攒够 240 根 K 线才开始，
+    每只股票自己的均线就绪后即可交易，一只新上市的股票不会推迟整个回测；
+  - 不绘制逐只股票的图；交易记录在模拟过程中分批写入 trades.csv（result_writers），
+    不在内存中累积，每日资产在结束后逐行写入 CSV。
+
+内存预算只计算本模块分配的数组（不含 Python 解释器和已导入的库），
+常驻数组超出预算时直接报错，而不是在运行中途耗尽内存。
+命令行运行时关闭 SQLite 的内存映射读取：映射的数据库页面计入常驻内存，
+每个连接最多 db_access.MMAP_SIZE（256 MB），在全市场数据库上会超过信号数组本身。
+
+命令行用法：
+    python universe_backtest.py --db daily_data.db --start 20210101 --budget-mb 1024
+    python universe_backtest.py --pool stock_pool.csv --out-dir universe_results
+'''
+import argparse
+import csv
+import os
+import resource
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import db_access
+from calendar_panel import align_to_calendar, trading_calendar
+from result_writers import CsvRecordWriter
+from signals import FIVE_STEP_PARAMS, compute_five_step
+from universe_loader import load_universe
+from vector_sim import (DAILY_DATA_TABLE, DB_FILE, INITIAL_CASH, all_codes, build_report, last_trade_date,
+                        simulate)
+
+# --- 配置参数 ---
+MEMORY_BUDGET_MB = 1024
+UNIVERSE_OUT_DIR = 'universe_results'
+MIN_CHUNK_STOCKS = 50
+UNIVERSE_MMAP_SIZE = 0  # 命令行运行时 SQLite 连接的内存映射字节数
+# 每个 (交易日 x 股票) 单元格的字节数（实测值留有余量）
+SIGNAL_BYTES_PER_CELL = 256  # 一块股票计算信号时的峰值：行情、紧凑排列、各指标和条件矩阵
+RESIDENT_BYTES_PER_CELL = 18  # 常驻：开盘价、收盘价（float64）和买卖信号（bool）
+SIMULATE_BYTES_PER_CELL = 48  # simulate 内部：K 线计数、最后行号、排序后的开盘价等
+TRADE_COLUMNS = ('日期', '股票', '方向', '价格', '数量')  # 与 vector_sim.simulate 的交易记录相同
+
+
+def peak_rss_mb():
+    '''本进程的峰值常驻内存（MB，Linux 上 ru_maxrss 以 KB 计）。'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def plan_chunks(n_dates, n_codes, budget_mb=MEMORY_BUDGET_MB):
+    '''按内存预算决定每块的股票数；常驻数组已超出预算时抛出 MemoryError。'''
+    budget = budget_mb * 1024 * 1024
+    resident = n_dates * n_codes * (RESIDENT_BYTES_PER_CELL + SIMULATE_BYTES_PER_CELL)
+    spare = budget - resident
+    per_stock = max(n_dates, 1) * SIGNAL_BYTES_PER_CELL
+    if spare < per_stock * MIN_CHUNK_STOCKS:
+        need = (resident + per_stock * MIN_CHUNK_STOCKS) / 1024 / 1024
+        raise MemoryError(f"内存预算 {budget_mb} MB 不足：{n_codes} 只股票 x {n_dates} 个交易日至少需要约 "
+                          f"{need:.0f} MB，请提高 --budget-mb 或缩短回测区间")
+    return max(MIN_CHUNK_STOCKS, min(n_codes, int(spare // per_stock)))
+
+
+def compute_universe_signals(codes, fromdate, todate, db_file=DB_FILE, table=DAILY_DATA_TABLE,
+                             params=None, budget_mb=MEMORY_BUDGET_MB):
+    '''
+    分块计算全部股票的五步法信号。
+    返回 (dates, codes, arrays, skipped)，arrays 为 open / close / entry / exit 四个 (交易日 x 股票) 数组。
+    '''
+    params = params or FIVE_STEP_PARAMS
+    calendar = trading_calendar(db_file, table, fromdate, todate)
+    codes = list(dict.fromkeys(codes))
+    chunk = plan_chunks(len(calendar), len(codes), budget_mb)
+
+    arrays = {'open': np.full((len(calendar), len(codes)), np.nan),
+              'close': np.full((len(calendar), len(codes)), np.nan),
+              'entry': np.zeros((len(calendar), len(codes)), dtype=bool),
+              'exit': np.zeros((len(calendar), len(codes)), dtype=bool)}
+    kept, skipped = np.zeros(len(codes), dtype=bool), {}
+    n_chunks = (len(codes) + chunk - 1) // chunk
+    for k, start in enumerate(range(0, len(codes), chunk), 1):
+        block = codes[start:start + chunk]
+        position = {code: start + i for i, code in enumerate(block)}
+        bars_by_code, block_skipped = load_universe(block, fromdate, todate, db_file=db_file, table=table,
+                                                    fields=('open', 'close', 'vol'))
+        skipped.update(block_skipped)
+        panel = align_to_calendar(bars_by_code, calendar, fields=('open', 'close', 'vol'))
+        del bars_by_code
+        sig = compute_five_step(panel.values['close'], panel.values['vol'], params)
+        cols = np.asarray([position[code] for code in panel.codes], dtype=np.int64)
+        arrays['open'][:, cols] = panel.values['open']
+        arrays['close'][:, cols] = panel.values['close']
+        arrays['entry'][:, cols] = sig['entry']
+        arrays['exit'][:, cols] = sig['exit']
+        kept[cols] = True
+        del panel, sig
+        print(f"信息: 信号 [{k}/{n_chunks}] 已完成 {min(start + chunk, len(codes))}/{len(codes)} 只股票，"
+              f"峰值内存 {peak_rss_mb():.0f} MB")
+        sys.stdout.flush()
+
+    # 区间内没有任何 K 线的股票不参与模拟（也不占用持仓名额 min(n, 5) 的 n）
+    keep = np.flatnonzero(kept)
+    if len(keep) < len(codes):
+        arrays = {name: values[:, keep] for name, values in arrays.items()}
+    return calendar, [codes[i] for i in keep], arrays, skipped
+
+
+def _write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+
+
+def write_universe_outputs(result, out_dir=UNIVERSE_OUT_DIR, initial_cash=INITIAL_CASH):
+    '''
+    逐行写出 equity.csv 和 trade_report.txt，返回报告字典。
+    交易记录为列表时（run_universe_backtest 没有给出 trades_csv）同时写出 trades.csv。
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    if isinstance(result['trades'], list):
+        with CsvRecordWriter(os.path.join(out_dir, 'trades.csv'), TRADE_COLUMNS, encoding='utf-8-sig') as writer:
+            for trade in result['trades']:
+                writer.append(trade)
+    start = result['start_row']
+    _write_csv(os.path.join(out_dir, 'equity.csv'), ['日期', '总资产'],
+               zip(result['dates'][start:].tolist(), result['equity'][start:].tolist()))
+    report = build_report(result, initial_cash)
+    report['股票数'] = str(len(result['codes']))
+    with open(os.path.join(out_dir, 'trade_report.txt'), 'w', encoding='utf-8') as f:
+        f.write("=== 全市场回测报告 ===\n")
+        for k, v in report.items():
+            f.write(f"{k}：{v}\n")
+    return report
+
+
+def run_universe_backtest(codes, fromdate, todate, db_file=DB_FILE, table=DAILY_DATA_TABLE, params=None,
+                          cash=INITIAL_CASH, budget_mb=MEMORY_BUDGET_MB, trades_csv=None):
+    '''
+    分块计算信号并模拟组合，返回 (result, skipped)。
+    给出 trades_csv 时交易记录在模拟过程中写入该文件，result['trades'] 为已关闭的写出器（只用于计数）。
+    '''
+    dates, codes, arrays, skipped = compute_universe_signals(codes, fromdate, todate, db_file, table,
+                                                             params, budget_mb)
+    writer = CsvRecordWriter(trades_csv, TRADE_COLUMNS, encoding='utf-8-sig') if trades_csv else None
+    try:
+        result = simulate(dates, codes, arrays['open'], arrays['close'], arrays['entry'], arrays['exit'],
+                          cash=cash, min_bars=0, trade_writer=writer)
+    finally:
+        if writer is not None:
+            writer.close()
+    result['codes'] = codes
+    return result, skipped
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='全市场五步法回测（内存受限）')
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--table', default=DAILY_DATA_TABLE)
+    parser.add_argument('--pool', default=None, help='股票池 CSV，默认为数据库中的全部股票')
+    parser.add_argument('--limit', type=int, default=None, help='只取前 N 只股票')
+    parser.add_argument('--start', default='20220101')
+    parser.add_argument('--end', default=None, help='默认为数据库最后一个交易日')
+    parser.add_argument('--budget-mb', type=int, default=MEMORY_BUDGET_MB)
+    parser.add_argument('--out-dir', default=UNIVERSE_OUT_DIR)
+    args = parser.parse_args()
+    db_access.MMAP_SIZE = UNIVERSE_MMAP_SIZE
+
+    if args.pool:
+        codes = pd.read_csv(args.pool)['ts_code'].dropna().tolist()
+    else:
+        codes = all_codes(args.db, args.table)
+    codes = codes[:args.limit] if args.limit else codes
+    fromdate = datetime.strptime(args.start, '%Y%m%d')
+    todate = datetime.strptime(args.end, '%Y%m%d') if args.end else last_trade_date(args.db, args.table)
+
+    print(f"开始全市场回测: {len(codes)} 只股票, {fromdate:%Y-%m-%d} - {todate:%Y-%m-%d}, 内存预算 {args.budget_mb} MB")
+    sys.stdout.flush()
+    t0 = time.perf_counter()
+    os.makedirs(args.out_dir, exist_ok=True)
+    try:
+        result, skipped = run_universe_backtest(codes, fromdate, todate, args.db, args.table,
+                                                budget_mb=args.budget_mb,
+                                                trades_csv=os.path.join(args.out_dir, 'trades.csv'))
+    except MemoryError as e:
+        print(f"错误: {e}")
+        sys.exit(1)
+    if skipped:
+        print(f"警告: 跳过 {len(skipped)} 只股票（数据不足或区间不重叠）")
+    report = write_universe_outputs(result, args.out_dir)
+    for k, v in report.items():
+        print(f"{k}：{v}")
+    print(f"信息: 用时 {time.perf_counter() - t0:.1f} 秒，峰值内存 {peak_rss_mb():.0f} MB，结果已写入 {args.out_dir}")
+    sys.stdout.flush()
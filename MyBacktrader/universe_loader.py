@@ -0,0 +1,224 @@
+'''
+股票池批量加载
+
+load_universe 一次性加载选定股票在日期范围内的全部日线：
+  - 列式存储（bar_store）与数据库一致时直接取切片；
+  - 否则按 ts_code 分块执行少量 IN (...) 查询，按股票拆分为列数组。
+加载前先查覆盖目录表（每只股票的首末交易日和行数），
+不在区间内或历史过短的股票直接跳过，不再对 daily_data 逐只 COUNT(*)。
+加载只使用只读连接：覆盖目录由写入日线的一方维护（daily_ingest 下载后刷新，
+或手动运行 python universe_loader.py）；目录缺失或与日线表不一致时改为直接按股票统计。
+目录记录统计时日线表的写入版本（change_tracking），判断是否最新只需按主键查两行，
+不再每次加载都对日线表 COUNT(*)；按原日期覆盖或修改已有行同样会改变版本。
+'''
+import sqlite3
+import sys
+
+import numpy as np
+
+from bar_store import date_to_int, get_shared_store
+from change_tracking import changed_codes, ensure_tracking, table_version
+from db_access import read_connection, write_connection
+from numpy_feed import bars_from_rows
+
+# --- 配置参数 ---
+DB_FILE = 'daily_data.db'
+DAILY_DATA_TABLE = 'daily_data'
+COVERAGE_TABLE = 'daily_coverage'
+COVERAGE_META_TABLE = 'daily_coverage_meta'
+IN_CHUNK = 500  # 每个 IN (...) 查询的代码数，低于旧版 SQLite 999 个参数的上限
+
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'vol')
+
+
+def _create_coverage_tables(conn, table):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {COVERAGE_TABLE} (
+            ts_code TEXT PRIMARY KEY,
+            first_date TEXT,
+            last_date TEXT,
+            row_count INTEGER
+        )
+    """)
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({COVERAGE_META_TABLE})")}
+    if columns and 'data_version' not in columns:
+        # 旧版目录按最后交易日和行数判断是否最新，换成写入版本后全量重建
+        conn.execute(f"DROP TABLE {COVERAGE_META_TABLE}")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {COVERAGE_META_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            data_version INTEGER
+        )
+    """)
+    # 按交易日的索引让 MAX(trade_date) 不必扫描全表
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_trade_date ON {table} (trade_date)")
+    conn.commit()
+
+
+def refresh_coverage_catalog(conn, table=DAILY_DATA_TABLE, rebuild=False):
+    '''
+    维护覆盖目录表（需要写连接），同时在日线表上建立写入版本跟踪（change_tracking）。
+    首次、rebuild=True 或记录的版本不可比较时全量统计；
+    之后只重新统计上次以来有过插入、修改或删除的股票（按主键索引逐只统计）。
+    返回本次统计的股票数（0 表示目录已是最新）。
+    '''
+    _create_coverage_tables(conn, table)
+    ensure_tracking(conn, table)
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")  # 版本号与统计的行来自同一个快照，期间不会有其他写入
+        data_version = table_version(conn, table)
+        meta = conn.execute(f"SELECT data_version FROM {COVERAGE_META_TABLE} WHERE table_name = ?",
+                            (table,)).fetchone()
+        last_version = None if meta is None or rebuild else meta[0]
+        if last_version is not None and last_version <= data_version:
+            codes = changed_codes(conn, table, last_version)
+            _recount_codes(conn, table, codes)
+            n = len(codes)
+        else:
+            conn.execute(f"DELETE FROM {COVERAGE_TABLE}")
+            n = conn.execute(f"""
+                INSERT INTO {COVERAGE_TABLE} (ts_code, first_date, last_date, row_count)
+                SELECT ts_code, MIN(trade_date), MAX(trade_date), COUNT(*)
+                FROM {table}
+                GROUP BY ts_code
+            """).rowcount
+        conn.execute(f"INSERT OR REPLACE INTO {COVERAGE_META_TABLE} VALUES (?, ?)", (table, data_version))
+    return n
+
+
+def _recount_codes(conn, table, codes):
+    '''重新统计指定股票的首末交易日和行数，已没有数据的股票从目录中删除。'''
+    for i in range(0, len(codes), IN_CHUNK):
+        chunk = codes[i:i + IN_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        conn.execute(f"DELETE FROM {COVERAGE_TABLE} WHERE ts_code IN ({placeholders})", chunk)
+        conn.execute(f"""
+            INSERT INTO {COVERAGE_TABLE} (ts_code, first_date, last_date, row_count)
+            SELECT ts_code, MIN(trade_date), MAX(trade_date), COUNT(*)
+            FROM {table}
+            WHERE ts_code IN ({placeholders})
+            GROUP BY ts_code
+        """, chunk)
+
+
+def catalog_is_current(conn, table=DAILY_DATA_TABLE):
+    '''覆盖目录存在，且记录的写入版本与日线表当前的版本相同（只读查询，按主键查两行）。'''
+    data_version = table_version(conn, table)
+    if data_version is None:
+        return False
+    try:
+        meta = conn.execute(f"SELECT data_version FROM {COVERAGE_META_TABLE} WHERE table_name = ?",
+                            (table,)).fetchone()
+    except sqlite3.OperationalError:  # 目录不存在或是旧版目录
+        return False
+    return meta is not None and meta[0] == data_version
+
+
+_stale_warned = set()
+
+
+def get_coverage(conn, ts_codes, table=DAILY_DATA_TABLE):
+    '''
+    返回 {ts_code: (first_date, last_date, row_count)}，没有数据的股票不出现在结果里。
+    只读取、不刷新覆盖目录；目录不是最新时直接对这些股票做 GROUP BY 统计。
+    '''
+    if catalog_is_current(conn, table):
+        sql = (f"SELECT ts_code, first_date, last_date, row_count FROM {COVERAGE_TABLE} "
+               f"WHERE ts_code IN ({{}})")
+    else:
+        if table not in _stale_warned:
+            _stale_warned.add(table)
+            print(f"警告: 覆盖目录缺失或不是最新，直接统计 {table}（运行 python universe_loader.py 可重建目录）")
+            sys.stdout.flush()
+        sql = (f"SELECT ts_code, MIN(trade_date), MAX(trade_date), COUNT(*) FROM {table} "
+               f"WHERE ts_code IN ({{}}) GROUP BY ts_code")
+    coverage = {}
+    codes = list(ts_codes)
+    for i in range(0, len(codes), IN_CHUNK):
+        chunk = codes[i:i + IN_CHUNK]
+        for code, first, last, count in conn.execute(sql.format(','.join('?' * len(chunk))), chunk):
+            coverage[code] = (first, last, count)
+    return coverage
+
+
+def _split_by_code(rows, fields):
+    '''按 ts_code 已排序的查询结果 -> {ts_code: 列数组字典}。'''
+    if not rows:
+        return {}
+    codes = np.asarray([row[0] for row in rows], dtype=object)
+    bars = bars_from_rows([row[1:] for row in rows], columns=('trade_date',) + tuple(fields))
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)]
+    return {codes[s]: {name: col[s:e] for name, col in bars.items()} for s, e in zip(starts, ends)}
+
+
+def _load_from_db(conn, codes, fromdate, todate, table, fields):
+    result = {}
+    from_str, to_str = str(date_to_int(fromdate)), str(date_to_int(todate))
+    for i in range(0, len(codes), IN_CHUNK):
+        chunk = codes[i:i + IN_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(f"""
+            SELECT ts_code, trade_date, {', '.join(fields)}
+            FROM {table}
+            WHERE ts_code IN ({placeholders}) AND trade_date BETWEEN ? AND ?
+            ORDER BY ts_code ASC, trade_date ASC
+        """, (*chunk, from_str, to_str)).fetchall()
+        result.update(_split_by_code(rows, fields))
+    return result
+
+
+def load_universe(ts_codes, fromdate, todate, db_file=DB_FILE, table=DAILY_DATA_TABLE,
+                  min_bars=1, fields=BAR_FIELDS):
+    '''
+    批量加载股票池。
+
+    返回 (bars_by_code, skipped)：
+      bars_by_code  {ts_code: {'trade_date': ..., 'open': ..., ...}}，保持输入顺序
+      skipped       {ts_code: 跳过原因}
+    区间内行数少于 min_bars 的股票也会被跳过。
+    '''
+    from_int, to_int = date_to_int(fromdate), date_to_int(todate)
+    codes = list(dict.fromkeys(ts_codes))  # 去重并保持顺序
+    skipped = {}
+
+    with read_connection(db_file) as conn:
+        coverage = get_coverage(conn, codes, table)
+    candidates = []
+    for code in codes:
+        cov = coverage.get(code)
+        if cov is None:
+            skipped[code] = '数据库中无此股票'
+        elif int(cov[1]) < from_int or int(cov[0]) > to_int:
+            skipped[code] = f'数据区间 {cov[0]}-{cov[1]} 与回测区间不重叠'
+        elif cov[2] < min_bars:
+            skipped[code] = f'历史数据仅 {cov[2]} 条，少于 {min_bars} 条'
+        else:
+            candidates.append(code)
+
+    store = get_shared_store(db_file)
+    if store is not None and store.meta.get('table') == table:
+        loaded = {code: store.get(code, fromdate, todate, fields=('trade_date',) + tuple(fields))
+                  for code in candidates if code in store}
+    else:
+        with read_connection(db_file) as conn:
+            loaded = _load_from_db(conn, candidates, fromdate, todate, table, fields)
+
+    bars_by_code = {}
+    for code in candidates:
+        bars = loaded.get(code)
+        count = 0 if bars is None else len(bars['trade_date'])
+        if count < max(min_bars, 1):
+            skipped[code] = f'回测区间内仅 {count} 条数据'
+            continue
+        bars_by_code[code] = bars
+    return bars_by_code, skipped
+
+
+if __name__ == '__main__':
+    # 重建覆盖目录：python universe_loader.py [db_file] [table]
+    db_file = sys.argv[1] if len(sys.argv) > 1 else DB_FILE
+    table = sys.argv[2] if len(sys.argv) > 2 else DAILY_DATA_TABLE
+    with write_connection(db_file) as conn:
+        n = refresh_coverage_catalog(conn, table, rebuild=True)
+    print(f"信息: 覆盖目录已重建，统计 {n} 只股票")
@@ -0,0 +1,77 @@
+'''
+按信号裁剪回测股票池
+
+股票池中的大多数股票在整个回测区间内一次也不满足五个买入条件，却仍被加载为数据源，
+由 backtrader 逐根 K 线同步和推进。这里在加入 cerebro 之前先用 signals.compute_five_step
+向量化计算全部股票的买入信号，只把可能买入的股票加入为数据源，回测结果与不裁剪时相同：
+  - 策略从所有数据源都满 240 根 K 线（最小周期）的那根 K 线开始调用 next()，
+    保留最晚满足最小周期的一只股票作为时钟数据源，开始日期不变；
+  - 从开始日期起（含开始时仍停牌、沿用之前 K 线的情况）出现过买入信号的股票全部保留，
+    从未出现买入信号的股票不会买入，也就不会持仓、卖出或占用资金，去掉后不影响其他股票；
+  - backtrader 的时钟是全部数据源 K 线日期的并集，保留的股票没有覆盖的日期再补几只股票覆盖，
+    每日资产、最大回撤和夏普比率因此也与不裁剪时相同；
+  - 向量化计算的 RSI 与策略逐根计算的结果可能有舍入差异，
+    判断信号时 RSI 阈值放宽 PRUNE_RSI_MARGIN，宁可多保留也不漏掉边界上的股票；
+  - 数据库中区间内没有数据的股票（load_universe 跳过的）原样保留，由策略脚本按原来的方式处理。
+持仓上限依赖股票数的策略（MyStrategy 的 min(n, 5)、grok 的 MyMultiStockStrategy 的 min(max_positions, n)）
+需要传入裁剪前的股票数（pool_size 参数）。
+
+一致性校验：python parity_check.py pruning
+'''
+import numpy as np
+
+from calendar_panel import align_to_calendar
+from signals import FIVE_STEP_PARAMS, compute_five_step
+from vector_sim import strategy_minperiod
+
+# --- 配置参数 ---
+PRUNE_RSI_MARGIN = 1e-6
+
+
+def prune_universe(codes, bars_by_code, params=None):
+    '''
+    codes         裁剪前的股票池（决定数据源顺序）
+    bars_by_code  load_universe 加载的 {ts_code: 列数组字典}，需要 trade_date / close / vol
+    返回 (kept, clock)：kept 为保留的股票代码（保持 codes 中的顺序），clock 为时钟数据源（可能为 None）。
+    kept 中除出现买入信号的股票外，还有时钟数据源和补齐日历的股票。
+    '''
+    params = params or FIVE_STEP_PARAMS
+    codes = list(dict.fromkeys(codes))
+    loaded = [code for code in codes if code in bars_by_code]
+    if not loaded:
+        return codes, None
+
+    # 日历取各股票 K 线日期的并集，与 backtrader 同步多个数据源时的时钟相同
+    calendar = np.unique(np.concatenate([np.asarray(bars_by_code[c]['trade_date'], dtype=np.int32)
+                                         for c in loaded]))
+    panel = align_to_calendar({c: bars_by_code[c] for c in loaded}, calendar, fields=('close', 'vol'))
+    relaxed = dict(params, rsi_fast_min=params['rsi_fast_min'] - PRUNE_RSI_MARGIN,
+                   rsi_slow_min=params['rsi_slow_min'] - PRUNE_RSI_MARGIN)
+    entry = compute_five_step(panel.values['close'], panel.values['vol'], relaxed)['entry']
+
+    # 每只股票满足最小周期的行；有股票始终不满足时策略不会调用 next()，只保留时钟数据源
+    min_bars = strategy_minperiod(params)
+    bar_count = np.cumsum(panel.present, axis=0)
+    ready = bar_count[-1] >= min_bars
+    ready_row = np.where(ready, np.argmax(bar_count >= min_bars, axis=0), len(calendar))
+    clock = loaded[int(np.argmax(ready_row))]
+    start_row = int(ready_row.max())
+
+    signaled = set()
+    if start_row < len(calendar):
+        first_row = np.maximum(panel.last_row()[start_row], 0)
+        rows = np.arange(len(calendar))[:, None]
+        hits = (entry & (rows >= first_row[None, :])).any(axis=0)
+        signaled = {loaded[j] for j in np.flatnonzero(hits)}
+    keep = np.array([code in signaled or code == clock for code in loaded])
+
+    # 补齐日历：每次加入覆盖剩余日期最多的股票，直到并集与裁剪前相同
+    uncovered = ~panel.present[:, keep].any(axis=1)
+    while uncovered.any():
+        j = int(np.argmax(np.where(keep, -1, panel.present[uncovered].sum(axis=0))))
+        keep[j] = True
+        uncovered &= ~panel.present[:, j]
+
+    kept_loaded = {loaded[j] for j in np.flatnonzero(keep)}
+    kept = [code for code in codes if code not in bars_by_code or code in kept_loaded]
+    return kept, clock
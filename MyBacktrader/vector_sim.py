@@ -0,0 +1,310 @@
+'''
+向量化组合回测
+
+在预先计算好的信号矩阵（signals.compute_five_step）上逐日模拟 chatgpt_stratege.py 中
+MyStrategy 的持仓与下单规则，以及 backtrader 默认撮合器的行为，输出资产曲线、
+交易记录和 trade_report.txt 中的各项指标。
+
+复现的规则：
+  - 最多持仓 p = min(n, 5)；每个买入信号分配 当日现金 * 1/(p-m)，m 为当日开始时的持仓数，
+    同一天的多个买入信号使用同一个 m 和同一份现金；
+  - 数量 = 金额 / 下一根 K 线开盘价，向下取整到 100 股；
+  - 市价单在该股票的下一根 K 线开盘价成交（停牌则等到复牌），手续费 0.0003；
+  - 提交时按信号日收盘价逐单预扣资金，不足则保证金拒单；成交时现金不足同样拒单。
+    原策略的 notify_order 不处理 Margin 状态，被拒单的股票此后不再交易，这里保持一致；
+  - 停牌日沿用该股票最后一根 K 线的指标和收盘价；
+  - 所有股票的 K 线数都达到指标最小周期后策略才开始运行；
+  - 最大回撤与夏普比率（按年收益、无风险利率 1%）的算法与 backtrader 的分析器相同。
+与原策略的差异：股票最后一根 K 线上出现买入信号时原策略因 data.open[1] 越界而中止，
+这里跳过该信号并计入 skipped_signals。
+
+命令行用法：
+    python vector_sim.py                      # 使用 stock_pool.csv 中的股票
+    python vector_sim.py --all --db daily_data.db
+'''
+import argparse
+import math
+import sys
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from calendar_panel import load_dense_panel
+from db_access import fetch_all, max_trade_date
+from signals import FIVE_STEP_PARAMS, compute_five_step
+
+# --- 配置参数 ---
+DB_FILE = 'daily_data.db'
+DAILY_DATA_TABLE = 'daily_data'
+STOCK_POOL_CSV = 'stock_pool.csv'
+TRADE_LOG_CSV = 'trades.csv'
+REPORT_TXT = 'trade_report.txt'
+
+INITIAL_CASH = 300000.0
+COMMISSION = 0.0003
+MAX_POSITIONS = 5
+LOT_SIZE = 100
+RISK_FREE_RATE = 0.01
+
+# 订单状态：空闲 / 已提交未成交 / 被拒单后永久占用
+_FREE, _PENDING, _BLOCKED = 0, 1, 2
+
+
+def strategy_minperiod(params=None):
+    '''backtrader 中策略开始调用 next 所需的每只股票最少 K 线数。'''
+    p = params or FIVE_STEP_PARAMS
+    return max(p['ma_long'], p['ma_mid'], p['ma_short'], p['exit_ma'],
+               p['rsi_fast'] + 1, p['rsi_slow'] + 1, p['vol_fast'], p['vol_slow'])
+
+
+def _sharpe_ratio(year_returns, riskfreerate=RISK_FREE_RATE):
+    '''与 bt.analyzers.SharpeRatio 默认参数（按年、总体标准差）相同的计算。'''
+    returns = list(year_returns.values())
+    rate = pow(1.0 + riskfreerate, 1.0 / 1) - 1.0
+    ratio = None
+    if returns:
+        ret_free = [r - rate for r in returns]
+        avg = math.fsum(ret_free) / len(ret_free)
+        dev = math.sqrt(math.fsum([pow(y - avg, 2.0) for y in ret_free]) / len(ret_free))
+        try:
+            ratio = avg / dev
+        except ZeroDivisionError:
+            ratio = None
+    return OrderedDict([('sharperatio', ratio)])
+
+
+def simulate(dates, codes, open_, close, entry, exit_, cash=INITIAL_CASH, commission=COMMISSION,
+             max_positions=MAX_POSITIONS, lot_size=LOT_SIZE, min_bars=None, trade_writer=None):
+    '''
+    逐日模拟组合。
+
+    dates 为 YYYYMMDD 整数数组，open_/close/entry/exit_ 为 (日期 x 股票) 数组，
+    close 为 NaN 表示当日无 K 线；codes 的顺序即 backtrader 中 datas 的顺序。
+    trade_writer 为 result_writers 的写出器时交易记录边模拟边写出（由调用方关闭），None 时保存在列表中。
+    返回字典：dates、equity（每日总资产）、trades（与 MyStrategy.trade_log 相同的记录，或 trade_writer）、
+    final_value、max_drawdown、sharpe、year_returns、start_row、skipped_signals。
+    '''
+    dates = np.asarray(dates)
+    n_dates, n_codes = close.shape
+    present = ~np.isnan(close)
+    cols = np.arange(n_codes)
+    if min_bars is None:
+        min_bars = strategy_minperiod()
+
+    # 每个日期对应的最后一根 K 线行号（停牌日沿用）、当前 K 线数 len(data)
+    last_row = np.maximum.accumulate(np.where(present, np.arange(n_dates)[:, None], -1), axis=0)
+    bar_count = np.cumsum(present, axis=0)
+    n_bars = bar_count[-1] if n_dates else np.zeros(n_codes, dtype=np.int64)
+    # 按 K 线序号排列的开盘价，open_compact[len(data)] 即 data.open[1]
+    order = np.argsort(~present, axis=0, kind='stable')
+    open_compact = np.take_along_axis(open_, order, axis=0)
+    ready = (bar_count >= min_bars).all(axis=1)
+    start_row = int(np.argmax(ready)) if ready.any() else n_dates
+
+    p = min(n_codes, max_positions)
+    size = np.zeros(n_codes, dtype=np.int64)
+    cost = np.zeros(n_codes)
+    state = np.zeros(n_codes, dtype=np.int8)
+    submitted, pending = [], []
+    trades = trade_writer if trade_writer is not None else []
+    skipped_signals = 0
+
+    equity = np.empty(n_dates)
+    max_value, max_drawdown = float('-inf'), 0.0
+    year_returns, cur_year, value_start, last_value = OrderedDict(), None, 0.0, cash
+
+    for t in range(n_dates):
+        # 1) 检查上一交易日提交的订单：按信号日收盘价依次预扣资金
+        if submitted:
+            pcash = cash
+            for o in submitted:
+                if o['buy']:
+                    pcash -= o['size'] * o['price']
+                    pcash -= abs(o['size']) * commission * o['price']
+                else:
+                    pcash += o['size'] * o['price']
+                    pcash -= abs(-o['size']) * commission * o['price']
+                if pcash >= 0.0:
+                    pending.append(o)
+                else:
+                    state[o['j']] = _BLOCKED
+            submitted = []
+
+        # 2) 有新 K 线的股票按开盘价成交
+        if pending:
+            waiting = []
+            for o in pending:
+                j = o['j']
+                if not present[t, j]:
+                    waiting.append(o)
+                    continue
+                px = float(open_[t, j])
+                if o['buy']:
+                    c = cash - o['size'] * px
+                    c -= abs(o['size']) * commission * px
+                    if c < 0.0:
+                        state[j] = _BLOCKED
+                        continue
+                    cash = c
+                    size[j], cost[j] = o['size'], px
+                    executed = o['size']
+                else:
+                    s, pp = int(size[j]), float(cost[j])
+                    pnl = s * (px - pp) * 1.0
+                    cash += s * pp + pnl
+                    cash -= abs(-s) * commission * px
+                    size[j], cost[j] = 0, 0.0
+                    executed = -s
+                state[j] = _FREE
+                trades.append({
+                    '日期': datetime.strptime(str(dates[t]), '%Y%m%d').strftime('%Y-%m-%d'),
+                    '股票': codes[j],
+                    '方向': '买入' if o['buy'] else '卖出',
+                    '价格': round(px, 2),
+                    '数量': int(executed),
+                })
+            pending = waiting
+
+        # 3) 当日总资产：持仓按最后收盘价计值
+        lr = last_row[t]
+        pos_value = 0.0
+        for j in np.flatnonzero(size):
+            s, c = int(size[j]), float(close[lr[j], j])
+            dvalue = s * c
+            dunrealized = s * (c - cost[j]) * 1.0
+            if dvalue > 0:
+                dvalue -= dunrealized
+                pos_value += dvalue / 1.0
+                pos_value += dunrealized
+            else:
+                pos_value += dvalue
+        value = cash + pos_value
+        equity[t] = value
+
+        max_value = max(max_value, value)
+        max_drawdown = max(max_drawdown, 100.0 * (max_value - value) / max_value)
+        year = int(dates[t]) // 10000
+        if year != cur_year:
+            cur_year, value_start = year, last_value
+        year_returns[year] = (value / value_start) - 1.0
+        last_value = value
+
+        # 4) 策略：对每只空闲股票检查卖出 / 买入信号
+        if t < start_row:
+            continue
+        held = size != 0
+        m = int(np.count_nonzero(size > 0))
+        wants_exit = held & exit_[lr, cols]
+        wants_entry = ~held & entry[lr, cols] if m < p else np.zeros(n_codes, dtype=bool)
+        available_cash = cash
+        for j in np.flatnonzero((state == _FREE) & (wants_exit | wants_entry)):
+            signal_close = float(close[lr[j], j])
+            if held[j]:
+                submitted.append({'j': j, 'buy': False, 'size': int(size[j]), 'price': signal_close})
+                state[j] = _PENDING
+                continue
+            k = bar_count[t, j]
+            if k >= n_bars[j]:
+                skipped_signals += 1
+                continue
+            allocation = 1 / (p - m)
+            amount = available_cash * allocation
+            open_next = float(open_compact[k, j])
+            if math.isnan(open_next):
+                skipped_signals += 1
+                continue
+            buy_size = int((amount / open_next) // lot_size * lot_size)
+            if buy_size > 0:
+                submitted.append({'j': j, 'buy': True, 'size': buy_size, 'price': signal_close})
+                state[j] = _PENDING
+
+    return {
+        'dates': dates,
+        'equity': equity,
+        'trades': trades,
+        'final_value': float(equity[-1]) if n_dates else cash,
+        'max_drawdown': max_drawdown,
+        'sharpe': _sharpe_ratio(year_returns),
+        'year_returns': year_returns,
+        'start_row': start_row,
+        'skipped_signals': skipped_signals,
+    }
+
+
+def build_report(result, initial_cash=INITIAL_CASH):
+    '''与 chatgpt_stratege.run_backtest 写入 trade_report.txt 的字段相同。'''
+    final_value = result['final_value']
+    return {
+        '生成日期': datetime.today().strftime('%Y-%m-%d'),
+        '初始资金': f"{initial_cash:.0f} 元",
+        '期末资产': f"{final_value:.2f} 元",
+        '收益': f"{final_value - initial_cash:.2f} 元",
+        '年化收益率': '示意，需根据周期计算',
+        '最大回撤': f"{result['max_drawdown']:.2f}%",
+        '夏普比率': str(result['sharpe']),
+        '交易笔数': f"{len(result['trades'])}"
+    }
+
+
+def write_outputs(result, trade_log_csv=TRADE_LOG_CSV, report_txt=REPORT_TXT, initial_cash=INITIAL_CASH):
+    pd.DataFrame(result['trades']).to_csv(trade_log_csv, index=False)
+    report = build_report(result, initial_cash)
+    with open(report_txt, 'w', encoding='utf-8') as f:
+        f.write("=== 回测交易报告 ===\n")
+        for k, v in report.items():
+            f.write(f"{k}：{v}\n")
+    return report
+
+
+def run_vector_backtest(codes, fromdate, todate, db_file=DB_FILE, table=DAILY_DATA_TABLE,
+                        params=None, cash=INITIAL_CASH):
+    '''加载股票池（对齐到交易日历）、计算信号并模拟，返回 (result, skipped)。'''
+    params = params or FIVE_STEP_PARAMS
+    min_bars = strategy_minperiod(params)
+    # K 线不足最小周期的股票会让 backtrader 无法运行，这里直接跳过
+    panel, skipped = load_dense_panel(codes, fromdate, todate, db_file=db_file, table=table,
+                                      fields=('open', 'close', 'vol'), min_bars=min_bars)
+    values = panel.values
+    signals = compute_five_step(values['close'], values['vol'], params)
+    result = simulate(panel.dates, panel.codes, values['open'], values['close'], signals['entry'], signals['exit'],
+                      cash=cash, min_bars=min_bars)
+    result['codes'] = panel.codes
+    return result, skipped
+
+
+def last_trade_date(db_file, table):
+    last = max_trade_date(db_file, table)
+    return datetime.strptime(last, "%Y%m%d") if last else datetime.today()
+
+
+def all_codes(db_file, table):
+    return [row[0] for row in fetch_all(db_file, f"SELECT DISTINCT ts_code FROM {table} ORDER BY ts_code")]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='五步法向量化组合回测')
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--table', default=DAILY_DATA_TABLE)
+    parser.add_argument('--all', action='store_true', help='使用数据库中的全部股票')
+    parser.add_argument('--start', default='20220101')
+    parser.add_argument('--end', default=None, help='默认为数据库最后一个交易日')
+    args = parser.parse_args()
+
+    if args.all:
+        codes = all_codes(args.db, args.table)
+    else:
+        codes = pd.read_csv(STOCK_POOL_CSV)['ts_code'].dropna().tolist()
+    fromdate = datetime.strptime(args.start, '%Y%m%d')
+    todate = datetime.strptime(args.end, '%Y%m%d') if args.end else last_trade_date(args.db, args.table)
+
+    print(f"开始向量化回测: {len(codes)} 只股票, {fromdate:%Y-%m-%d} - {todate:%Y-%m-%d}")
+    sys.stdout.flush()
+    result, skipped = run_vector_backtest(codes, fromdate, todate, db_file=args.db, table=args.table)
+    if skipped:
+        print(f"警告: 跳过 {len(skipped)} 只股票（数据不足或区间不重叠）")
+    report = write_outputs(result)
+    for k, v in report.items():
+        print(f"{k}：{v}")
+    sys.stdout.flush()
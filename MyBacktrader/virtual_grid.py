@@ -0,0 +1,181 @@
+'''
+虚拟化表格（Tkinter Treeview）
+
+Treeview 中只保留可见窗口那么多行（约几十个 item），滚动时只改写这些 item 的值，
+因此刷新耗时与结果行数无关：
+  - 数据源 DataFrame 在 set_source 时为每一列预先排好序（位置索引数组，NaN 排在最后）；
+  - 筛选结果以行位置数组传入 show_rows，按列排序只需用成员掩码从预排序数组中取子序列（O(n)）；
+  - 每次只把可见窗口的行切片出来，用 pandas / numpy 的向量化操作格式化。
+点击列标题按该列排序，再次点击切换升序 / 降序。
+'''
+import tkinter as tk
+from tkinter import ttk
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_ROW_HEIGHT = 20
+WHEEL_ROWS = 3  # 鼠标滚轮每格滚动的行数
+
+
+def format_float(values, decimals=2, na='N/A'):
+    '''数值列 -> 固定小数位的字符串数组，NaN 显示为 na。'''
+    arr = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64)
+    return np.where(np.isnan(arr), na, np.char.mod(f'%.{decimals}f', arr))
+
+
+def format_text(values, na=''):
+    s = pd.Series(values)
+    return np.where(s.isna().to_numpy(), na, s.astype(str).to_numpy())
+
+
+def sorted_positions(df):
+    '''每一列的升序行位置数组（稳定排序，NaN 在最后）以及对应的 NaN 掩码。'''
+    df = df.reset_index(drop=True)
+    orders, nulls = {}, {}
+    for col in df.columns:
+        orders[col] = df[col].sort_values(kind='mergesort', na_position='last').index.to_numpy()
+        nulls[col] = df[col].isna().to_numpy()
+    return orders, nulls
+
+
+def ordered_rows(order, isnull, rows, n_source, descending=False):
+    '''从预排序的位置数组中取出属于 rows 的子序列；降序时 NaN 仍排在最后。'''
+    member = np.zeros(n_source, dtype=bool)
+    member[rows] = True
+    ordered = order[member[order]]
+    if descending:
+        nan = isnull[ordered]
+        ordered = np.concatenate([ordered[~nan][::-1], ordered[nan]])
+    return ordered
+
+
+class VirtualGrid:
+    '''
+    columns 为 [(列名, 标题, 宽度), ...]；formatters 为 {列名: 函数(Series) -> 字符串数组}，
+    未指定的列按文本显示。
+    '''
+
+    def __init__(self, parent, columns, formatters=None, height=20):
+        self.keys = [key for key, _, _ in columns]
+        self.titles = {key: title for key, title, _ in columns}
+        self.formatters = formatters or {}
+        self.frame = ttk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, columns=self.keys, show='headings', height=height)
+        for key, title, width in columns:
+            self.tree.heading(key, text=title, command=lambda k=key: self.sort_by(k))
+            self.tree.column(key, width=width, anchor='center')
+
+        self.vbar = ttk.Scrollbar(self.frame, orient='vertical', command=self._on_scrollbar)
+        self.hbar = ttk.Scrollbar(self.frame, orient='horizontal', command=self.tree.xview)
+        self.tree.configure(xscrollcommand=self.hbar.set)
+        self.tree.grid(row=0, column=0, sticky='nsew')
+        self.vbar.grid(row=0, column=1, sticky='ns')
+        self.hbar.grid(row=1, column=0, sticky='ew')
+        self.frame.grid_rowconfigure(0, weight=1)
+        self.frame.grid_columnconfigure(0, weight=1)
+
+        self.tree.bind('<Configure>', self._on_resize)
+        self.tree.bind('<MouseWheel>', self._on_wheel)
+        self.tree.bind('<Button-4>', self._on_wheel)
+        self.tree.bind('<Button-5>', self._on_wheel)
+
+        self.source = pd.DataFrame(columns=self.keys)
+        self.orders, self.nulls = {}, {}
+        self.rows = np.empty(0, dtype=np.int64)
+        self.view = self.rows
+        self.sort_key, self.descending = None, False
+        self.top = 0
+        self.visible = height
+        self.items = []
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def set_source(self, df):
+        '''设置数据源并预先为每一列排序；之后 show_rows 传入的是该数据源的行位置。'''
+        self.source = df.reset_index(drop=True)
+        self.orders, self.nulls = sorted_positions(self.source[[k for k in self.keys if k in self.source]])
+        self.show_rows(np.arange(len(self.source)))
+
+    def show_rows(self, rows):
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self._apply_sort()
+
+    def sort_by(self, key):
+        if key not in self.orders:
+            return
+        self.descending = not self.descending if key == self.sort_key else False
+        self.sort_key = key
+        for k in self.keys:
+            arrow = (' ▼' if self.descending else ' ▲') if k == key else ''
+            self.tree.heading(k, text=self.titles[k] + arrow)
+        self._apply_sort()
+
+    def _apply_sort(self):
+        if self.sort_key is None:
+            self.view = self.rows
+        else:
+            self.view = ordered_rows(self.orders[self.sort_key], self.nulls[self.sort_key], self.rows,
+                                     len(self.source), self.descending)
+        self.top = 0
+        self._render()
+
+    def _format_window(self, start, stop):
+        window = self.source.iloc[self.view[start:stop]]
+        columns = []
+        for key in self.keys:
+            values = window[key] if key in window else pd.Series([None] * len(window))
+            columns.append(self.formatters.get(key, format_text)(values))
+        return list(zip(*columns))
+
+    def _render(self):
+        n = len(self.view)
+        self.top = max(0, min(self.top, n - self.visible))
+        stop = min(self.top + self.visible, n)
+        count = stop - self.top
+        while len(self.items) < count:
+            self.items.append(self.tree.insert('', tk.END))
+        while len(self.items) > count:
+            self.tree.delete(self.items.pop())
+        for item, values in zip(self.items, self._format_window(self.top, stop)):
+            self.tree.item(item, values=values)
+        self.tree.selection_remove(self.tree.selection())
+        if n:
+            self.vbar.set(self.top / n, stop / n)
+        else:
+            self.vbar.set(0.0, 1.0)
+
+    def _scroll_to(self, top):
+        top = max(0, min(int(top), len(self.view) - self.visible))
+        if top != self.top:
+            self.top = top
+            self._render()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self._scroll_to(round(float(amount) * len(self.view)))
+        elif action == 'scroll':
+            step = self.visible if unit == 'pages' else 1
+            self._scroll_to(self.top + int(amount) * step)
+
+    def _on_wheel(self, event):
+        if event.num == 4:
+            direction = -1
+        elif event.num == 5:
+            direction = 1
+        else:
+            direction = -1 if event.delta > 0 else 1
+        self._scroll_to(self.top + direction * WHEEL_ROWS)
+        return 'break'
+
+    def _on_resize(self, event):
+        row_height, header = DEFAULT_ROW_HEIGHT, DEFAULT_ROW_HEIGHT + 5
+        if self.items:
+            bbox = self.tree.bbox(self.items[0])
+            if bbox:
+                header, row_height = bbox[1], bbox[3]
+        visible = max(1, (event.height - header) // row_height)
+        if visible != self.visible:
+            self.visible = visible
+            self._render()